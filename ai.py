@@ -4,6 +4,8 @@ from pymunk import Vec2d
 import gameobjects
 from collections import defaultdict, deque
 import maps
+import grid
+import planners
 
 # NOTE: use only 'map0' during development!
 
@@ -29,12 +31,24 @@ class Ai:
     boxes. 
     """
 
-    def __init__(self, tank,  game_objects_list, tanks_list, space, currentmap):
+    def __init__(self, tank, entities, space, currentmap, passability_grid=None, planner=None, targeting=None):
         self.tank               = tank
-        self.game_objects_list  = game_objects_list
-        self.tanks_list         = tanks_list
+        self.entities           = entities
         self.space              = space
         self.currentmap         = currentmap
+        # The grid is shared by all ais, create one if the game does not provide it.
+        if passability_grid is None:
+            passability_grid = grid.PassabilityGrid.from_map(currentmap)
+        self.grid               = passability_grid
+        # The planner gives the next tile towards the target, by default the
+        # distance fields (which can be shared by all ais).
+        if planner is None:
+            planner = grid.DistanceFields(passability_grid)
+        self.planner            = planner
+        # Line of sight queries, shared by all ais and computed once per tick.
+        if targeting is None:
+            targeting = Targeting(space, currentmap)
+        self.targeting          = targeting
         self.flag = None
         self.MAX_X = currentmap.width - 1 
         self.MAX_Y = currentmap.height - 1
@@ -44,6 +58,14 @@ class Ai:
         self.move_cycle = self.move_cycle_gen()
         self.update_grid_pos()
 
+    def rebind(self, tank):
+        """Makes the ai control a new tank, for instance when its tank has respawned."""
+        self.tank = tank
+        self.allow_metalbox = False
+        self.path = deque()
+        self.move_cycle = self.move_cycle_gen()
+        self.update_grid_pos()
+
     def update_grid_pos(self):
         """This should only be called in the beginning, or at the end of a move_cycle."""
         self.grid_pos = self.get_tile_of_position(self.tank.body.position)
@@ -55,27 +77,22 @@ class Ai:
 
     def maybe_shoot(self):
         """ 
-        Makes a raycast query in front of the tank. If another tank
-        or a wooden box is found, then we shoot. 
+        Looks at what is in front of the tank (a raycast query made by the
+        targeting service). If another tank or a wooden box is found, then we shoot. 
         """
-        # Get the diagonal of the map using pythagorean theroem
-        diagonal = ((self.currentmap.width**2) + (self.currentmap.height**2))
-        # Start in front of tank
-        start = self.tank.body.position[0]+(math.cos(self.tank.body.angle+math.radians(90)))*0.5, \
-                self.tank.body.position[1]+(math.sin(self.tank.body.angle+math.radians(90)))*0.5
-        # End is the longest possible distance from a tank to a boarder in the map.
-        end = self.tank.body.position[0]+(math.cos(self.tank.body.angle+math.radians(90)))* diagonal, \
-                self.tank.body.position[1]+(math.sin(self.tank.body.angle+math.radians(90)))* diagonal
-        object = self.space.segment_query_first(start, end, 0, pymunk.ShapeFilter())
+        # The tank would ignore the shot anyway, so don't look.
+        if not self.tank.can_shoot():
+            return
+        object = self.targeting.first_hit(self.tank)
 
         if object != None:
             if hasattr(object, 'shape'):
                 if hasattr(object.shape, 'parent'):
                     if isinstance(object.shape.parent, gameobjects.Tank):
-                        self.tank.shoot(self.space, self.game_objects_list)
+                        self.tank.shoot(self.space, self.entities)
                     elif isinstance(object.shape.parent, gameobjects.Box):
                         if object.shape.parent.destructable:
-                            self.tank.shoot(self.space, self.game_objects_list)
+                            self.tank.shoot(self.space, self.entities)
 
     def move_cycle_gen(self):
         """ 
@@ -84,14 +101,19 @@ class Ai:
         """ 
         while True:
             self.update_grid_pos()
-            shortest_path = self.find_shortest_path()
+            next_coord = self.find_next_tile()
+            # The path is still being planned, wait for it without moving.
+            if next_coord is planners.PENDING:
+                self.tank.stop_moving()
+                self.tank.stop_turning()
+                yield
+                continue
             # If no shortest path is found, allow metal boxes.
-            if not shortest_path:
+            if next_coord is None:
                 self.allow_metalbox = True
                 yield
                 continue # Start from the top of our cycle
             self.allow_metalbox = False
-            next_coord = shortest_path.popleft()
             yield
             target_angle = angle_between_vectors(self.tank.body.position, next_coord + Vec2d(0.5, 0.5))
             # Difference between the tanks angle and the target angle.
@@ -126,34 +148,29 @@ class Ai:
 
     move_cycle = move_cycle_gen
     
+    def find_next_tile(self):
+        """ 
+        Returns the next tile on a shortest path to the target, as given by our
+        planner (for instance a distance field to the target that all ais share).
+        Returns None if there is no path, and planners.PENDING if the planner
+        has not found it yet.
+        """
+        start = self.grid.index(*self.grid_pos.int_tuple)
+        target = self.grid.index(*self.get_target_tile().int_tuple)
+        next_index = self.planner.next_tile(start, target, self.allow_metalbox)
+        if next_index is None or next_index is planners.PENDING:
+            return next_index
+        return Vec2d(self.grid.coords(next_index))
+
     def find_shortest_path(self):
         """ 
-        A simple Breadth First Search using integer coordinates as our nodes.
-        Edges are calculated as we go, using an external function.
+        A simple Breadth First Search on the passability grid, using the
+        integer indices of the tiles as our nodes.
         """
-        shortest_path = []
-        start = self.grid_pos
-        queue = deque()
-        queue.append(start)
-        visited_nodes = set(start.int_tuple)
-        node_tree = {}
-
-        while len(queue) > 0:
-            node = queue.popleft()
-            if node == self.get_target_tile():
-                while node != start:
-                    shortest_path.append(node)
-                    parent = node_tree[node.int_tuple]
-                    node = parent
-                shortest_path.reverse()
-                return deque(shortest_path)
-            for neighbour in self.get_tile_neighbors(node):
-                if neighbour.int_tuple not in visited_nodes:
-                    queue.append(neighbour)
-                    node_tree[neighbour.int_tuple] = node
-                    visited_nodes.add(neighbour.int_tuple)
-
-        return deque(shortest_path)
+        start = self.grid.index(*self.grid_pos.int_tuple)
+        target = self.grid.index(*self.get_target_tile().int_tuple)
+        path = self.grid.bfs(start, target, self.allow_metalbox)
+        return deque(Vec2d(self.grid.coords(index)) for index in path)
             
     def get_target_tile(self):
         """ 
@@ -173,11 +190,8 @@ class Ai:
         where it is when the Ai object is initialized.
         """
         if self.flag is None:
-        # Find the flag in the game objects list
-            for obj in self.game_objects_list:
-                if isinstance(obj, gameobjects.Flag):
-                    self.flag = obj
-                    break
+        # Look up the flag in the entity store
+            self.flag = self.entities.flag
         return self.flag
 
     def get_tile_of_position(self, position_vector):
@@ -185,36 +199,104 @@ class Ai:
         x, y = position_vector
         return Vec2d(int(x), int(y))
 
-    def get_tile_neighbors(self, coord_vec):
-        """ 
-        Returns all bordering grid squares of the input coordinate.
-        A bordering square is only considered accessible if it is grass
-        or a wooden box.
-        """
-        neighbors = []  # Find the coordinates of the tiles' four neighbors
-        position = self.get_tile_of_position(coord_vec)
-        neighbors.append(position + Vec2d(-1, 0))
-        neighbors.append(position + Vec2d(1, 0))
-        neighbors.append(position + Vec2d(0, -1))
-        neighbors.append(position + Vec2d(0, 1))
 
-        return filter(self.filter_tile_neighbors, neighbors)
+SimpleAi = Ai # Legacy
 
 
-    def filter_tile_neighbors (self, coord):
-        """
-        Filters neighbor tiles. Grass and wooden box always returns true.
-        Metalbox only returns true if metalbox is allowed.
-        """
-        if coord[0] <= self.MAX_X and coord[0] >= 0 and coord[1] <= self.MAX_Y and coord[1] >= 0:
-            if self.currentmap.boxAt(int(coord[0]), int(coord[1])) == 0 or self.currentmap.boxAt(int(coord[0]), int(coord[1])) == 2:
-                return True
-            if self.currentmap.boxAt(int(coord[0]), int(coord[1])) == 3:
-                return self.allow_metalbox
-            else:
-                return False
-        
-        
+class Targeting:
+    """ 
+    Makes the raycast queries in front of the tanks for the ais. The rays of all
+    the tanks are cast in one batch at the start of a tick (see update), and the
+    results are kept for the rest of the tick, so that controllers of the same
+    tank share them. Tanks that can not shoot are skipped, and a ray stops at
+    the border of the map.
+    """
 
+    def __init__(self, space, currentmap):
+        self.space      = space
+        self.width      = currentmap.width
+        self.height     = currentmap.height
+        self.hits       = {}  # Tank -> result of the raycast query for the current tick.
+        self.raycasts   = 0   # Total number of raycast queries.
+        self.tick_raycasts = 0 # Number of raycast queries in the current tick.
 
-SimpleAi = Ai # Legacy
+    def update(self, tanks):
+        """Starts a new tick and casts the rays of all the tanks that can shoot."""
+        self.hits.clear()
+        self.tick_raycasts = 0
+        for tank in tanks:
+            if tank.can_shoot():
+                self.first_hit(tank)
+
+    def first_hit(self, tank):
+        """Returns the result of a raycast query in front of the tank (None if nothing is hit)."""
+        if tank not in self.hits:
+            self.hits[tank] = self.raycast(tank)
+        return self.hits[tank]
+
+    def raycast(self, tank):
+        self.raycasts += 1
+        self.tick_raycasts += 1
+        # Direction the tank is facing.
+        dx = math.cos(tank.body.angle + math.radians(90))
+        dy = math.sin(tank.body.angle + math.radians(90))
+        # Start in front of tank
+        x = tank.body.position[0] + dx * 0.5
+        y = tank.body.position[1] + dy * 0.5
+        # End where the ray leaves the map.
+        length = self.ray_length(x, y, dx, dy)
+        if length <= 0:
+            return None
+        end = x + dx * length, y + dy * length
+        return self.space.segment_query_first((x, y), end, 0, pymunk.ShapeFilter())
+
+    def ray_length(self, x, y, dx, dy):
+        """Distance from (x, y) in the direction (dx, dy) to the border of the map."""
+        lengths = []
+        if dx > 0:
+            lengths.append((self.width - x) / dx)
+        elif dx < 0:
+            lengths.append(-x / dx)
+        if dy > 0:
+            lengths.append((self.height - y) / dy)
+        elif dy < 0:
+            lengths.append(-y / dy)
+        return min(lengths) if lengths else 0
+
+
+class AiRegistry:
+    """ 
+    Keeps exactly one ai controller per tank slot (the index of the tank in
+    the list of tanks). When a tank respawns, the controller of its slot is
+    rebound to the new tank instead of creating a new controller.
+    """
+
+    def __init__(self):
+        self.controllers = {} # Slot -> Ai
+
+    def add(self, slot, controller):
+        """Sets the controller of a slot, replacing the previous one."""
+        self.controllers[slot] = controller
+
+    def rebind(self, slot, tank):
+        """Makes the controller of the slot (if there is one) control the respawned tank."""
+        controller = self.controllers.get(slot)
+        if controller is not None:
+            controller.rebind(tank)
+
+    def remove(self, slot):
+        self.controllers.pop(slot, None)
+
+    def clear(self):
+        """Removes all the controllers, call this when a round is reset."""
+        self.controllers.clear()
+
+    def __contains__(self, slot):
+        return slot in self.controllers
+
+    def __len__(self):
+        """Number of active controllers."""
+        return len(self.controllers)
+
+    def __iter__(self):
+        return iter(self.controllers.values())
@@ -0,0 +1,366 @@
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+
+#-- The benchmarks never open a window or play sounds.
+os.environ['SDL_VIDEODRIVER'] = 'dummy'
+os.environ['SDL_AUDIODRIVER'] = 'dummy'
+
+import pygame
+import pymunk
+import ctf
+import maps
+import mapfile
+import planners
+import movement
+
+#----- Benchmark suite -----#
+#   Times the hot paths of the game: the ai path finding (breadth first
+#   search, the hierarchical planner and the weighted planner), a full tick of
+#   the main loop, the rendering of the game objects and the loading of large
+#   maps. The results are written as JSON so that they can be compared between commits.
+#
+#   python3 benchmark.py [--output results.json] [--quick]
+#
+#   Flags read by ctf.py (for instance --planner incremental) also apply.
+
+#-- Maps used by the benchmarks, the random maps are always generated with the same seed.
+BUILTIN_MAPS = [('map0', maps.map0), ('map1', maps.map1), ('map2', maps.map2)]
+
+QUICK = '--quick' in sys.argv
+
+if QUICK:
+    LARGE_MAPS      = [('random50', maps.random_map(50, 50))]
+    PLANNER_MAPS    = LARGE_MAPS
+    TICK_MAPS       = [('map2', maps.map2, 2), ('map1', maps.map1, 6), ('random30-16', maps.random_map(30, 30, 16), 16)]
+    LOAD_SIZES      = [200]
+    TANK_COUNTS     = [64]
+    MOVEMENT_TICKS  = 30
+    PATH_REPEATS    = 3
+    TICKS           = 200
+    FRAMES          = 50
+else:
+    LARGE_MAPS      = [('random50', maps.random_map(50, 50)),
+                       ('random100', maps.random_map(100, 100)),
+                       ('random200', maps.random_map(200, 200))]
+    PLANNER_MAPS    = LARGE_MAPS + [('random500', maps.random_map(500, 500))]
+    TICK_MAPS       = [('map2', maps.map2, 2), ('map1', maps.map1, 6), ('random40-32', maps.random_map(40, 40, 32), 32)]
+    LOAD_SIZES      = [200, 1000, 2000]
+    TANK_COUNTS     = [64, 128, 256]
+    MOVEMENT_TICKS  = 150
+    PATH_REPEATS    = 10
+    TICKS           = 1000
+    FRAMES          = 200
+
+RENDER_MAPS = BUILTIN_MAPS + [('random50', maps.random_map(50, 50))]
+WALL_MAPS   = BUILTIN_MAPS + LARGE_MAPS[:2]
+
+
+def summary(samples):
+    """Returns the number of samples, the mean and the percentiles (in milliseconds) of a list of durations in seconds."""
+    ordered = sorted(samples)
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+    return {'samples': len(ordered),
+            'mean_ms': sum(ordered) / len(ordered) * 1000,
+            'p50_ms':  percentile(50),
+            'p95_ms':  percentile(95),
+            'p99_ms':  percentile(99),
+            'max_ms':  ordered[-1] * 1000}
+
+def load(game_map):
+    """Starts a headless game on the map where every tank is controlled by the ai."""
+    ctf.HEADLESS = True
+    ctf.PLAYERS = 0
+    ctf.WIN_CONDITION = None
+    ctf.setup_map(game_map)
+    ctf.start_game()
+
+def bench_pathfinding(name, game_map):
+    """Times ai.Ai.find_shortest_path from every tank to its target."""
+    load(game_map)
+    samples = []
+    for aitank in ctf.ai_registry:
+        aitank.update_grid_pos()
+        for i in range(PATH_REPEATS):
+            start = time.perf_counter()
+            aitank.find_shortest_path()
+            samples.append(time.perf_counter() - start)
+    result = {'map': name, 'size': [game_map.width, game_map.height]}
+    result.update(summary(samples))
+    return result
+
+def bench_hierarchical(name, game_map):
+    """ 
+    Times the hierarchical planner from every tank to its target: the first
+    tile of a path (the search on the abstract graph) and every following tile.
+    """
+    load(game_map)
+    passability_grid = ctf.passability_grid
+    planner = planners.HierarchicalPlanner(passability_grid)
+    searches = []
+    steps = []
+    for aitank in ctf.ai_registry:
+        aitank.update_grid_pos()
+        start = passability_grid.index(*aitank.grid_pos.int_tuple)
+        target = passability_grid.index(*aitank.get_target_tile().int_tuple)
+        for i in range(PATH_REPEATS):
+            # Forget the refined paths, but keep the abstract graph.
+            planner.next_tiles.clear()
+            planner.remaining.clear()
+            begin = time.perf_counter()
+            node = planner.next_tile(start, target)
+            searches.append(time.perf_counter() - begin)
+            while node is not None:
+                begin = time.perf_counter()
+                node = planner.next_tile(node, target)
+                steps.append(time.perf_counter() - begin)
+    result = {'map': name, 'size': [game_map.width, game_map.height],
+              'search': summary(searches), 'step': summary(steps)}
+    return result
+
+def bench_weighted(name, game_map):
+    """ 
+    Compares the weighted planner with the breadth first search of the ai,
+    from every tank to its target. Like the ai, the search is made again with
+    metal boxes allowed when there is no path without them.
+    """
+    load(game_map)
+    passability_grid = ctf.passability_grid
+    samples = []
+    bfs_expansions = 0
+    weighted_expansions = 0
+    for aitank in ctf.ai_registry:
+        aitank.update_grid_pos()
+        start = passability_grid.index(*aitank.grid_pos.int_tuple)
+        target = passability_grid.index(*aitank.get_target_tile().int_tuple)
+        passability_grid.bfs_expansions = 0
+        if not passability_grid.bfs(start, target):
+            passability_grid.bfs(start, target, True)
+        bfs_expansions += passability_grid.bfs_expansions
+        for i in range(PATH_REPEATS):
+            planner = planners.WeightedPlanner(passability_grid)
+            begin = time.perf_counter()
+            planner.next_tile(start, target)
+            samples.append(time.perf_counter() - begin)
+        weighted_expansions += planner.expansions
+    result = {'map': name, 'size': [game_map.width, game_map.height],
+              'bfs_expansions': bfs_expansions, 'weighted_expansions': weighted_expansions}
+    result.update(summary(samples))
+    return result
+
+def bench_ticks(name, game_map, tanks):
+    """Times full ticks of the main loop (ai, updates, space.step, post_update)."""
+    load(game_map)
+    samples = []
+    for i in range(TICKS):
+        start = time.perf_counter()
+        ctf.tick()
+        samples.append(time.perf_counter() - start)
+    result = {'map': name, 'size': [game_map.width, game_map.height], 'tanks': tanks,
+              'ticks_per_second': len(samples) / sum(samples)}
+    result.update(summary(samples))
+    return result
+
+def timed(function, samples):
+    """Returns function wrapped so that the duration of every call is added to samples."""
+    def wrapper(*args):
+        start = time.perf_counter()
+        result = function(*args)
+        samples.append(time.perf_counter() - start)
+        return result
+    return wrapper
+
+def split_walls():
+    """Replaces the merged wall shapes of the loaded map by one shape per rock tile, as before they were merged."""
+    space = ctf.space
+    walls = [shape for shape in space.shapes if isinstance(shape, pymunk.Poly) and shape.body is space.static_body]
+    space.remove(*walls)
+    for box in ctf.entity_store.boxes():
+        if box.body.body_type == pymunk.Body.STATIC:
+            box.shape = pymunk.Poly(box.body, box.points)
+            box.shape.friction = 0.5
+            box.shape.elasticity = 0.1
+            box.shape.collision_type = 3
+            box.shape.parent = box
+            space.add(box.shape)
+
+def bench_walls(name, game_map):
+    """ 
+    Compares the number of shapes in the physics engine and the time of
+    space.step during ai-only ticks, with the rock tiles merged into walls
+    and with one shape per rock tile.
+    """
+    result = {'map': name, 'size': [game_map.width, game_map.height]}
+    for merged in (True, False):
+        load(game_map)
+        if not merged:
+            split_walls()
+        shapes = len(ctf.space.shapes)
+        samples = []
+        ctf.space.step = timed(ctf.space.step, samples)
+        for i in range(TICKS):
+            ctf.tick()
+        result['merged' if merged else 'tiles'] = dict(summary(samples), shapes=shapes)
+    return result
+
+def bench_movement(tanks):
+    """ 
+    Times the batched movement stage (movement.update) and the full ticks with
+    many ai tanks, with the default backend and with numpy if it is installed.
+    The tanks start two tiles apart on the top and bottom rows of a random map.
+    """
+    game_map = maps.random_map(tanks, 64, tanks)
+    result = {'map': 'random%dx64' % tanks, 'size': [game_map.width, game_map.height], 'tanks': tanks}
+    update = movement.update
+    backend = movement.numpy_backend
+    for name in ('batched', 'numpy'):
+        if name == 'numpy' and movement.numpy is None:
+            result[name] = None
+            continue
+        movement.use_numpy(name == 'numpy')
+        load(game_map)
+        updates = []
+        ticks = []
+        movement.update = timed(update, updates)
+        try:
+            for i in range(MOVEMENT_TICKS):
+                start = time.perf_counter()
+                ctf.tick()
+                ticks.append(time.perf_counter() - start)
+        finally:
+            movement.update = update
+            movement.use_numpy(backend)
+        result[name] = {'update': summary(updates), 'tick': summary(ticks), 'bullets': len(ctf.entity_store.bullets())}
+    return result
+
+def bench_rendering(name, game_map):
+    """Times drawing all the game objects with update_screen on an offscreen surface."""
+    load(game_map)
+    ctf.background = pygame.Surface(game_map.rect().size)
+    ctf.create_background()
+    surface = pygame.Surface(game_map.rect().size)
+    samples = []
+    for i in range(FRAMES):
+        start = time.perf_counter()
+        surface.blit(ctf.background, (0, 0))
+        for obj in ctf.entity_store:
+            obj.update_screen(surface)
+        samples.append(time.perf_counter() - start)
+        # Let the objects move between the frames.
+        ctf.tick()
+    result = {'map': name, 'size': [game_map.width, game_map.height], 'objects': len(ctf.entity_store),
+              'frames_per_second': len(samples) / sum(samples)}
+    result.update(summary(samples))
+    return result
+
+def measure(function):
+    """ 
+    Calls function twice: once to time it and once to trace its memory.
+    Returns the seconds it took, the peak of the memory it allocated and the
+    memory still held by what it returned, in KiB.
+    """
+    begin = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - begin
+    tracemalloc.start()
+    result = function()
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return seconds, peak / 1024, held / 1024
+
+def bench_map_loading(size):
+    """ 
+    Times and measures the memory of a size x size random map: generated in
+    memory (maps.random_map), read from JSON and compiled (what happens the
+    first time a JSON map is used) and loaded from the compiled file.
+    """
+    game_map = maps.random_map(size, size)
+    result = {'map': 'random%d' % size, 'size': [size, size]}
+    seconds, peak, held = measure(lambda: maps.random_map(size, size))
+    result['generate'] = {'ms': seconds * 1000, 'peak_kib': peak, 'held_kib': held}
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'map.json')
+        compiled = os.path.join(directory, 'map.ctfm')
+        with open(source, 'w') as file:
+            json.dump({'width': size, 'height': size,
+                       'boxes': [list(game_map.boxes.row(y)) for y in range(size)],
+                       'start_position': game_map.start_positions,
+                       'flag_position': game_map.flag_position}, file)
+        def load_json():
+            mapfile.compile_json(source, compiled)
+            return mapfile.load_compiled(compiled)
+        seconds, peak, held = measure(load_json)
+        result['json'] = {'ms': seconds * 1000, 'peak_kib': peak, 'held_kib': held}
+        seconds, peak, held = measure(lambda: mapfile.load_compiled(compiled))
+        result['compiled'] = {'ms': seconds * 1000, 'peak_kib': peak, 'held_kib': held}
+    return result
+
+def metadata():
+    """Describes the machine and the version of the code the benchmarks ran on."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=ctf.main_dir).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'commit':   commit,
+            'time':     time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python':   platform.python_version(),
+            'pygame':   pygame.version.ver,
+            'pymunk':   pymunk.version,
+            'machine':  platform.machine(),
+            'planner':  ctf.PLANNER,
+            'quick':    QUICK}
+
+def run():
+    results = {'metadata': metadata(), 'pathfinding': [], 'hierarchical': [], 'weighted': [], 'ticks': [], 'rendering': [],
+               'map_loading': [], 'walls': [], 'movement': []}
+    for name, game_map in BUILTIN_MAPS + LARGE_MAPS:
+        results['pathfinding'].append(bench_pathfinding(name, game_map))
+        print('pathfinding', name, round(results['pathfinding'][-1]['p50_ms'], 3), 'ms (p50)')
+    for name, game_map in PLANNER_MAPS:
+        result = bench_hierarchical(name, game_map)
+        results['hierarchical'].append(result)
+        print('hierarchical', name, round(result['search']['p50_ms'], 3), 'ms per search,',
+              round(result['step']['p50_ms'], 4), 'ms per tile (p50)')
+    for name, game_map in BUILTIN_MAPS + LARGE_MAPS:
+        result = bench_weighted(name, game_map)
+        results['weighted'].append(result)
+        print('weighted', name, round(result['p50_ms'], 3), 'ms (p50),', result['weighted_expansions'],
+              'expanded nodes against', result['bfs_expansions'], 'for the breadth first search')
+    for name, game_map, tanks in TICK_MAPS:
+        results['ticks'].append(bench_ticks(name, game_map, tanks))
+        print('ticks', name, round(results['ticks'][-1]['ticks_per_second'], 1), 'ticks/s')
+    for name, game_map in RENDER_MAPS:
+        results['rendering'].append(bench_rendering(name, game_map))
+        print('rendering', name, round(results['rendering'][-1]['frames_per_second'], 1), 'frames/s')
+    for tanks in TANK_COUNTS:
+        result = bench_movement(tanks)
+        results['movement'].append(result)
+        print('movement', tanks, 'tanks,', ', '.join('%s %.3f ms per update (p50)' % (name, result[name]['update']['p50_ms'])
+                                                    for name in ('batched', 'numpy') if result[name] is not None))
+    for name, game_map in WALL_MAPS:
+        result = bench_walls(name, game_map)
+        results['walls'].append(result)
+        print('walls', name, result['tiles']['shapes'], '->', result['merged']['shapes'], 'shapes,',
+              round(result['tiles']['mean_ms'], 3), '->', round(result['merged']['mean_ms'], 3), 'ms per space.step')
+    for size in LOAD_SIZES:
+        result = bench_map_loading(size)
+        results['map_loading'].append(result)
+        print('map loading', result['map'], ', '.join('%s %.1f ms (peak %.0f KiB, held %.0f KiB)'
+              % (way, result[way]['ms'], result[way]['peak_kib'], result[way]['held_kib'])
+              for way in ('generate', 'json', 'compiled')))
+    return results
+
+if __name__ == '__main__':
+    output = ctf.get_option('--output', 'benchmark_results.json')
+    results = run()
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print('Results written to', output)
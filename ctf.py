@@ -6,9 +6,17 @@ import math
 from pygame import mixer
 import os
 import sys
+import time
 
 #----- Initialisation -----#
 
+#-- Headless mode: no window, no rendering and no framerate throttling,
+#   the simulation runs as fast as the CPU allows.
+HEADLESS = '--headless' in sys.argv
+if HEADLESS:
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+
 #-- Initialise the display
 pygame.init()
 pygame.display.set_mode()
@@ -18,34 +26,108 @@ main_dir = os.path.split(os.path.abspath(__file__))[0]
 #-- Initialise the clock
 clock = pygame.time.Clock()
 
-#-- Initialise the physics engine
-space = pymunk.Space()
-space.gravity = (0.0, 0.0)
-space.damping = 0.1 # Adds friction to the ground for all objects
-
-
 #-- Import from the ctf framework
 import ai
 import images
 import gameobjects
 import maps
+import renderer
+import grid
+import planners
+import planning
+import entities
+import profiler
+import snapshot
+import geometry
+import mapfile
+import movement
+
+# Nothing is drawn in headless mode, the objects only need the sizes of their sprites.
+if HEADLESS:
+    images.set_metadata_only()
 
 #-- Constants
-FRAMERATE = 50
+FIRST_TO_POINTS = 5 # Points needed to win with --first-to
+BEST_OF_ROUNDS  = 5 # Rounds played with --best-of
+TIME_LIMIT      = 10 # Seconds played with --time
+
+def get_option(name, default=None):
+    """Returns the value written after the flag name on the command line, or default."""
+    if name in sys.argv and sys.argv.index(name) + 1 < len(sys.argv):
+        return sys.argv[sys.argv.index(name) + 1]
+    return default
+
+#-- Timing: the game runs TICK_RATE ticks per second whatever the frame rate is,
+#   each tick steps the physics SUBSTEPS times (more substeps for faster bullets),
+#   and the screen is drawn RENDER_RATE times per second (see main_loop).
+#   The speeds of the tanks and bullets are updated every UPDATE_INTERVAL ticks.
+TICK_RATE       = int(get_option('--tick-rate', '50'))
+SUBSTEPS        = int(get_option('--substeps', '1'))
+RENDER_RATE     = int(get_option('--fps', '60'))
+UPDATE_INTERVAL = 3
+MAX_FRAME_TIME  = 0.25 # Longest time simulated after one frame, so a stall does not freeze the game catching up.
+
+#-- Path planner used by the ai: "field" (distance fields shared by all ais),
+#   "incremental" (one D* Lite planner per ai), "hierarchical" (an HPA*
+#   planner shared by all ais, for large maps) or "weighted" (an A* planner
+#   shared by all ais that prices shooting wood boxes and pushing metal boxes).
+PLANNER = get_option('--planner', 'field')
+
+#-- Plan the paths of the ais in background processes with --async-planning
+#   (see planning.py), so that long searches do not hold up the ticks.
+ASYNC_PLANNING   = '--async-planning' in sys.argv
+PLANNING_WORKERS = int(get_option('--planning-workers', '1'))
+planning_service = None
+
+#-- Type of ai of each slot ("none" for a tank without ai), used by the match
+#   runner. When it is None, PLAYERS and PLANNER decide which tanks are ai.
+AI_TYPES = None
+
+#-- Time every phase of the ticks with --profile
+tick_profiler = profiler.TickProfiler() if '--profile' in sys.argv else profiler.NoProfiler()
+
+#-- Compute the movement of the tanks and bullets with numpy, see movement.py
+if '--numpy' in sys.argv:
+    movement.use_numpy()
+
+#-- Maximum number of bullets flying at the same time, see gameobjects.BulletPool
+gameobjects.bullet_pool.max_bullets = int(get_option('--max-bullets', gameobjects.bullet_pool.max_bullets))
+
+#-- Game mode: the number of players using the keyboard, the other tanks are
+#   controlled by the ai (None if no tank is controlled by the ai).
+if '--singleplayer' in sys.argv:
+    PLAYERS = 1
+elif '--multiplayer' in sys.argv:
+    PLAYERS = 2
+elif '--ai-only' in sys.argv:
+    PLAYERS = 0
+else:
+    PLAYERS = None
+
+#-- Win condition: "first-to", "best-of", "time" or None to play until the window is closed.
+WIN_CONDITION = None
+for condition in ('first-to', 'best-of', 'time'):
+    if '--' + condition in sys.argv:
+        WIN_CONDITION = condition
+        break
+
+#-- The game stops after --max-ticks ticks. Nothing ends a headless game without
+#   a win condition (there is no window to close), it stops after ten minutes
+#   of game time unless --max-ticks says otherwise.
+MAX_TICKS = get_option('--max-ticks')
+if MAX_TICKS is not None:
+    MAX_TICKS = int(MAX_TICKS)
+elif HEADLESS and WIN_CONDITION is None:
+    MAX_TICKS = TICK_RATE * 60 * 10
 
 #-- Variables
-#   Define the current level
+#   Define the current level, set by setup_map()
 current_map         = maps.map0
 
-#-- Choose type of map
-if '--map' in sys.argv:
-    if '--json' in sys.argv:
-        current_map = maps.create_map_jon(sys.argv[5])
-
-#   List of all game objects
-game_objects_list   = []
-tanks_list          = []
-ai_list             = []
+#   Store of all game objects, with an index for each type of object
+#   and the tanks by slot (player number - 1)
+entity_store        = entities.EntityStore()
+ai_registry         = ai.AiRegistry()  # One ai controller per tank slot
 
 # List/dictionary for win conditions
 round_counter       = 0
@@ -53,35 +135,74 @@ round_counter       = 0
 
 point_dict          = {}
 
-#-- Resize the screen to the size of the current level
-screen = pygame.display.set_mode(current_map.rect().size)
+# Number of ticks since the game started.
+ticks               = 0
 
-#-- Generate the background
-background = pygame.Surface(screen.get_size())
 
-#-- Create and add boarders
+def load_map_option():
+    """ 
+    Returns the map chosen on the command line: --map NAME (map0, map1, map2),
+    --map PATH (a .json or a compiled .ctfm map, see mapfile.py) or the older
+    --map --json PATH. It is only read when ctf.py is run, the modules that
+    import ctf (the match runner, the replays) choose their own map.
+    """
+    map_name = get_option('--json') if '--json' in sys.argv else get_option('--map')
+    if map_name is None:
+        return maps.map0
+    try:
+        return mapfile.load_map(map_name)
+    except (OSError, mapfile.MapError) as error:
+        raise SystemExit('Could not load map "%s": %s' % (map_name, error))
+
+def setup_map(new_map):
+    """ 
+    Prepares the screen, the background and the physics engine for a map.
+    Has to be called before start_game().
+    """
+    global current_map, screen, background, screen_renderer, space, targeting
+    current_map = new_map
+
+    # Nothing is drawn in headless mode, so there is no screen.
+    screen = background = screen_renderer = None
+    if not HEADLESS:
+        #-- Resize the screen to the size of the current level
+        screen = pygame.display.set_mode(current_map.rect().size)
 
-space = pymunk.Space()
-static_lines = [
-    pymunk.Segment(space.static_body, (0,0), (0, current_map.height), 0),
-    pymunk.Segment(space.static_body, (0, current_map.height), (current_map.width ,current_map.height), 0),
-    pymunk.Segment(space.static_body, (current_map.width ,0), (current_map.width, current_map.height), 0),
-    pymunk.Segment(space.static_body, (0,0), (current_map.width,0), 0)
-]
+        #-- Generate the background
+        background = pygame.Surface(screen.get_size())
 
-for line in static_lines:
-    line.elasticity = 1
-    line.friction = 1
+        #-- Only redraw the parts of the screen that change between frames
+        screen_renderer = renderer.DirtyRectRenderer(screen, background)
 
-space.add(*static_lines)
+    #-- Initialise the physics engine
+    space = pymunk.Space()
+
+    #-- Create and add boarders
+    static_lines = [
+        pymunk.Segment(space.static_body, (0,0), (0, current_map.height), 0),
+        pymunk.Segment(space.static_body, (0, current_map.height), (current_map.width ,current_map.height), 0),
+        pymunk.Segment(space.static_body, (current_map.width ,0), (current_map.width, current_map.height), 0),
+        pymunk.Segment(space.static_body, (0,0), (current_map.width,0), 0)
+    ]
+
+    for line in static_lines:
+        line.elasticity = 1
+        line.friction = 1
+
+    space.add(*static_lines)
+
+    #-- Line of sight queries for the ai, shared by all ais
+    targeting = ai.Targeting(space, current_map)
+
+    collision_handlers()
+    if not HEADLESS:
+        create_background()
 
 #-- Create collisions
 def collision_bullet_nondestr(arb, space, data):
     """Collision with bullet and none destructable object."""
     _bullet = arb.shapes[0]
-    space.remove(_bullet, _bullet.body)
-    if _bullet.parent in game_objects_list:
-        game_objects_list.remove(_bullet.parent)
+    gameobjects.bullet_pool.release(_bullet.parent, entity_store)
     return True
 
 def collision_bullet_destr(arb, space, data):
@@ -89,10 +210,9 @@ def collision_bullet_destr(arb, space, data):
     _bullet = arb.shapes[0]
     _box = arb.shapes[1]
     space.remove(_box, _box.body)
-    game_objects_list.remove(_box.parent)
-    space.remove(_bullet, _bullet.body)
-    if _bullet.parent in game_objects_list:
-        game_objects_list.remove(_bullet.parent)
+    entity_store.remove(_box.parent)
+    passability_grid.remove_box(_box.parent)
+    gameobjects.bullet_pool.release(_bullet.parent, entity_store)
     return True
     
 
@@ -101,22 +221,17 @@ def collision_bullet_tank(arb, space, data):
     _bullet = arb.shapes[0]
     _tank = arb.shapes[1]
     _tank.parent.drop_flag(flag)
-    index = tanks_list.index(_tank.parent)
-    space.remove(_bullet, _bullet.body)
-    if _bullet.parent in game_objects_list:
-        game_objects_list.remove(_bullet.parent)
+    index = _tank.parent.slot
+    gameobjects.bullet_pool.release(_bullet.parent, entity_store)
     space.remove(_tank, _tank.body)
-    game_objects_list.remove(_tank.parent)
-    tanks_list.remove(_tank.parent)
-    recreate_tank(index) 
+    entity_store.remove(_tank.parent)
+    recreate_tank(index)
     return True
 
 def collision_bullet_bullet(arb, space, data):
     """Collision with bullet and bullet"""
     _bullet = arb.shapes[0]
-    space.remove(_bullet, _bullet.body)
-    if _bullet.parent in game_objects_list:
-        game_objects_list.remove(_bullet.parent)
+    gameobjects.bullet_pool.release(_bullet.parent, entity_store)
     return True
 
 def collision_handlers():
@@ -132,6 +247,9 @@ def collision_handlers():
     # Collision with bullet
     handler = space.add_collision_handler(1,1)
     handler.pre_solve = collision_bullet_bullet
+    # The renderer only looks at the boxes that something touches.
+    if screen_renderer is not None:
+        screen_renderer.watch(space, (3, 4))
 
 
 def create_background():
@@ -146,16 +264,36 @@ def create_background():
 
 def create_boxes():
 #-- Create the boxes
-    for x in range(0, current_map.width):
-        for y in range(0,  current_map.height):
-            # Get the type of boxes
-            box_type  = current_map.boxAt(x, y)
-            # If the box type is not 0 (aka grass tile), create a box
-            if(box_type != 0):
-                # Create a "Box" using the box_type, aswell as the x,y coordinates,
-                # and the pymunk space
-                box = gameobjects.get_box_with_type(x, y, box_type, space)
-                game_objects_list.append(box)
+    # Turn the grid and the shared planners used by the ai into global variables
+    global passability_grid, distance_fields, hierarchical_planner, weighted_planner, planning_service
+    passability_grid = grid.PassabilityGrid.from_map(current_map)
+    distance_fields = grid.DistanceFields(passability_grid)
+    hierarchical_planner = planners.HierarchicalPlanner(passability_grid)
+    weighted_planner = planners.WeightedPlanner(passability_grid)
+    # The workers plan on snapshots of the new grid.
+    if planning_service is not None:
+        planning_service.close()
+    planning_service = planning.PlanningService(passability_grid, PLANNING_WORKERS) if ASYNC_PLANNING else None
+    rocks = {}
+    # Loop over the tiles that are not grass (aka the boxes), the grass is skipped in bulk.
+    for x, y, box_type in current_map.boxes.boxes():
+        if box_type == 1:
+            # Rock boxes are only drawn, their shapes are merged into walls below.
+            box = gameobjects.get_box_with_type(x, y, box_type, None)
+            rocks[(x, y)] = box
+        else:
+            # Create a "Box" using the box_type, aswell as the x,y coordinates,
+            # and the pymunk space
+            box = gameobjects.get_box_with_type(x, y, box_type, space)
+            # Wood boxes can be destroyed and wood and metal boxes can be pushed,
+            # keep the passability grid up to date with them.
+            passability_grid.track(box, box_type)
+        entity_store.add(box)
+    # The boxes are drawn between two ticks, remember_states needs the ones that moved.
+    if not HEADLESS:
+        passability_grid.follow_moves()
+    # Neighbouring rock tiles become one shape in the physics engine.
+    geometry.add_walls(space, geometry.merge_tiles(current_map.boxes, 1), rocks, 3)
 
 
 def create_bases():
@@ -163,22 +301,46 @@ def create_bases():
     for i in range(0, len(current_map.start_positions)):
         # The position of bases is the startpositins of the tanks.
         pos = current_map.start_positions[i]
-        base = gameobjects.GameVisibleObject(pos[0], pos[1], images.bases[i])
-        game_objects_list.append(base)
+        base = gameobjects.GameVisibleObject(pos[0], pos[1], images.bases[i % len(images.bases)])
+        entity_store.add(base)
+
+def create_planner(kind):
+    """Returns the path planner for a new ai, kind is the name of the planner."""
+    if planning_service is not None and kind in planning.WORKER_PLANNERS:
+        return planning.AsyncPlanner(planning_service, kind)
+    if kind == 'incremental':
+        return planners.IncrementalPlanner(passability_grid)
+    if kind == 'hierarchical':
+        return hierarchical_planner
+    if kind == 'weighted':
+        return weighted_planner
+    return distance_fields
+
+def ai_type(slot):
+    """Returns the type of ai (a planner name) of a slot."""
+    if AI_TYPES is not None:
+        return AI_TYPES[slot]
+    return PLANNER
+
+def ai_slots():
+    """
+    Returns the slots (player number - 1) of the tanks controlled by the ai.
+    The amount of ai tanks depends on players and game mode.
+    """
+    if AI_TYPES is not None:
+        return [slot for slot in range(len(current_map.start_positions))
+                if slot < len(AI_TYPES) and AI_TYPES[slot] != 'none']
+    if PLAYERS is None:
+        return range(0)
+    return range(PLAYERS, len(current_map.start_positions))
 
 def create_ai():
     """
-    Function to create ai tanks. 
-    The amount of ai tanks depends on players and game mode.
+    Function to create ai tanks, one controller for each ai slot.
     """
-    if '--singleplayer' in sys.argv:
-        for tank in tanks_list[1:]:
-            aitank = ai.Ai(tank, game_objects_list, tanks_list, space, current_map)
-            ai_list.append(aitank)
-    elif '--multiplayer' in sys.argv:
-        for tank in tanks_list[2:]:
-            aitank = ai.Ai(tank, game_objects_list, tanks_list, space, current_map)
-            ai_list.append(aitank)
+    for slot in ai_slots():
+        aitank = ai.Ai(entity_store.tank_at(slot), entity_store, space, current_map, passability_grid, create_planner(ai_type(slot)), targeting)
+        ai_registry.add(slot, aitank)
 
 
 def create_tanks():
@@ -188,41 +350,40 @@ def create_tanks():
         # Get the starting position of the tank "i"
         pos = current_map.start_positions[i]
         # Create the tank, images.tanks contains the image representing the tank
-        tank = gameobjects.Tank(pos[0], pos[1], pos[2], images.tanks[i], space)
-        # Add the tank to the list of tanks
-        tanks_list.append(tank)
-        game_objects_list.append(tank)
-    
-        create_ai()
+        tank = gameobjects.Tank(pos[0], pos[1], pos[2], images.tanks[i % len(images.tanks)], space)
+        # Add the tank to the store, in slot "i"
+        entity_store.add(tank, i)
+
+    create_ai()
 
 def recreate_tank(index):
     """
     A function to respawn a tank if it has been destroyed.
     """
-    # Gets the starting position from tanks index in tanks_list. 
+    # Gets the starting position from the slot of the tank.
     pos = current_map.start_positions[index]
-    tank = gameobjects.Tank(pos[0], pos[1], pos[2], images.tanks[index], space)
-    # Insert the tank at the same index as it were before in tanks_list.
-    tanks_list.insert(index, tank)
-    game_objects_list.append(tank)
+    tank = gameobjects.Tank(pos[0], pos[1], pos[2], images.tanks[index % len(images.tanks)], space)
+    # Put the tank in the same slot as it were before.
+    entity_store.add(tank, index)
     # Make sure all the tanks that are ais still are after respawn.
-    create_ai()
+    ai_registry.rebind(index, tank)
 
 #-- Create the flag
 def create_flag():
     # Turn flag into global variable
     global flag
     flag = gameobjects.Flag(current_map.flag_position[0], current_map.flag_position[1])
-    game_objects_list.append(flag)
+    entity_store.add(flag)
 
 def won():
-    # If a tank has won remove everything and add it again.
+    # If a tank has won put everything back as it was at the start of the game.
     # -> a new round starts.
-    space.remove(space.shapes, space.bodies)
-    game_objects_list.clear()
-    tanks_list.clear()
-    ai_list.clear()
-    create_objects()
+    world_snapshot.restore()
+    ai_registry.clear()
+    create_ai()
+    # The boxes were moved back without touching anything.
+    if screen_renderer is not None:
+        screen_renderer.invalidate()
     
 
 def print_score():
@@ -233,13 +394,64 @@ def print_score():
 
 def print_wincond(timer):
     """ Function to display the wincondition """
-    if '--first-to' in sys.argv:
-        print('First to 5 points wins!', end = '\r')
-    elif '--best-of' in sys.argv:
-        print('Rounds left:', 5 - round_counter, end = '\r')
-    elif '--time' in sys.argv:
+    if HEADLESS:
+        return
+    if WIN_CONDITION == 'first-to':
+        print('First to', FIRST_TO_POINTS, 'points wins!', end = '\r')
+    elif WIN_CONDITION == 'best-of':
+        print('Rounds left:', BEST_OF_ROUNDS - round_counter, end = '\r')
+    elif WIN_CONDITION == 'time':
         print('Time left:', (str(timer)).zfill(2), end = '\r')
 
+def print_tick_rate(ticks, seconds):
+    """ Function to print how fast the simulation ran """
+    print("____SIMULATION____")
+    print('Ticks:', ticks)
+    print('Seconds:', round(seconds, 3))
+    if seconds > 0:
+        print('Ticks per second:', round(ticks / seconds, 1))
+
+def print_stats(ticks):
+    """ Function to print the rendering and path planning statistics """
+    stats = gameobjects.rotation_cache.stats()
+    print("____ROTATION CACHE____")
+    print('Hits:', stats['hits'])
+    print('Misses:', stats['misses'])
+    print('Cached sprites:', stats['size'])
+    stats = gameobjects.bullet_pool.stats()
+    print("____BULLET POOL____")
+    print('Live bullets:', stats['live'])
+    print('Free bullets:', stats['free'])
+    print('Allocated bullets:', stats['allocated'], 'of', stats['max'])
+    print('Recycled bullets:', stats['recycled'])
+    print("____AI____")
+    print('Active ai controllers:', len(ai_registry))
+    if ticks > 0:
+        print('Raycasts per tick:', round(targeting.raycasts / ticks, 2))
+    # Only the incremental planners of the current round are counted.
+    incremental = [aitank.planner for aitank in ai_registry if isinstance(aitank.planner, planners.IncrementalPlanner)]
+    if incremental:
+        replans = sum(planner.replans for planner in incremental)
+        expansions = sum(planner.expansions for planner in incremental)
+        print("____PATH PLANNING____")
+        print('Replans:', replans)
+        print('Expanded nodes:', expansions)
+        if ticks > 0:
+            print('Expanded nodes per tick:', round(expansions / ticks, 2))
+    if any(aitank.planner is hierarchical_planner for aitank in ai_registry):
+        print("____HIERARCHICAL PLANNER____")
+        print('Abstract searches:', hierarchical_planner.searches)
+        print('Expanded abstract nodes:', hierarchical_planner.expansions)
+        print('Clusters rebuilt:', hierarchical_planner.rebuilt)
+    if any(aitank.planner is weighted_planner for aitank in ai_registry):
+        print("____WEIGHTED PLANNER____")
+        print('Searches:', weighted_planner.searches)
+        print('Expanded nodes:', weighted_planner.expansions)
+    if planning_service is not None:
+        print("____BACKGROUND PLANNING____")
+        print('Paths asked for:', planning_service.requests)
+        print('Stale paths dropped:', planning_service.dropped)
+
 def print_winner():
     """ Function to print out the winner """
     print("____WINNER____")
@@ -261,159 +473,262 @@ def create_objects():
 def p1_controls(event):
     if event.type == pygame.KEYDOWN:
         if event.key == pygame.K_UP:
-            tanks_list[0].accelerate()
+            entity_store.tank_at(0).accelerate()
         elif event.key == pygame.K_DOWN:
-            tanks_list[0].decelerate()
+            entity_store.tank_at(0).decelerate()
         elif event.key == pygame.K_LEFT:
-            tanks_list[0].turn_left()
+            entity_store.tank_at(0).turn_left()
         elif event.key == pygame.K_RIGHT:
-            tanks_list[0].turn_right()
+            entity_store.tank_at(0).turn_right()
         elif event.key == pygame.K_RETURN:
-            tanks_list[0].shoot(space, game_objects_list)  
+            entity_store.tank_at(0).shoot(space, entity_store)  
     elif event.type == pygame.KEYUP:
         if event.key == pygame.K_UP or pygame.K_DOWN:
-            tanks_list[0].stop_moving()
+            entity_store.tank_at(0).stop_moving()
             if event.key == pygame.K_LEFT or pygame.K_RIGHT:
-                tanks_list[0].stop_turning()    
+                entity_store.tank_at(0).stop_turning()    
         
 
 def p2_controls(event):
     if event.type == pygame.KEYDOWN:
         if event.key == pygame.K_w:
-            tanks_list[1].accelerate()
+            entity_store.tank_at(1).accelerate()
         elif event.key == pygame.K_s:
-            tanks_list[1].decelerate()
+            entity_store.tank_at(1).decelerate()
         elif event.key == pygame.K_a:
-            tanks_list[1].turn_left()
+            entity_store.tank_at(1).turn_left()
         elif event.key == pygame.K_d:
-            tanks_list[1].turn_right()
+            entity_store.tank_at(1).turn_right()
         elif event.key == pygame.K_SPACE:
-            tanks_list[1].shoot(space, game_objects_list)
+            entity_store.tank_at(1).shoot(space, entity_store)
     elif event.type == pygame.KEYUP:
         if event.key == pygame.K_w or pygame.K_s:
-            tanks_list[1].stop_moving()
+            entity_store.tank_at(1).stop_moving()
             if event.key == pygame.K_a or pygame.K_d:
-                tanks_list[1].stop_turning()
+                entity_store.tank_at(1).stop_turning()
 
 
 #----- Main Loop -----#
-def main_loop():
-#-- Control whether the game run
-    running = True
+def start_game():
+    """ 
+    Creates the objects of the first round and resets the score and the tick
+    counters. setup_map() has to be called first.
+    """
+    global round_counter, ticks, world_snapshot
+    gameobjects.bullet_pool.release_all(entity_store)
+    entity_store.clear()
+    ai_registry.clear()
+    create_objects()
+    # The next rounds start from this snapshot instead of creating the objects again.
+    world_snapshot = snapshot.WorldSnapshot(entity_store, space, passability_grid, current_map, flag)
 
-    skip_update = 0
-    
-    # Time variable used to create timer.
-    t1 = 0
-    
-    # Add 0 to the round counter
     round_counter = 0
+    ticks = 0
 
     # Add a key and 0 for each tank.
-    for ind in range(len(tanks_list)):
+    point_dict.clear()
+    for ind in range(len(entity_store.slots)):
         player = 'Player ' + str(ind+1)
         point_dict[player] = 0
 
-    while running:
-    #-- Handle the events
-        
-        # Add 1 to t1
-        t1 = t1 + 1
-        # Start time
-        t2 = 10
-        # Create timer
-        timer = t2-(t1//FRAMERATE)
-        # Print out the wincondition
-        print_wincond(timer)
-
-        tanks_list[0].update()
-        tanks_list[1].update()
-        for event in pygame.event.get():
-        # Check if we receive a QUIT event (for instance, if the user press the
-        # close button of the window) or if the user press the escape key.
-    
-            if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
-                running = False
-
-            # Depending on game mode, run functions for player controls.
-            if '--singleplayer' in sys.argv:
-                p1_controls(event)
-            elif '--multiplayer' in sys.argv:
-                p1_controls(event)
-                p2_controls(event)
-
-        for ai in ai_list:
-            ai.decide()
-
-        for tank in tanks_list:
-        # Reset game if a tank has won and print score
-            if tank.has_won():
-                index = tanks_list.index(tank)
-                won()
-                # Add 1 to the round counter
-                round_counter = round_counter + 1
-                # Give the player that won this round a point.
-                point_dict['Player ' + str(index+1)] = point_dict['Player ' + str(index+1)] + 1
-                print('')
-                print_score()
-
-            # Try to grab flag    
-            tank.try_grab_flag(flag)
-
-        # Enable win condition depending on what command is written.
-        if '--first-to' in sys.argv:
-            for key in point_dict:
-                if point_dict[key] == 5:
-                    print_winner()
-                    running = False
-        elif '--best-of' in sys.argv:
-            if round_counter == 5:
-                print_winner()
-                running = False
-        elif '--time' in sys.argv:
-            if timer == 0:
-                print_winner()
-                running = False
-
-
-        #-- Update physics
-        if skip_update == 0:
-        # Loop over all the game objects and update their speed in function of their
-        # acceleration.
-            for obj in game_objects_list:
-                obj.update()
-                skip_update = 2
-        else:
-            skip_update -= 1
+def apply_input(slot, name):
+    """Gives an input (one of gameobjects.Tank.INPUTS) to the tank in a slot."""
+    tank = entity_store.tank_at(slot)
+    if name == 'shoot':
+        tank.shoot(space, entity_store)
+    else:
+        getattr(tank, name)()
+
+def tick(events=(), inputs=()):
+    """ 
+    Runs one tick of the game: the player events, the ai, the win conditions,
+    the object updates, the physics and the post updates. inputs are (slot, input)
+    pairs given to the tanks after the events, for instance from a replay.
+    Returns False when the game is over.
+    """
+    global round_counter, ticks
+    running = True
 
-        #   Check collisions and update the objects position
-        space.step(1 / FRAMERATE)
+    # Add 1 to the ticks
+    ticks = ticks + 1
+    # Create timer
+    timer = TIME_LIMIT-(ticks//TICK_RATE)
+    # Print out the wincondition
+    print_wincond(timer)
+
+    entity_store.tank_at(0).update()
+    entity_store.tank_at(1).update()
+    for event in events:
+    # Check if we receive a QUIT event (for instance, if the user press the
+    # close button of the window) or if the user press the escape key.
+
+        if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+            running = False
+
+        # Depending on game mode, run functions for player controls.
+        if PLAYERS == 1:
+            p1_controls(event)
+        elif PLAYERS == 2:
+            p1_controls(event)
+            p2_controls(event)
+    for slot, name in inputs:
+        apply_input(slot, name)
+    tick_profiler.mark('events')
+
+    # Cast the rays of all the ai tanks at once, then let the ais decide.
+    targeting.update(aitank.tank for aitank in ai_registry)
+    for aitank in ai_registry:
+        aitank.decide()
+    tick_profiler.mark('ai')
+
+    for tank in list(entity_store.tanks()):
+    # Reset game if a tank has won and print score
+        if tank.has_won():
+            index = tank.slot
+            won()
+            # Add 1 to the round counter
+            round_counter = round_counter + 1
+            # Give the player that won this round a point.
+            point_dict['Player ' + str(index+1)] = point_dict['Player ' + str(index+1)] + 1
+            print('')
+            print_score()
+            # The tanks of the previous round are gone.
+            break
+
+        # Try to grab flag    
+        tank.try_grab_flag(flag)
+
+    # Enable win condition depending on what command is written.
+    if WIN_CONDITION == 'first-to':
+        if max(point_dict.values()) >= FIRST_TO_POINTS:
+            running = False
+    elif WIN_CONDITION == 'best-of':
+        if round_counter == BEST_OF_ROUNDS:
+            running = False
+    elif WIN_CONDITION == 'time':
+        if timer == 0:
+            running = False
+    tick_profiler.mark('rules')
+
+
+    #-- Update physics
+    if (ticks - 1) % UPDATE_INTERVAL == 0:
+    # Update the speed of all the tanks and bullets in function of their
+    # acceleration, in one batch (the other objects do not move by themselves).
+        movement.update(entity_store.tanks(), entity_store.bullets())
+    tick_profiler.mark('update')
+
+    #   Check collisions and update the objects position
+    for i in range(SUBSTEPS):
+        space.step(1 / TICK_RATE / SUBSTEPS)
+
+    #   Move the pushed boxes to their new tile in the passability grid
+    passability_grid.update_boxes()
+    tick_profiler.mark('step')
+
+    #   Update object that depends on an other object position (for instance a flag)
+    for tank in entity_store.tanks():
+        tank.post_update()
+
+    for obj in entity_store:
+        obj.post_update()
+    tick_profiler.mark('post_update')
+
+    return running
+
+def remember_states():
+    """Remembers where the moving objects are before a tick, to draw them between two ticks."""
+    for obj in entity_store.tanks():
+        obj.remember_state()
+    for obj in entity_store.bullets():
+        obj.remember_state()
+    # The boxes that did not move since the last tick still have their state
+    # (see PassabilityGrid.follow_moves).
+    for box in passability_grid.moved:
+        box.remember_state()
+    passability_grid.moved.clear()
+    flag.remember_state()
+
+def out_of_ticks():
+    """Returns whether the game has run for MAX_TICKS ticks."""
+    return MAX_TICKS is not None and ticks >= MAX_TICKS
 
-        #   Update object that depends on an other object position (for instance a flag)
-        for tank in tanks_list:
-            tank.post_update()
+def main_loop():
+#-- Control whether the game run
+    running = True
 
-        for obj in game_objects_list:
-            obj.post_update()
+    start_time = time.perf_counter()
+
+    #-- Record the inputs of the match with --record PATH, see replay.py
+    recorder = None
+    record_path = get_option('--record', None)
+    if record_path is not None:
+        import replay
+        recorder = replay.Recorder(sys.modules[__name__])
+
+    # Headless games run the ticks back to back, nothing is drawn or throttled.
+    while running and HEADLESS:
+        tick_profiler.start_tick()
+        running = tick() and not out_of_ticks()
+        if recorder is not None:
+            recorder.end_tick()
+        tick_profiler.end_tick(entity_store)
+
+    #-- Fixed timestep: the time of every frame is added to the accumulator and
+    #   a tick is run for every 1 / TICK_RATE seconds in it, so slow frames do
+    #   not slow the game down and fast frames do not speed it up. The objects
+    #   are then drawn between the last two ticks, at the time left in the accumulator.
+    tick_time   = 1 / TICK_RATE
+    accumulator = tick_time # The first frame runs a tick.
+    events      = []
+    last_time   = time.perf_counter()
+    while running:
+        now = time.perf_counter()
+        accumulator += min(now - last_time, MAX_FRAME_TIME)
+        last_time = now
+
+        #-- Handle the events, they wait for the next tick if none is run this frame.
+        events.extend(pygame.event.get())
+        ticked = False
+        while running and accumulator >= tick_time:
+            if ticked:
+                tick_profiler.end_tick(entity_store)
+            tick_profiler.start_tick()
+            remember_states()
+            running = tick(events) and not out_of_ticks()
+            events = []
+            if recorder is not None:
+                recorder.end_tick()
+            accumulator -= tick_time
+            ticked = True
 
         #-- Update Display
-
-        # Display the background on the screen
-        screen.blit(background, (0, 0))
-
-        # Update the display of the game objects on the screen
-        for obj in game_objects_list:
-            obj.update_screen(screen)
-
-        #   Redisplay the entire screen (see double buffer technique)
-        pygame.display.flip()
-
-        #   Control the game framerate
-        clock.tick(FRAMERATE)
-
-collision_handlers()
-create_background()
-create_objects()
-main_loop()
-
-
+        # Restore the background where something changed, redraw the game objects
+        # there and send only those parts of the screen to the display.
+        gameobjects.render_alpha = min(accumulator / tick_time, 1.0)
+        screen_renderer.render(entity_store)
+        # The drawing is counted in the last tick of the frame.
+        if ticked:
+            tick_profiler.mark('render')
+            tick_profiler.end_tick(entity_store)
+
+        #   Control the frame rate
+        clock.tick(RENDER_RATE)
+
+    if recorder is not None:
+        recorder.save(record_path)
+    if planning_service is not None:
+        planning_service.close()
+    if WIN_CONDITION is not None:
+        print_winner()
+    if HEADLESS:
+        print_tick_rate(ticks, time.perf_counter() - start_time)
+    if '--stats' in sys.argv:
+        print_stats(ticks)
+    if '--profile' in sys.argv:
+        tick_profiler.print_report()
+
+if __name__ == '__main__':
+    setup_map(load_map_option())
+    start_game()
+    main_loop()
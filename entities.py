@@ -0,0 +1,112 @@
+import gameobjects
+
+
+def kind_of(obj):
+    """Returns the name of the index an object is stored in."""
+    if isinstance(obj, gameobjects.Tank):
+        return 'tanks'
+    if isinstance(obj, gameobjects.Bullet):
+        return 'bullets'
+    if isinstance(obj, gameobjects.Box):
+        return 'boxes'
+    if isinstance(obj, gameobjects.Flag):
+        return 'flags'
+    if isinstance(obj, gameobjects.GameVisibleObject):
+        return 'bases'
+    return 'others'
+
+
+class EntityStore:
+    """ 
+    Holds all the game objects. Every object gets a stable id when it is added,
+    adding and removing objects are O(1), and the objects are also indexed by
+    type (tanks, bullets, boxes, flags, bases). Iterating over the store, or
+    over one of the types, gives the objects in the order they were added.
+    Tanks can also be looked up by their slot (their player number - 1).
+    The store must not be changed while it is iterated over.
+    """
+
+    KINDS = ('tanks', 'bullets', 'boxes', 'flags', 'bases', 'others')
+
+    def __init__(self):
+        self.next_id  = 0
+        self.objects  = {}                                  # Id -> object, in insertion order.
+        self.by_kind  = {kind: {} for kind in self.KINDS}   # Kind -> {id: object}
+        self.slots    = {}                                  # Slot -> tank
+        # Kind -> number of times objects of that kind were added or removed,
+        # so that a kind that rarely changes (boxes) can be cached.
+        self.revisions = {kind: 0 for kind in self.KINDS}
+
+    def add(self, obj, slot=None):
+        """Adds an object (a tank in the given slot if slot is given) and returns its id."""
+        obj.entity_id = self.next_id
+        self.next_id += 1
+        self.objects[obj.entity_id] = obj
+        kind = kind_of(obj)
+        self.by_kind[kind][obj.entity_id] = obj
+        self.revisions[kind] += 1
+        if slot is not None:
+            obj.slot = slot
+            self.slots[slot] = obj
+        return obj.entity_id
+
+    def remove(self, obj):
+        """Removes an object, returns False if it was not in the store."""
+        entity_id = getattr(obj, 'entity_id', None)
+        if self.objects.get(entity_id) is not obj:
+            return False
+        del self.objects[entity_id]
+        kind = kind_of(obj)
+        del self.by_kind[kind][entity_id]
+        self.revisions[kind] += 1
+        slot = getattr(obj, 'slot', None)
+        if slot is not None and self.slots.get(slot) is obj:
+            del self.slots[slot]
+        return True
+
+    def clear(self):
+        self.objects.clear()
+        for kind, index in self.by_kind.items():
+            index.clear()
+            self.revisions[kind] += 1
+        self.slots.clear()
+
+    def get(self, entity_id):
+        return self.objects.get(entity_id)
+
+    def __contains__(self, obj):
+        return self.objects.get(getattr(obj, 'entity_id', None)) is obj
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __iter__(self):
+        return iter(self.objects.values())
+
+    def tanks(self):
+        return self.by_kind['tanks'].values()
+
+    def bullets(self):
+        return self.by_kind['bullets'].values()
+
+    def boxes(self):
+        return self.by_kind['boxes'].values()
+
+    def bases(self):
+        return self.by_kind['bases'].values()
+
+    def of_kind(self, kind):
+        return self.by_kind[kind].values()
+
+    @property
+    def flag(self):
+        """The flag, or None if there is no flag."""
+        return next(iter(self.by_kind['flags'].values()), None)
+
+    def tank_at(self, slot):
+        """Returns the tank in a slot, or None if the slot is empty."""
+        return self.slots.get(slot)
+
+    def counts(self):
+        """Returns the number of objects of each kind."""
+        return {kind: len(index) for kind, index in self.by_kind.items()}
@@ -2,6 +2,7 @@ import images
 import pygame
 import pymunk
 import math
+from collections import OrderedDict
 
 
 DEBUG = False # Change this to set it in debug mode
@@ -11,6 +12,62 @@ def physics_to_display(x):
     """This function is used to convert coordinates in the physic engine into the display coordinates."""
     return x * images.TILE_SIZE
 
+# Where the objects are drawn between the last two ticks: 0 at the previous tick
+# and 1 at the last tick (see ctf.main_loop). Only the objects that remembered
+# their state before the last tick (remember_state) are drawn in between.
+render_alpha = 1.0
+
+def interpolate(previous, current):
+    """Returns the value between previous and current at render_alpha."""
+    return previous + (current - previous) * render_alpha
+
+
+class RotationCache:
+    """
+    Keeps rotated copies of sprites so that each (sprite, angle) pair is only
+    rotated once. Angles are rounded to ANGLE_STEP degrees, and when more than
+    max_size rotated sprites are stored the least recently used one is evicted.
+    """
+
+    ANGLE_STEP = 1 # Size of an angle bucket, in degrees.
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.entries  = OrderedDict()
+        self.hits     = 0
+        self.misses   = 0
+
+    def rotate(self, sprite, angle):
+        """Returns the sprite rotated by angle (in degrees), rotating it only on a cache miss."""
+        bucket = int(round(angle / self.ANGLE_STEP)) % (360 // self.ANGLE_STEP)
+        key = (sprite, bucket)
+        rotated = self.entries.get(key)
+        if rotated is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return rotated
+
+        self.misses += 1
+        rotated = pygame.transform.rotate(sprite, bucket * self.ANGLE_STEP)
+        self.entries[key] = rotated
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False) # Evict the least recently used sprite.
+        return rotated
+
+    def clear(self):
+        """Removes all rotated sprites and resets the counters."""
+        self.entries.clear()
+        self.hits   = 0
+        self.misses = 0
+
+    def stats(self):
+        """Returns the hit/miss counters and the number of cached sprites."""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+
+# Rotation cache shared by every game object.
+rotation_cache = RotationCache()
+
 
 class GameObject:
     """ 
@@ -23,6 +80,7 @@ class GameObject:
 
     def __init__(self, sprite):
         self.sprite = sprite
+        self.previous_state = None # State before the last tick, to draw the object between ticks.
 
     def update(self):
         """ 
@@ -41,12 +99,20 @@ class GameObject:
     def update_screen(self, screen):
         """ 
         Updates the visual part of the game. Should NOT need to be changed
-        by a subclass.
+        by a subclass. Returns the rectangle of the screen that was drawn on.
+        """
+        sprite, rect = self.screen_sprite()
+        return screen.blit(sprite, rect) # Copy the sprite on the screen
+
+    def screen_sprite(self):
+        """ 
+        Returns the rotated sprite of the object and the rectangle of the
+        screen it covers.
         """
         sprite = self.sprite
 
         p = self.screen_position() # Get the position of the object (pygame coordinates)
-        sprite = pygame.transform.rotate(sprite, self.screen_orientation()) # Rotate the sprite using the rotation of the object
+        sprite = rotation_cache.rotate(sprite, self.screen_orientation()) # Rotate the sprite using the rotation of the object
 
         # The position of the screen correspond to the center of the object,
         # but the function screen.blit expect to receive the top left corner
@@ -55,7 +121,8 @@ class GameObject:
         # corner of the sprite
         offset = pymunk.Vec2d(sprite.get_size()) / 2.
         p = p - offset
-        screen.blit(sprite, p) # Copy the sprite on the screen
+        # Truncate the corner the same way screen.blit does.
+        return sprite, pygame.Rect(int(p[0]), int(p[1]), sprite.get_width(), sprite.get_height())
 
 
 
@@ -105,30 +172,53 @@ class GamePhysicsObject(GameObject):
         self.shape.friction = 0.5
         self.shape.elasticity = 0.1
 
-        # Add the object to the physic engine.
+        # Add the object to the physic engine. Without a space the shape is
+        # left out, for rock boxes that are merged into walls (see geometry.py).
+        if space is None:
+            return
         if(movable):
             space.add(self.body, self.shape)
         else:
             space.add(self.shape)
 
 
+    def reset(self, x, y, orientation):
+        """Moves the object back to (x,y) with the given orientation, at rest."""
+        self.body.position          = x, y
+        self.body.angle             = math.radians(orientation)
+        self.body.velocity          = 0, 0
+        self.body.angular_velocity  = 0
+        self.body.force             = 0, 0
+        self.body.torque            = 0
+        # Do not draw the object on its way back.
+        self.previous_state         = None
+
+    def remember_state(self):
+        """Call this before a tick, so that the object can be drawn between the ticks."""
+        self.previous_state = (self.body.position, self.body.angle)
+
     def screen_position(self):
         """Converts the body's position in the physics engine to screen coordinates."""
-        return physics_to_display(self.body.position)
+        if self.previous_state is None:
+            return physics_to_display(self.body.position)
+        return physics_to_display(interpolate(self.previous_state[0], self.body.position))
 
     def screen_orientation(self):
         """Angles are reversed from the engine to the display."""
-        return -math.degrees(self.body.angle)
+        if self.previous_state is None:
+            return -math.degrees(self.body.angle)
+        return -math.degrees(interpolate(self.previous_state[1], self.body.angle))
 
     def update_screen(self, screen):
-        super().update_screen(screen)
+        rect = super().update_screen(screen)
         # debug draw
         if DEBUG:
             ps = [self.body.position+p for p in self.points]
 
             ps = [physics_to_display(p) for p in ps]
             ps += [ps[0]]
-            pygame.draw.lines(screen, pygame.color.THECOLORS["red"], False, ps, 1)
+            rect = rect.union(pygame.draw.lines(screen, pygame.color.THECOLORS["red"], False, ps, 1))
+        return rect
 
 
 
@@ -144,6 +234,13 @@ class Tank(GamePhysicsObject):
     ACCELERATION = 0.4
     NORMAL_MAX_SPEED = 2.0
     FLAG_MAX_SPEED = NORMAL_MAX_SPEED * 0.5
+    SHOOT_COOLDOWN = 50 # Frames between two shots.
+
+    # The inputs that control a tank. If input_listener is set, it is called
+    # with the tank and the name of the input every time a tank gets an input
+    # (this is used to record replays).
+    INPUTS = ('accelerate', 'decelerate', 'turn_left', 'turn_right', 'stop_moving', 'stop_turning', 'shoot')
+    input_listener = None
     
 
     def __init__(self, x, y, orientation, sprite, space):
@@ -152,9 +249,6 @@ class Tank(GamePhysicsObject):
         self.acceleration = 0 # 1 forward, 0 for stand still, -1 for backwards.
         self.rotation = 0 # 1 clockwise, 0 for no rotation, -1 counter clockwise.
         self.shape.collision_type = 2
-        self.shape = pymunk.Poly(self.body, self.points)
-        self.shape.parent = self
-
 
 
         self.flag           = None                      # This variable is used to access the flag object, if the current tank is carrying the flag.
@@ -164,29 +258,48 @@ class Tank(GamePhysicsObject):
         self.frame = 0
 
 
+    def reset(self, x, y, orientation):
+        """Puts the tank back at its start, as it was when it was created."""
+        super().reset(x, y, orientation)
+        self.acceleration   = 0
+        self.rotation       = 0
+        self.flag           = None
+        self.max_speed      = Tank.NORMAL_MAX_SPEED
+        self.frame          = 0
+
+    def notify_input(self, name):
+        if Tank.input_listener is not None:
+            Tank.input_listener(self, name)
+
     def accelerate(self):
         """Call this function to make the tank move forward."""
+        self.notify_input('accelerate')
         self.acceleration = 1
 
     def stop_moving(self):
         """Call this function to make the tank stop moving."""
+        self.notify_input('stop_moving')
         self.acceleration  = 0
         self.body.velocity = pymunk.Vec2d.zero()
 
     def decelerate(self):
         """Call this function to make the tank move backward."""
+        self.notify_input('decelerate')
         self.acceleration = -1
 
     def turn_left(self):
         """Makes the tank turn left (counter clock-wise)."""
+        self.notify_input('turn_left')
         self.rotation = -1
 
     def turn_right(self):
         """Makes the tankelf.frame = 0 turn right (clock-wise)."""
+        self.notify_input('turn_right')
         self.rotation = 1
 
     def stop_turning(self):
         """Call this function to make the tank stop turning."""
+        self.notify_input('stop_turning')
         self.rotation = 0
         self.body.angular_velocity = 0
 
@@ -239,14 +352,20 @@ class Tank(GamePhysicsObject):
         """Check if the current tank has won (if it is has the flag and it is close to its start position)."""
         return self.flag != None and (self.start_position - self.body.position).length < 0.3
 
-    def shoot(self, space, obj_list):
-        """Call this function to shoot a missile."""
-        if self.frame > 50:
-            self.frame = 0    
-            bullet = Bullet(self.body.position[0]+(math.cos(self.body.angle+math.radians(90)))*0.5, \
+    def can_shoot(self):
+        """Returns whether enough frames have passed since the last shot to shoot again."""
+        return self.frame > Tank.SHOOT_COOLDOWN
+
+    def shoot(self, space, entities):
+        """Call this function to shoot a missile, the bullet is taken from the bullet pool and added to the entity store."""
+        self.notify_input('shoot')
+        if self.can_shoot():
+            bullet = bullet_pool.acquire(self.body.position[0]+(math.cos(self.body.angle+math.radians(90)))*0.5, \
                 self.body.position[1]+(math.sin(self.body.angle+math.radians(90)))*0.5, \
-                math.degrees(self.body.angle), images.bullet, space)
-            obj_list.append(bullet) 
+                math.degrees(self.body.angle), space, entities)
+            # No bullet is fired with --max-bullets 0, then the tank can try again next frame.
+            if bullet is not None:
+                self.frame = 0
 
     def drop_flag(self, flag):
         if self.flag:
@@ -262,18 +381,77 @@ class Bullet(GamePhysicsObject):
     
     def __init__(self, x, y, orientation, sprite, space):
         super().__init__(x, y, orientation, sprite, space, True)
-        # Define variable used to apply motion to the bullet.
-
         self.shape.collision_type = 1
-        self.shape = pymunk.Poly(self.body, self.points)
-        self.shape.parent = self
-    
+        self.active = True # False while the bullet waits in the pool.
+
     def update(self):
         # Creates a vector in the direction we want accelerate.
         acceleration_vector = pymunk.Vec2d(0, self.SPEED).rotated(self.body.angle)
         # Applies the vector tao our velocity.
         self.body.velocity += acceleration_vector
 
+
+class BulletPool:
+    """ 
+    Reuses bullets instead of creating a new body and shape for every shot.
+    A bullet that hits something is removed from the space and kept in the
+    pool until it is fired again. At most max_bullets bullets are ever
+    created, when they are all flying the one fired first is taken out of
+    the game and fired again, so bullets that keep bouncing around can not
+    stop the tanks from shooting.
+    """
+
+    def __init__(self, max_bullets=256):
+        self.max_bullets    = max_bullets
+        self.free           = []
+        self.flying         = {}  # Flying bullets, in the order they were fired (the values are unused).
+        self.allocated      = 0
+        self.recycled       = 0   # Number of flying bullets taken out to be fired again.
+
+    def acquire(self, x, y, orientation, space, entities):
+        """Fires a bullet from (x,y), returns it or None if max_bullets is 0."""
+        if not self.free and self.allocated >= self.max_bullets and self.flying:
+            self.release(next(iter(self.flying)), entities)
+            self.recycled += 1
+        if self.free:
+            bullet = self.free.pop()
+            bullet.reset(x, y, orientation)
+            space.add(bullet.body, bullet.shape)
+            bullet.active = True
+        elif self.allocated < self.max_bullets:
+            bullet = Bullet(x, y, orientation, images.bullet, space)
+            self.allocated += 1
+        else:
+            return None
+        entities.add(bullet)
+        self.flying[bullet] = None
+        return bullet
+
+    def release(self, bullet, entities):
+        """Takes a bullet out of the game, it can be released more than once in a step."""
+        if not bullet.active:
+            return
+        bullet.active = False
+        if bullet.body.space is not None:
+            bullet.body.space.remove(bullet.shape, bullet.body)
+        entities.remove(bullet)
+        self.free.append(bullet)
+        del self.flying[bullet]
+
+    def release_all(self, entities):
+        """Releases every flying bullet, for instance when a new round or game starts."""
+        for bullet in list(entities.bullets()):
+            self.release(bullet, entities)
+
+    def stats(self):
+        """Returns the number of live, free, allocated and recycled bullets and the limit."""
+        return {'live': len(self.flying), 'free': len(self.free), 'allocated': self.allocated,
+                'recycled': self.recycled, 'max': self.max_bullets}
+
+
+# Bullet pool shared by every tank.
+bullet_pool = BulletPool()
+
 class Box(GamePhysicsObject):
     """This class extends the GamePhysicsObject to handle box objects."""
 
@@ -304,11 +482,20 @@ class GameVisibleObject(GameObject):
         self.orientation  = 0
         super().__init__(sprite)
 
+    def remember_state(self):
+        """Call this before a tick, so that the object can be drawn between the ticks."""
+        self.previous_state = (self.x, self.y, self.orientation)
+
     def screen_position(self):
-        return physics_to_display(pymunk.Vec2d(self.x, self.y))
+        if self.previous_state is None:
+            return physics_to_display(pymunk.Vec2d(self.x, self.y))
+        x, y, orientation = self.previous_state
+        return physics_to_display(pymunk.Vec2d(interpolate(x, self.x), interpolate(y, self.y)))
 
     def screen_orientation(self):
-        return self.orientation
+        if self.previous_state is None:
+            return self.orientation
+        return interpolate(self.previous_state[2], self.orientation)
 
 
 
@@ -0,0 +1,280 @@
+import weakref
+from array import array
+
+#-- Tile types, the same values as in maps.Map.boxes
+GRASS    = 0
+ROCKBOX  = 1
+WOODBOX  = 2
+METALBOX = 3
+
+#-- Lookup tables from tile type to whether the ai can drive there (wood boxes
+#   can be shot away, metal boxes can only be pushed).
+PASSABLE            = bytes([1, 0, 1, 0])
+PASSABLE_METALBOX   = bytes([1, 0, 1, 1])
+
+
+class ChangeSet(set):
+    """Indices of the tiles that changed, collected for one incremental planner (see PassabilityGrid.subscribe)."""
+    # Compared by identity, so the grid can keep it in a weak set.
+    __eq__   = object.__eq__
+    __ne__   = object.__ne__
+    __hash__ = object.__hash__
+
+
+class PassabilityGrid:
+    """ 
+    A compact copy of the tiles of a map that the ai uses for path finding.
+    The tiles are stored row by row in a flat bytearray, surrounded by a border
+    of rock boxes so that a neighbour is always found at a fixed offset from
+    a tile and never needs a bounds check. The grid follows the boxes in the
+    game: destroyed boxes turn into grass and pushed boxes move to their new tile.
+    """
+
+    def __init__(self, width, height):
+        self.width    = width
+        self.height   = height
+        self.stride   = width + 2
+        self.tiles    = bytearray([ROCKBOX]) * (self.stride * (height + 2))
+        # Offsets to the left, right, upper and lower neighbour of a tile.
+        self.offsets  = (-1, 1, -self.stride, self.stride)
+        self.version  = 0   # Incremented every time a tile changes.
+        # The change sets of the incremental planners, forgotten with the planners.
+        self.subscribers = weakref.WeakSet()
+        self.boxes    = {}  # Box -> (index of its tile, tile type) for the boxes that can change.
+        self.occupant = {}  # Index of a tile -> box on that tile.
+        # Boxes that moved since ctf.remember_states emptied it, and the position
+        # and angle of every box, only when follow_moves() was called.
+        self.moved    = None
+        self.states   = {}
+        self.bfs_expansions = 0 # Nodes expanded by bfs, to compare it with the planners.
+
+    @classmethod
+    def from_map(cls, currentmap):
+        """Creates a grid with the tiles of a maps.Map."""
+        grid = cls(currentmap.width, currentmap.height)
+        for y in range(currentmap.height):
+            start = grid.index(0, y)
+            grid.tiles[start:start + currentmap.width] = currentmap.boxes.row(y)
+        return grid
+
+    def index(self, x, y):
+        """Returns the index in the flat array of the tile (x, y)."""
+        return (y + 1) * self.stride + x + 1
+
+    def coords(self, index):
+        """Returns the tile coordinates (x, y) of an index in the flat array."""
+        y, x = divmod(index, self.stride)
+        return x - 1, y - 1
+
+    def passable(self, allow_metalbox=False):
+        """Returns the lookup table from tile type to passable."""
+        return PASSABLE_METALBOX if allow_metalbox else PASSABLE
+
+    def tile_at(self, x, y):
+        """Returns the type of the tile (x, y)."""
+        return self.tiles[self.index(x, y)]
+
+    def set_tile(self, x, y, type):
+        """Changes the type of the tile (x, y)."""
+        self.set_index(self.index(x, y), type)
+
+    def set_index(self, index, type):
+        if self.tiles[index] != type:
+            self.tiles[index] = type
+            self.version += 1
+            for changes in self.subscribers:
+                changes.add(index)
+
+    def subscribe(self):
+        """ 
+        Returns a ChangeSet that collects the indices of the tiles that change
+        from now on. The planner empties it when it has read it, so it never
+        holds more than the tiles of the grid.
+        """
+        changes = ChangeSet()
+        self.subscribers.add(changes)
+        return changes
+
+    def tile_of_box(self, box):
+        x, y = box.body.position
+        return self.index(int(x), int(y))
+
+    def track(self, box, type):
+        """Follows a box that can be destroyed or pushed, so that the grid stays up to date."""
+        index = self.tile_of_box(box)
+        self.boxes[box] = (index, type)
+        if self.moved is not None:
+            self.states[box] = (box.body.position, box.body.angle)
+        self.occupant[index] = box
+        # A box recreated at the start of a round fills its tile again.
+        if self.tiles[index] != type:
+            self.set_index(index, type)
+
+    def remove_box(self, box):
+        """Call this when a box is destroyed, its tile becomes grass."""
+        if box in self.boxes:
+            index, type = self.boxes.pop(box)
+            if self.moved is not None:
+                del self.states[box]
+                self.moved.discard(box)
+            if self.occupant.get(index) is box:
+                del self.occupant[index]
+                self.set_index(index, GRASS)
+
+    def follow_moves(self):
+        """ 
+        Makes update_boxes collect the boxes that moved or turned in moved, for
+        a game that draws the boxes between two ticks. It costs reading the
+        angle of every box, so headless games do not call it.
+        """
+        self.moved  = set()
+        self.states = {box: (box.body.position, box.body.angle) for box in self.boxes}
+
+    def update_boxes(self):
+        """Call this after every physics step to move the pushed boxes to their new tile."""
+        if self.moved is not None:
+            self.update_moved_boxes()
+            return
+        for box, (index, type) in self.boxes.items():
+            new_index = self.tile_of_box(box)
+            if new_index != index:
+                self.move_box(box, index, new_index, type)
+
+    def update_moved_boxes(self):
+        """update_boxes with follow_moves(), only the boxes whose body moved or turned are looked at."""
+        states = self.states
+        for box, (index, type) in self.boxes.items():
+            body  = box.body
+            state = (body.position, body.angle)
+            if state == states[box]:
+                continue
+            states[box] = state
+            self.moved.add(box)
+            x, y = state[0]
+            new_index = self.index(int(x), int(y))
+            if new_index != index:
+                self.move_box(box, index, new_index, type)
+
+    def move_box(self, box, index, new_index, type):
+        if self.occupant.get(index) is box:
+            del self.occupant[index]
+            self.set_index(index, GRASS)
+        # Boxes can not be pushed into the border.
+        if self.tiles[new_index] != ROCKBOX:
+            self.occupant[new_index] = box
+            self.set_index(new_index, type)
+        self.boxes[box] = (new_index, type)
+
+    def bfs(self, start, target, allow_metalbox=False):
+        """ 
+        Breadth first search on the flat indices from start to target.
+        Returns the list of indices from the tile after start up to target,
+        or an empty list if the target can not be reached.
+        """
+        tiles     = self.tiles
+        passable  = self.passable(allow_metalbox)
+        stride    = self.stride
+        parent    = array('l', [-1]) * len(tiles)
+        parent[start] = start
+        queue     = [start]
+        append    = queue.append
+        # The queue is a list that only grows, iterating over it visits the nodes in order.
+        for expanded, node in enumerate(queue, 1):
+            if node == target:
+                self.bfs_expansions += expanded
+                path = []
+                while node != start:
+                    path.append(node)
+                    node = parent[node]
+                path.reverse()
+                return path
+            for neighbour in (node - 1, node + 1, node - stride, node + stride):
+                if parent[neighbour] < 0 and passable[tiles[neighbour]]:
+                    parent[neighbour] = node
+                    append(neighbour)
+        self.bfs_expansions += len(queue)
+        return []
+
+
+class DistanceFields:
+    """ 
+    Distances from every tile to the targets of the ais (the flag and the bases),
+    shared by all ais. A field is computed once per target tile and version
+    of the grid with a breadth first search backwards from the target. With
+    the field, the next tile on a shortest path is the neighbour closest to the target.
+    """
+
+    MAX_FIELDS = 32 # Fields kept for the current version of the grid.
+
+    def __init__(self, passability_grid):
+        self.grid     = passability_grid
+        self.fields   = {}  # (target, allow_metalbox) -> distances
+        self.version  = passability_grid.version
+        self.computed = 0   # Number of fields computed, used to check that they are shared.
+
+    def field(self, target, allow_metalbox=False):
+        """Returns the distances to the target index, -1 for tiles that can not reach it."""
+        if self.version != self.grid.version:
+            self.fields.clear()
+            self.version = self.grid.version
+        key = (target, allow_metalbox)
+        distances = self.fields.get(key)
+        if distances is None:
+            if len(self.fields) >= self.MAX_FIELDS:
+                del self.fields[next(iter(self.fields))] # Forget the oldest field.
+            distances = self.compute(target, allow_metalbox)
+            self.fields[key] = distances
+            self.computed += 1
+        return distances
+
+    def compute(self, target, allow_metalbox):
+        """ 
+        Breadth first search from the target. A tile is only expanded if it is
+        passable, since that is required to drive into it.
+        """
+        tiles     = self.grid.tiles
+        passable  = self.grid.passable(allow_metalbox)
+        stride    = self.grid.stride
+        distances = array('l', [-1]) * len(tiles)
+        distances[target] = 0
+        queue     = [target]
+        append    = queue.append
+        for node in queue:
+            if node != target and not passable[tiles[node]]:
+                continue
+            distance = distances[node] + 1
+            for neighbour in (node - 1, node + 1, node - stride, node + stride):
+                if distances[neighbour] < 0:
+                    distances[neighbour] = distance
+                    append(neighbour)
+        return distances
+
+    def next_tile(self, start, target, allow_metalbox=False):
+        """ 
+        Returns the index of the next tile on a shortest path from start to
+        target, or None if we are at the target or it can not be reached.
+        """
+        tiles     = self.grid.tiles
+        passable  = self.grid.passable(allow_metalbox)
+        # A box on the target (a metal box pushed onto the flag) blocks it, as in bfs.
+        if start == target or not passable[tiles[target]]:
+            return None
+        distances = self.field(target, allow_metalbox)
+        if distances[start] < 0:
+            return None
+        best      = None
+        for offset in self.grid.offsets:
+            neighbour = start + offset
+            distance  = distances[neighbour]
+            if distance >= 0 and passable[tiles[neighbour]] and (best is None or distance < distances[best]):
+                best = neighbour
+        return best
+
+    def path(self, start, target, allow_metalbox=False):
+        """Returns the list of indices after start up to target, following the field."""
+        path = []
+        node = self.next_tile(start, target, allow_metalbox)
+        while node is not None:
+            path.append(node)
+            node = self.next_tile(node, target, allow_metalbox)
+        return path
@@ -1,5 +1,7 @@
 import pygame
 import os
+import json
+import struct
 
 #-- Load the sounds and images
 main_dir = os.path.split(os.path.abspath(__file__))[0]
@@ -16,32 +18,199 @@ def load_image(file):
         surface = pygame.image.load(file)
     except pygame.error:
         raise SystemExit('Could not load image "%s" %s'%(file, pygame.get_error()))
-    return surface.convert_alpha()
+    return convert(surface)
+
+def convert(surface):
+    """Converts a surface to the pixel format of the display, if there is one, for fast blitting."""
+    if pygame.display.get_init() and pygame.display.get_surface() is not None:
+        return surface.convert_alpha()
+    return surface
 
 
 TILE_SIZE = 40 # Define the default size of tiles
 
-#-- Load all images with the function load_images
-explosion = load_image('explosion.png') # Image of an explosion
- 
-grass     = load_image('grass.png') # Image of a grass tile
+#----- Sprites -----#
+#   The images are loaded the first time one of them is used (images.grass,
+#   images.tanks, ...), not when this module is imported. They are all packed
+#   into one texture atlas, and every sprite is a view (a subsurface) of the
+#   atlas. The atlas, with the bullet already scaled and rotated, is cached on
+#   disk and loaded as one image as long as the files in data are unchanged.
+#
+#   In metadata only mode (see set_metadata_only) nothing is loaded at all:
+#   the sprites only know their size, which is read from the PNG headers. This
+#   is enough for headless games, where nothing is drawn.
+
+# Name -> (file, size to scale to or None, rotation in degrees)
+SPRITES = {
+    'explosion':    ('explosion.png', None, 0), # Image of an explosion
+    'grass':        ('grass.png', None, 0), # Image of a grass tile
+    'rockbox':      ('rockbox.png', None, 0), # Image of a rock box (wall)
+    'metalbox':     ('metalbox.png', None, 0), # Image of a metal box
+    'woodbox':      ('woodbox.png', None, 0), # Image of a wood box
+    'flag':         ('flag.png', None, 0), # Image of flag
+    'bullet':       ('bullet.png', (10, 10), -90),
+}
+
+# Image of tanks of different colors, and of the bases corresponding to the color of each tank
+COLORS = ('orange', 'blue', 'white', 'yellow', 'red', 'gray')
+SPRITES.update({'tank_' + color: ('tank_%s.png' % color, None, 0) for color in COLORS})
+SPRITES.update({'base_' + color: ('base_%s.png' % color, None, 0) for color in COLORS})
+
+# Lists of sprites, in the order of the colors.
+SPRITE_LISTS = {
+    'tanks': ['tank_' + color for color in COLORS],
+    'bases': ['base_' + color for color in COLORS],
+}
+
+CACHE_DIR   = os.path.join(main_dir, '.sprite_cache')
+ATLAS_WIDTH = 256 # Width of the atlas in pixels, the sprites are packed in rows.
+
+metadata_only = False
+atlas         = None
+sprites       = {} # Name -> loaded sprite
+
+
+class SpriteInfo:
+    """Stands in for a sprite in metadata only mode, it only knows its size."""
+
+    def __init__(self, name, width, height):
+        self.name   = name
+        self.width  = width
+        self.height = height
+
+    def get_width(self):
+        return self.width
+
+    def get_height(self):
+        return self.height
 
-rockbox   = load_image('rockbox.png') # Image of a rock box (wall)
+    def get_size(self):
+        return (self.width, self.height)
 
-metalbox  = load_image('metalbox.png') # Image of a metal box
 
-woodbox   = load_image('woodbox.png') # Image of a wood box
+def png_size(file):
+    """Returns the size of a PNG image, read from its header without decoding the image."""
+    with open(os.path.join(main_dir, 'data', file), 'rb') as image:
+        header = image.read(24)
+    if header[:8] != b'\x89PNG\r\n\x1a\n' or header[12:16] != b'IHDR':
+        raise SystemExit('Could not read the size of image "%s"' % file)
+    return struct.unpack('>II', header[16:24])
 
-flag      = load_image('flag.png') # Image of flag
+def sprite_size(name):
+    """Returns the size of a sprite once scaled and rotated, without loading it."""
+    file, size, rotation = SPRITES[name]
+    width, height = size or png_size(file)
+    if rotation % 180 == 90:
+        width, height = height, width
+    return (width, height)
 
-bullet = load_image('bullet.png')
-bullet = pygame.transform.scale(bullet, (10, 10))
-bullet = pygame.transform.rotate(bullet, -90)
 
-# List of image of tanks of different colors
-tanks     = [load_image('tank_orange.png'), load_image('tank_blue.png'), load_image('tank_white.png'),
-             load_image('tank_yellow.png'), load_image('tank_red.png'),  load_image('tank_gray.png')]
+def set_metadata_only(enabled=True):
+    """
+    In metadata only mode the sprites are SpriteInfo objects that only know their
+    size, and pygame is never used to load an image. Sprites used before the
+    mode changes are forgotten.
+    """
+    global metadata_only, atlas
+    metadata_only = enabled
+    atlas = None
+    for name in list(sprites) + list(SPRITE_LISTS):
+        globals().pop(name, None)
+    sprites.clear()
+
+
+def preprocess(name):
+    """Loads the image of a sprite from the data directory, scaled and rotated."""
+    file, size, rotation = SPRITES[name]
+    surface = pygame.image.load(os.path.join(main_dir, 'data', file))
+    if size is not None:
+        surface = pygame.transform.scale(surface, size)
+    if rotation != 0:
+        surface = pygame.transform.rotate(surface, rotation)
+    return surface
+
+def pack(sizes):
+    """Places rectangles of the given sizes in rows, returns name -> (x, y, width, height) and the atlas height."""
+    rects = {}
+    x = y = row_height = 0
+    for name in sorted(sizes, key=lambda name: (-sizes[name][1], name)):
+        width, height = sizes[name]
+        if x + width > ATLAS_WIDTH:
+            x = 0
+            y += row_height
+            row_height = 0
+        rects[name] = (x, y, width, height)
+        x += width
+        row_height = max(row_height, height)
+    return rects, y + row_height
+
+def source_key():
+    """Identifies the version of the image files, the cached atlas is only valid for this key."""
+    key = []
+    for name in sorted(SPRITES):
+        file, size, rotation = SPRITES[name]
+        stat = os.stat(os.path.join(main_dir, 'data', file))
+        key.append([name, file, size and list(size), rotation, stat.st_size, stat.st_mtime_ns])
+    return key
+
+def build_atlas():
+    """Loads and preprocesses every sprite and packs them into one surface."""
+    surfaces = {name: preprocess(name) for name in SPRITES}
+    rects, height = pack({name: surface.get_size() for name, surface in surfaces.items()})
+    surface = pygame.Surface((ATLAS_WIDTH, height), pygame.SRCALPHA, 32)
+    for name, (x, y, width, height) in rects.items():
+        surface.blit(surfaces[name], (x, y))
+    return surface, rects
+
+def load_atlas():
+    """Returns the atlas and the rectangle of every sprite in it, from the disk cache when it is valid."""
+    key = source_key()
+    index_file = os.path.join(CACHE_DIR, 'atlas.json')
+    image_file = os.path.join(CACHE_DIR, 'atlas.png')
+    try:
+        with open(index_file) as file:
+            index = json.load(file)
+        if index['key'] == key:
+            return pygame.image.load(image_file), {name: tuple(rect) for name, rect in index['rects'].items()}
+    except (OSError, ValueError, KeyError, pygame.error):
+        pass
+
+    surface, rects = build_atlas()
+    # The cache is only an optimisation, the game runs without it.
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        pygame.image.save(surface, image_file)
+        with open(index_file, 'w') as file:
+            json.dump({'key': key, 'rects': rects}, file)
+    except (OSError, pygame.error):
+        pass
+    return surface, rects
+
+def sprite(name):
+    """Returns a sprite, loading the atlas the first time a sprite is used."""
+    global atlas
+    loaded = sprites.get(name)
+    if loaded is not None:
+        return loaded
+    if metadata_only:
+        loaded = SpriteInfo(name, *sprite_size(name))
+    else:
+        if atlas is None:
+            surface, rects = load_atlas()
+            atlas = (convert(surface), rects)
+        surface, rects = atlas
+        loaded = surface.subsurface(rects[name])
+    sprites[name] = loaded
+    return loaded
 
-# List of image of bases corresponding to the color of each tank
-bases     = [load_image('base_orange.png'), load_image('base_blue.png'), load_image('base_white.png'),
-             load_image('base_yellow.png'), load_image('base_red.png'),  load_image('base_gray.png')]
\ No newline at end of file
+def __getattr__(name):
+    """Loads images.<sprite name> and images.tanks/images.bases on first use."""
+    if name in SPRITES:
+        value = sprite(name)
+    elif name in SPRITE_LISTS:
+        value = [sprite(sprite_name) for sprite_name in SPRITE_LISTS[name]]
+    else:
+        raise AttributeError("module 'images' has no attribute '%s'" % name)
+    # Later uses find the sprite directly, without calling __getattr__.
+    globals()[name] = value
+    return value
@@ -0,0 +1,219 @@
+import os
+import re
+import sys
+import json
+import math
+import mmap
+import struct
+import zlib
+import maps
+
+#----- Compiled maps -----#
+#   A compiled map (.ctfm) is a small header followed by the tiles, one byte
+#   per tile row by row, so that the tiles can be used straight from a memory
+#   mapped file without reading or parsing anything. JSON maps are validated
+#   and compiled the first time they are used, and the compiled file is kept
+#   in CACHE_DIR until the JSON file changes.
+#
+#   Header: magic, version, width, height, number of players, modification
+#   time and size of the source file (0 if there is none), then the start
+#   positions (x, y, angle) and the flag position (x, y) as doubles.
+#
+#   Compile a map:  python3 mapfile.py map.json map.ctfm
+#                   python3 mapfile.py map1 map1.ctfm       (a map of maps.py)
+
+MAGIC   = b'CTFM'
+VERSION = 1
+HEADER  = struct.Struct('<4sHIIBqq')
+
+# Any byte that is not a box type (0 to 3).
+BAD_TILE = re.compile(b'[^\x00-\x03]')
+
+main_dir  = os.path.split(os.path.abspath(__file__))[0]
+CACHE_DIR = os.path.join(main_dir, '.map_cache')
+
+
+class MapError(Exception):
+    """Raised when a map file is invalid."""
+
+
+class MappedTiles(maps.TileGrid):
+    """The tiles of a compiled map, read from a memory mapped file instead of chunks."""
+
+    def __init__(self, data, offset, width, height):
+        super().__init__(width, height)
+        self.data   = data
+        self.offset = offset
+
+    def get(self, x, y):
+        return self.data[self.offset + y * self.width + x]
+
+    def set(self, x, y, type):
+        raise MapError('The tiles of a compiled map can not be changed')
+
+    def set_row(self, y, row):
+        raise MapError('The tiles of a compiled map can not be changed')
+
+    def row(self, y, start=0, stop=None):
+        stop = self.width if stop is None else min(stop, self.width)
+        begin = self.offset + y * self.width
+        return self.data[begin + start:begin + stop]
+
+    def counts(self):
+        counts = [0, 0, 0, 0]
+        for y in range(self.height):
+            row = self.row(y)
+            for type in range(1, 4):
+                counts[type] += row.count(type)
+        counts[0] = self.width * self.height - sum(counts)
+        return counts
+
+    def memory(self):
+        # The tiles are in the page cache, not in the memory of the process.
+        return 0
+
+
+def is_integer(value):
+    # JSON true and false are bools, which are ints in Python.
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def is_number(value):
+    return (is_integer(value) or isinstance(value, float)) and math.isfinite(value)
+
+def validate(width, height, rows, start_positions, flag_position):
+    """Checks that a map makes sense, raises MapError otherwise."""
+    if not is_integer(width) or not is_integer(height) or width <= 0 or height <= 0:
+        raise MapError('The size of the map must be positive integers, not %r x %r' % (width, height))
+    if len(rows) != height:
+        raise MapError('The map has %d rows of boxes but a height of %d' % (len(rows), height))
+    for y, row in enumerate(rows):
+        if len(row) != width:
+            raise MapError('Row %d has %d boxes but the map has a width of %d' % (y, len(row), width))
+        if any(not is_integer(type) or type not in (0, 1, 2, 3) for type in row):
+            raise MapError('Row %d has an unknown box type, types are 0 to 3' % y)
+    if not 0 < len(start_positions) < 256:
+        raise MapError('A map must have between 1 and 255 start positions, not %d' % len(start_positions))
+    for position in start_positions:
+        if (len(position) != 3 or not all(is_number(value) for value in position)
+                or not (0 <= position[0] <= width and 0 <= position[1] <= height)):
+            raise MapError('Start position %r is not (x, y, angle) inside the map' % (position,))
+    if (len(flag_position) != 2 or not all(is_number(value) for value in flag_position)
+            or not (0 <= flag_position[0] <= width and 0 <= flag_position[1] <= height)):
+        raise MapError('Flag position %r is not (x, y) inside the map' % (flag_position,))
+
+
+def to_bytes(game_map, source_stat=None):
+    """Returns a map compiled to bytes."""
+    mtime, size = (source_stat.st_mtime_ns, source_stat.st_size) if source_stat else (0, 0)
+    parts = [HEADER.pack(MAGIC, VERSION, game_map.width, game_map.height, len(game_map.start_positions), mtime, size)]
+    for x, y, angle in game_map.start_positions:
+        parts.append(struct.pack('<ddd', x, y, angle))
+    parts.append(struct.pack('<dd', *game_map.flag_position))
+    for y in range(game_map.height):
+        parts.append(bytes(game_map.boxes.row(y)))
+    return b''.join(parts)
+
+def compile_map(game_map, path, source_stat=None):
+    """Writes a compiled map. The file is replaced at once, so a running game never reads half a file."""
+    temporary = path + '.tmp'
+    try:
+        with open(temporary, 'wb') as file:
+            file.write(to_bytes(game_map, source_stat))
+        os.replace(temporary, path)
+    except BaseException:
+        # Do not leave half a file in the cache.
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+def compile_json(source, path):
+    """Validates a JSON map (see maps.create_map_jon) and compiles it."""
+    try:
+        with open(source) as file:
+            data = json.load(file)
+        width, height, rows = data['width'], data['height'], data['boxes']
+        start_positions, flag_position = data['start_position'], data['flag_position']
+        # Values of the wrong type ("boxes": 5) fail inside validate.
+        validate(width, height, rows, start_positions, flag_position)
+        compile_map(maps.Map(width, height, rows, start_positions, flag_position), path, os.stat(source))
+    except (ValueError, KeyError, TypeError, struct.error) as error:
+        raise MapError('Could not read map "%s": %s' % (source, error))
+
+
+def read_header(data):
+    """Returns (width, height, players, source mtime, source size) of a compiled map."""
+    if len(data) < HEADER.size:
+        raise MapError('Not a compiled map')
+    magic, version, width, height, players, mtime, size = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise MapError('Not a compiled map of version %d' % VERSION)
+    return width, height, players, mtime, size
+
+def load_compiled(path):
+    """Loads a compiled map, its tiles stay in the memory mapped file."""
+    with open(path, 'rb') as file:
+        # An empty file can not be mapped.
+        if os.fstat(file.fileno()).st_size == 0:
+            raise MapError('Compiled map "%s" is empty' % path)
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    width, height, players, mtime, size = read_header(data)
+    offset = HEADER.size
+    start_positions = []
+    for i in range(players):
+        start_positions.append(list(struct.unpack_from('<ddd', data, offset)))
+        offset += 24
+    flag_position = list(struct.unpack_from('<dd', data, offset))
+    offset += 16
+    if len(data) != offset + width * height:
+        raise MapError('Compiled map "%s" is truncated' % path)
+    # The planners use the tiles as indices in tables of the four box types.
+    if BAD_TILE.search(data, offset):
+        raise MapError('Compiled map "%s" has an unknown box type' % path)
+    return maps.Map(width, height, MappedTiles(data, offset, width, height), start_positions, flag_position)
+
+
+def cache_path(source):
+    """Returns the path of the compiled version of a JSON map in the cache."""
+    source = os.path.abspath(source)
+    name = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join(CACHE_DIR, '%s-%08x.ctfm' % (name, zlib.crc32(source.encode())))
+
+def is_up_to_date(path, source):
+    """Returns whether a compiled map was compiled from the current version of source."""
+    try:
+        with open(path, 'rb') as file:
+            width, height, players, mtime, size = read_header(file.read(HEADER.size))
+    except (OSError, MapError):
+        return False
+    stat = os.stat(source)
+    return (mtime, size) == (stat.st_mtime_ns, stat.st_size)
+
+def load_json(source):
+    """Loads a JSON map through the cache, it is only validated and compiled when it has changed."""
+    path = cache_path(source)
+    if not is_up_to_date(path, source):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        compile_json(source, path)
+    return load_compiled(path)
+
+def load_map(name):
+    """Returns a map from its name in maps.py (map0, map1, ...), a .json file or a .ctfm file."""
+    game_map = getattr(maps, name, None)
+    if isinstance(game_map, maps.Map):
+        return game_map
+    if not os.path.exists(name):
+        raise MapError('No map called "%s"' % name)
+    if name.endswith('.json'):
+        return load_json(name)
+    return load_compiled(name)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        raise SystemExit('Usage: python3 mapfile.py SOURCE OUTPUT.ctfm')
+    source, output = sys.argv[1:]
+    if source.endswith('.json'):
+        compile_json(source, output)
+    else:
+        compile_map(load_map(source), output)
+    print('Compiled', source, 'to', output)
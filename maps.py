@@ -1,15 +1,129 @@
 import images
 import pygame
 import json
+import random
+import re
+
+#-- Compact storage of the tiles of a map
+NOT_GRASS = re.compile(b'[^\\x00]')
+
+class TileGrid:
+  """ 
+  The box types of the tiles of a map, one byte per tile. The map is split
+  into chunks of CHUNK_SIZE x CHUNK_SIZE tiles and chunks with only grass are
+  not stored at all, so large maps use little memory. tiles[y][x] gives the
+  type of a tile like the nested lists that were used before.
+  """
+
+  CHUNK_SIZE = 64
+
+  def __init__(self, width, height):
+    self.width  = width
+    self.height = height
+    self.chunks = {} # (chunk x, chunk y) -> bytearray of CHUNK_SIZE * CHUNK_SIZE tiles, row by row
+
+  @classmethod
+  def from_rows(cls, rows):
+    """Creates the grid from a list of rows, each row is a sequence of box types."""
+    height = len(rows)
+    tiles = cls(len(rows[0]) if height else 0, height)
+    for y, row in enumerate(rows):
+      tiles.set_row(y, row)
+    return tiles
+
+  def set_row(self, y, row):
+    """Sets the types of a whole row of tiles."""
+    size = self.CHUNK_SIZE
+    row = bytes(row)
+    chunk_y, offset = divmod(y, size)
+    offset *= size
+    for chunk_x in range(0, (self.width + size - 1) // size):
+      part = row[chunk_x * size:(chunk_x + 1) * size]
+      chunk = self.chunks.get((chunk_x, chunk_y))
+      if chunk is None:
+        if not part.strip(b'\0'):
+          continue
+        chunk = self.chunks[(chunk_x, chunk_y)] = bytearray(size * size)
+      chunk[offset:offset + len(part)] = part
+
+  def get(self, x, y):
+    size = self.CHUNK_SIZE
+    chunk = self.chunks.get((x // size, y // size))
+    if chunk is None:
+      return 0
+    return chunk[(y % size) * size + x % size]
+
+  def set(self, x, y, type):
+    size = self.CHUNK_SIZE
+    chunk = self.chunks.get((x // size, y // size))
+    if chunk is None:
+      if type == 0:
+        return
+      chunk = self.chunks[(x // size, y // size)] = bytearray(size * size)
+    chunk[(y % size) * size + x % size] = type
+
+  def row(self, y, start=0, stop=None):
+    """Returns the types of the tiles start to stop (excluded) of a row, as bytes."""
+    size = self.CHUNK_SIZE
+    stop = self.width if stop is None else min(stop, self.width)
+    chunk_y, offset = divmod(y, size)
+    offset *= size
+    parts = []
+    x = start
+    while x < stop:
+      chunk_x, begin = divmod(x, size)
+      end = min(size, begin + stop - x)
+      chunk = self.chunks.get((chunk_x, chunk_y))
+      if chunk is None:
+        parts.append(bytes(end - begin))
+      else:
+        parts.append(chunk[offset + begin:offset + end])
+      x += end - begin
+    return b''.join(parts)
+
+  def region(self, x, y, width, height):
+    """Returns the rows of a rectangle of tiles, as a list of bytes."""
+    return [self.row(row, x, x + width) for row in range(y, min(y + height, self.height))]
+
+  def counts(self):
+    """Returns a list with the number of tiles of each type (grass, rock, wood, metal)."""
+    counts = [0, 0, 0, 0]
+    for chunk in self.chunks.values():
+      for type in range(1, 4):
+        counts[type] += chunk.count(type)
+    counts[0] = self.width * self.height - sum(counts)
+    return counts
+
+  def boxes(self):
+    """Yields (x, y, type) for every tile that is not grass, row by row."""
+    for y in range(self.height):
+      row = self.row(y)
+      # The grass is skipped by the regular expression engine, not tile by tile.
+      for match in NOT_GRASS.finditer(row):
+        yield match.start(), y, row[match.start()]
+
+  def __getitem__(self, y):
+    return self.row(y)
+
+  def __len__(self):
+    return self.height
+
+  def memory(self):
+    """Returns the number of bytes used by the tiles."""
+    return sum(len(chunk) for chunk in self.chunks.values())
+
 
 class Map:
   """An instance of Map is a blueprint for how the game map will look."""
 
   def __init__(self,  width,  height,  boxes,  start_positions, flag_position):
     """ 
-    Takes as argument the size of the map (width, height), an array with the boxes type,
-    the start position of tanks (start_positions) and the position of the flag (flag_position).
+    Takes as argument the size of the map (width, height), the boxes type (a TileGrid,
+    or a list of rows), the start position of tanks (start_positions) and the position
+    of the flag (flag_position).
     """
+    if not isinstance(boxes, TileGrid):
+      boxes = TileGrid.from_rows(boxes)
     self.width              = width
     self.height             = height
     self.boxes              = boxes
@@ -21,7 +135,7 @@ class Map:
 
   def boxAt(self, x, y):
     """Return the type of the box at coordinates (x, y)."""
-    return self.boxes[y][x]
+    return self.boxes.get(x, y)
 
 #-- All map types
 map0 = Map(9, 9,
@@ -67,4 +181,35 @@ def create_map_jon(path):
               json_map['height'],
               json_map['boxes'],
               json_map ['start_position'],
-              json_map['flag_position'])
\ No newline at end of file
+              json_map['flag_position'])
+
+#-- Random maps, used to test and benchmark the game on maps of any size
+def random_map(width, height, players=4, seed=0, density=0.3):
+  """ 
+  Creates a random map of the given size. A part (density) of the tiles are
+  boxes of random types. The tanks start along the top and bottom rows and
+  the flag is in the middle of the map. The top, bottom and middle rows and
+  the middle column are kept free, so that every base can reach the flag.
+  """
+  generator = random.Random(seed)
+  boxes = TileGrid(width, height)
+  free_rows = (0, height // 2, height - 1)
+  for y in range(height):
+    # Only one row at a time is kept as a list.
+    row = bytearray(generator.choice([1, 2, 3]) if generator.random() < density else 0 for x in range(width))
+    if y in free_rows:
+      row = bytearray(width)
+    row[width // 2] = 0
+    boxes.set_row(y, row)
+
+  # Spread the start positions, every other one on the top and bottom row.
+  start_positions = []
+  per_row = (players + 1) // 2
+  for i in range(players):
+    x = int((i // 2 + 0.5) * width / per_row) + 0.5
+    if i % 2 == 0:
+      start_positions.append([x, 0.5, 0])
+    else:
+      start_positions.append([x, height - 0.5, 180])
+  return Map(width, height, boxes, start_positions, [width // 2 + 0.5, height // 2 + 0.5])
+
@@ -0,0 +1,171 @@
+import os
+import sys
+import json
+import time
+import random
+import multiprocessing
+
+#----- Match runner -----#
+#   Plays many headless matches between ais, spread over a pool of processes
+#   (one per core by default), and aggregates the results in one report.
+#
+#   python3 match_runner.py --map map1 --ai none,field,incremental,field --win best-of
+#                           --matches 100 --workers 8 --seed 1 --output report.json
+#
+#   --map       a built-in map (map0, map1, map2), the path of a json or compiled
+#               map (see mapfile.py) or random:WIDTHxHEIGHT:PLAYERS for a random
+#               map generated from the seed of each match.
+#   --ai        the type of ai of each slot: a planner name (field, incremental,
+#               hierarchical, weighted) or none for a tank that is not
+#               controlled. Missing slots get "field".
+#   --win       first-to, best-of or time (see ctf.py).
+#   --max-ticks a match that has not ended after this many ticks is stopped.
+#   --seed      the seed of the first match, the next matches use the next
+#               seeds. The seed of a match decides which start position
+#               (and base) each slot gets, and the map itself for random maps.
+#               The simulation has no other randomness, so on a map with N
+#               start positions at most N! matches are different.
+
+DEFAULT_MAX_TICKS = 50 * 60 * 10 # Ten minutes of game time.
+
+
+def get_option(name, default=None):
+    """Returns the value written after the flag name on the command line, or default."""
+    if name in sys.argv and sys.argv.index(name) + 1 < len(sys.argv):
+        return sys.argv[sys.argv.index(name) + 1]
+    return default
+
+def init_worker():
+    """Runs once in every worker process, before the first match."""
+    # The matches are headless and their score boards would only be noise.
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    # SDL turns SIGTERM into a quit event, then the pool could not stop its workers.
+    os.environ['SDL_NO_SIGNAL_HANDLERS'] = '1'
+    sys.stdout = open(os.devnull, 'w')
+    # ctf.py reads its options from the command line, the flags of the runner are not for it.
+    sys.argv = sys.argv[:1]
+    # Nothing is drawn, so no image has to be loaded.
+    import images
+    images.set_metadata_only()
+
+def load_map(description, seed):
+    """Returns the map described by --map."""
+    import maps
+    if description.startswith('random:'):
+        size, players = description[len('random:'):].split(':')
+        width, height = size.split('x')
+        return maps.random_map(int(width), int(height), int(players), seed)
+    import mapfile
+    return mapfile.load_map(description)
+
+def shuffle_start_positions(game_map, seed):
+    """Returns the map with its start positions in an order chosen by the seed."""
+    import maps
+    start_positions = list(game_map.start_positions)
+    random.Random(seed).shuffle(start_positions)
+    return maps.Map(game_map.width, game_map.height, game_map.boxes, start_positions, game_map.flag_position)
+
+def play_match(match):
+    """ 
+    Plays one headless match in a worker process and returns its result. A
+    match that fails (even with SystemExit) is returned with its error, an
+    exception left in a worker would stop the pool from ever finishing.
+    """
+    start = time.perf_counter()
+    try:
+        import ctf
+        game_map = shuffle_start_positions(load_map(match['map'], match['seed']), match['seed'])
+
+        ctf.HEADLESS = True
+        ctf.AI_TYPES = match['ai_types'] + ['field'] * (len(game_map.start_positions) - len(match['ai_types']))
+        ctf.WIN_CONDITION = match['win_condition']
+        ctf.setup_map(game_map)
+        ctf.start_game()
+
+        start = time.perf_counter()
+        running = True
+        while running and ctf.ticks < match['max_ticks']:
+            running = ctf.tick()
+    except BaseException as error:
+        return {'seed':     match['seed'],
+                'points':   {},
+                'rounds':   0,
+                'ticks':    0,
+                'finished': False,
+                'seconds':  time.perf_counter() - start,
+                'error':    '%s: %s' % (type(error).__name__, error)}
+    return {'seed':     match['seed'],
+            'points':   dict(ctf.point_dict),
+            'rounds':   ctf.round_counter,
+            'ticks':    ctf.ticks,
+            'finished': not running,
+            'seconds':  time.perf_counter() - start}
+
+def aggregate(results, seconds):
+    """Combines the results of all the matches into one report."""
+    points = {}
+    wins = {}
+    for result in results:
+        for player, score in result['points'].items():
+            points[player] = points.get(player, 0) + score
+        # Every player with the highest score wins the match (draws count for everyone).
+        best = max(result['points'].values(), default=0)
+        if best > 0:
+            for player, score in result['points'].items():
+                if score == best:
+                    wins[player] = wins.get(player, 0) + 1
+    ticks = sum(result['ticks'] for result in results)
+    return {'matches':            len(results),
+            'finished':           sum(1 for result in results if result['finished']),
+            'errors':             [(result['seed'], result['error']) for result in results if 'error' in result],
+            'rounds':             sum(result['rounds'] for result in results),
+            'ticks':              ticks,
+            'points':             points,
+            'wins':               wins,
+            'seconds':            seconds,
+            'matches_per_second': len(results) / seconds if seconds > 0 else 0,
+            'ticks_per_second':   ticks / seconds if seconds > 0 else 0,
+            'results':            sorted(results, key=lambda result: result['seed'])}
+
+def run(game_map, ai_types, win_condition, matches, workers, seed, max_ticks):
+    """Plays the matches on a pool of worker processes and returns the aggregated report."""
+    jobs = [{'map': game_map, 'ai_types': ai_types, 'win_condition': win_condition,
+             'seed': seed + i, 'max_ticks': max_ticks} for i in range(matches)]
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=init_worker) as pool:
+        results = list(pool.imap_unordered(play_match, jobs))
+        # Let the workers exit by themselves instead of terminating them.
+        pool.close()
+        pool.join()
+    report = aggregate(results, time.perf_counter() - start)
+    report['settings'] = {'map': game_map, 'ai_types': ai_types, 'win_condition': win_condition,
+                          'matches': matches, 'workers': workers, 'seed': seed, 'max_ticks': max_ticks}
+    return report
+
+def print_report(report):
+    print("____MATCHES____")
+    print('Matches:', report['matches'], '(' + str(report['finished']), 'finished)')
+    for seed, error in report['errors']:
+        print('Match with seed', seed, 'failed:', error)
+    print('Rounds:', report['rounds'])
+    print('Ticks:', report['ticks'])
+    print('Seconds:', round(report['seconds'], 3))
+    print('Ticks per second:', round(report['ticks_per_second'], 1))
+    print("____SCORE____")
+    for player in sorted(report['points'], key=lambda player: int(player.split()[-1])):
+        print(player, ':', report['points'][player], 'points,', report['wins'].get(player, 0), 'wins')
+
+if __name__ == '__main__':
+    report = run(get_option('--map', 'map0'),
+                 get_option('--ai', 'field').split(','),
+                 get_option('--win', 'best-of'),
+                 int(get_option('--matches', '10')),
+                 int(get_option('--workers', str(os.cpu_count() or 1))),
+                 int(get_option('--seed', '0')),
+                 int(get_option('--max-ticks', str(DEFAULT_MAX_TICKS))))
+    print_report(report)
+    output = get_option('--output')
+    if output is not None:
+        with open(output, 'w') as file:
+            json.dump(report, file, indent=2)
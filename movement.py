@@ -0,0 +1,120 @@
+import math
+import gameobjects
+
+# numpy is optional, it is only needed by the numpy backend (see use_numpy).
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#----- Movement stage -----#
+#   Does Tank.update and Bullet.update for all the tanks and bullets at once:
+#   the state of the bodies is gathered into arrays, the accelerations, speed
+#   limits and angular velocity limits are computed in one pass, and the
+#   velocities are written back before the physics step.
+#
+#   The default backend computes exactly what Tank.update and Bullet.update
+#   compute (the same floating point operations in the same order, but without
+#   creating any Vec2d), so games and replays are the same as with the per
+#   object updates. The numpy backend is faster with hundreds of tanks, but
+#   numpy's atan2 and sqrt can differ from the math module in the last bit, so
+#   a replay recorded with one backend may desync with the other. Replays
+#   store the backend they were recorded with (see replay.py).
+
+numpy_backend = False
+
+def use_numpy(enabled=True):
+    """Selects the numpy backend, raises SystemExit if numpy is not installed."""
+    global numpy_backend
+    if enabled and numpy is None:
+        raise SystemExit('The numpy movement backend needs numpy to be installed')
+    numpy_backend = enabled
+
+
+def gather(objects):
+    """Returns the bodies of the objects and their angles and velocities, as lists."""
+    bodies = [obj.body for obj in objects]
+    angles = [body.angle for body in bodies]
+    velocities = [body.velocity for body in bodies]
+    return bodies, angles, [velocity[0] for velocity in velocities], [velocity[1] for velocity in velocities]
+
+def scatter(bodies, xs, ys, angular_velocities=None):
+    """Writes the new velocities back to the bodies."""
+    for body, x, y in zip(bodies, xs, ys):
+        body.velocity = x, y
+    if angular_velocities is not None:
+        for body, angular_velocity in zip(bodies, angular_velocities):
+            body.angular_velocity = angular_velocity
+
+
+def thrust(angles, xs, ys, thrusts):
+    """Adds Vec2d(0, thrust).rotated(angle) to the velocities (xs, ys)."""
+    if numpy_backend:
+        angles = numpy.array(angles)
+        thrusts = numpy.array(thrusts)
+        return (numpy.array(xs) + (0 * numpy.cos(angles) - thrusts * numpy.sin(angles)),
+                numpy.array(ys) + (0 * numpy.sin(angles) + thrusts * numpy.cos(angles)))
+    new_xs = []
+    new_ys = []
+    for angle, x, y, push in zip(angles, xs, ys, thrusts):
+        cos = math.cos(angle)
+        sin = math.sin(angle)
+        new_xs.append(x + (0 * cos - push * sin))
+        new_ys.append(y + (0 * sin + push * cos))
+    return new_xs, new_ys
+
+def limit_speed(xs, ys, max_speeds):
+    """Clamps the length of the velocities (xs, ys) to max_speeds, keeping their direction."""
+    if numpy_backend:
+        length_sqrd = xs ** 2 + ys ** 2
+        speeds = numpy.clip(numpy.sqrt(length_sqrd), -max_speeds, max_speeds)
+        # Vec2d.angle is 0 for a null vector.
+        angles = numpy.where(length_sqrd == 0, 0.0, numpy.arctan2(ys, xs))
+        cos = numpy.cos(angles)
+        sin = numpy.sin(angles)
+        return speeds * cos - 0 * sin, speeds * sin + 0 * cos
+    new_xs = []
+    new_ys = []
+    for x, y, max_speed in zip(xs, ys, max_speeds):
+        length_sqrd = x**2 + y**2
+        speed = gameobjects.clamp(max_speed, math.sqrt(length_sqrd))
+        angle = 0 if length_sqrd == 0 else math.atan2(y, x)
+        cos = math.cos(angle)
+        sin = math.sin(angle)
+        new_xs.append(speed*cos - 0*sin)
+        new_ys.append(speed*sin + 0*cos)
+    return new_xs, new_ys
+
+
+def update_tanks(tanks):
+    """Does Tank.update for a list of tanks."""
+    if not tanks:
+        return
+    bodies, angles, xs, ys = gather(tanks)
+    max_speeds = [tank.max_speed for tank in tanks]
+    angular_velocities = [gameobjects.clamp(max_speed, body.angular_velocity + tank.rotation * tank.ACCELERATION)
+                          for tank, body, max_speed in zip(tanks, bodies, max_speeds)]
+    xs, ys = thrust(angles, xs, ys, [tank.ACCELERATION * tank.acceleration for tank in tanks])
+    if numpy_backend:
+        max_speeds = numpy.array(max_speeds)
+    xs, ys = limit_speed(xs, ys, max_speeds)
+    if numpy_backend:
+        xs = xs.tolist()
+        ys = ys.tolist()
+    scatter(bodies, xs, ys, angular_velocities)
+
+def update_bullets(bullets):
+    """Does Bullet.update for a list of bullets."""
+    if not bullets:
+        return
+    bodies, angles, xs, ys = gather(bullets)
+    xs, ys = thrust(angles, xs, ys, [bullet.SPEED for bullet in bullets])
+    if numpy_backend:
+        xs = xs.tolist()
+        ys = ys.tolist()
+    scatter(bodies, xs, ys)
+
+def update(tanks, bullets):
+    """Updates the velocities of the tanks and of the bullets, call this before the physics step."""
+    update_tanks(list(tanks))
+    update_bullets(list(bullets))
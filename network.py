@@ -0,0 +1,498 @@
+import os
+import sys
+import math
+import time
+import random
+import struct
+import asyncio
+import gameobjects
+from replay import write_varint, read_varint
+
+#----- Network play -----#
+#   An authoritative server: the game runs headless on the server, the clients
+#   only send the inputs of their tank and get snapshots of the game state back,
+#   over UDP. A snapshot is quantized and delta compressed against the last
+#   snapshot the client acknowledged, so only what changed since then is sent.
+#
+#   python3 network.py --map map1 --clients 2 --bots 2 --ticks 1500
+#                      --latency 50 --jitter 10 --loss 0.05
+#
+#   --clients   the slots (from slot 0) that are played by remote clients, the
+#               other tanks are ais (--ai chooses their planner).
+#   --bots      clients started in the same process, that connect over localhost
+#               and give random inputs. With --bots 0 the server waits for remote
+#               clients (python3 network.py --connect HOST:PORT).
+#   --latency, --jitter (milliseconds) and --loss (0 to 1) simulate a bad
+#               network on every packet sent, by the server and by the clients.
+#   --ticks     the server stops after this many ticks and prints the bytes per tick.
+#
+#   Packets (integers are little endian, varints as in replay.py):
+#   JOIN      type
+#   WELCOME   type, slot (B), tick rate (H), map name
+#   INPUT     type, last snapshot received (I), first input sequence (I),
+#             varint count, one byte per input (index in gameobjects.Tank.INPUTS).
+#             Every input is sent again in each packet until the server has it.
+#   SNAPSHOT  type, tick (I), tick of the baseline or NO_TICK (I), last input
+#             sequence applied (I), then the delta from the baseline (see encode_delta).
+
+JOIN, WELCOME, INPUT, SNAPSHOT = range(4)
+NO_TICK = 0xffffffff
+
+WELCOME_HEADER  = struct.Struct('<BBH')
+INPUT_HEADER    = struct.Struct('<BII')
+SNAPSHOT_HEADER = struct.Struct('<BIII')
+
+HISTORY         = 128  # Snapshots kept as baselines, by the server and by the clients.
+JOIN_INTERVAL   = 0.25 # Seconds between two join requests of a client.
+POSITION_SCALE  = 64   # Positions are sent in 1/64 of a tile.
+ANGLE_STEPS     = 1024 # Angles are sent in 1/1024 of a turn.
+
+#-- A state is a dict of entries: key -> tuple of integers. The key of an entry
+#   is id * 8 + kind, where the id is the slot of a tank or a score, the entity
+#   id of a bullet and the tile index of the start position of a box.
+TANK, BULLET, FLAG, BOX, SCORE = range(5)
+FIELDS = {TANK:   4, # x, y, angle, carries the flag
+          BULLET: 3, # x, y, angle
+          FLAG:   3, # x, y, angle
+          BOX:    4, # x, y, angle, destroyed
+          SCORE:  1} # points
+
+
+def get_option(name, default=None):
+    """Returns the value written after the flag name on the command line, or default."""
+    if name in sys.argv and sys.argv.index(name) + 1 < len(sys.argv):
+        return sys.argv[sys.argv.index(name) + 1]
+    return default
+
+
+#-- Quantization
+def quantize(value):
+    return int(round(value * POSITION_SCALE))
+
+def quantize_angle(degrees):
+    return int(round(degrees * ANGLE_STEPS / 360)) % ANGLE_STEPS
+
+def capture(ctf):
+    """Returns the quantized state of the game. Boxes that are still on their start tile are left out."""
+    state = {}
+    for slot, tank in ctf.entity_store.slots.items():
+        x, y = tank.body.position
+        state[slot * 8 + TANK] = (quantize(x), quantize(y), quantize_angle(math.degrees(tank.body.angle)),
+                                  int(tank.flag is not None))
+    for bullet in ctf.entity_store.bullets():
+        x, y = bullet.body.position
+        state[bullet.entity_id * 8 + BULLET] = (quantize(x), quantize(y), quantize_angle(math.degrees(bullet.body.angle)))
+    flag = ctf.flag
+    state[FLAG] = (quantize(flag.x), quantize(flag.y), quantize_angle(flag.orientation))
+    width = ctf.current_map.width
+    for box, (x, y, type) in ctf.world_snapshot.boxes.items():
+        key = (y * width + x) * 8 + BOX
+        if box not in ctf.entity_store:
+            state[key] = (0, 0, 0, 1)
+            continue
+        bx, by = box.body.position
+        entry = (quantize(bx), quantize(by), quantize_angle(math.degrees(box.body.angle)), 0)
+        if entry != (quantize(x + 0.5), quantize(y + 0.5), 0, 0):
+            state[key] = entry
+    for player, points in ctf.point_dict.items():
+        state[(int(player.split()[-1]) - 1) * 8 + SCORE] = (points,)
+    return state
+
+
+#-- Delta compression
+def zigzag(value):
+    """Maps signed integers to unsigned ones, small numbers to small numbers: 0, -1, 1, -2 -> 0, 1, 2, 3."""
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+def unzigzag(value):
+    return value >> 1 if value & 1 == 0 else -(value >> 1) - 1
+
+def encode_delta(buffer, state, baseline):
+    """
+    Appends the difference between state and baseline to buffer: the number of
+    changed entries, then for each its key, a bit mask of the fields that
+    changed and the change of these fields, and last the keys of the entries
+    that are not in state anymore. An entry that is not in the baseline is
+    sent as a change from zeros.
+    """
+    changed = [(key, fields, baseline.get(key)) for key, fields in state.items() if baseline.get(key) != fields]
+    write_varint(buffer, len(changed))
+    for key, fields, old in changed:
+        if old is None:
+            old = (0,) * len(fields)
+        mask = 0
+        for i in range(len(fields)):
+            if fields[i] != old[i]:
+                mask |= 1 << i
+        write_varint(buffer, key)
+        buffer.append(mask)
+        for i in range(len(fields)):
+            if mask & (1 << i):
+                write_varint(buffer, zigzag(fields[i] - old[i]))
+    removed = [key for key in baseline if key not in state]
+    write_varint(buffer, len(removed))
+    for key in removed:
+        write_varint(buffer, key)
+
+def decode_delta(data, offset, baseline):
+    """Returns the state encoded by encode_delta at offset, applied to baseline."""
+    state = dict(baseline)
+    count, offset = read_varint(data, offset)
+    for _ in range(count):
+        key, offset = read_varint(data, offset)
+        mask = data[offset]
+        offset += 1
+        fields = list(state.get(key) or (0,) * FIELDS[key & 7])
+        for i in range(len(fields)):
+            if mask & (1 << i):
+                change, offset = read_varint(data, offset)
+                fields[i] += unzigzag(change)
+        state[key] = tuple(fields)
+    count, offset = read_varint(data, offset)
+    for _ in range(count):
+        key, offset = read_varint(data, offset)
+        state.pop(key, None)
+    return state
+
+
+def parse_inputs(data):
+    """
+    Returns (ack, first sequence, input indices) of an INPUT packet, or None
+    if the packet is short, has extra bytes or an unknown input.
+    """
+    if len(data) < INPUT_HEADER.size + 1:
+        return None
+    _, ack, first = INPUT_HEADER.unpack_from(data)
+    try:
+        count, offset = read_varint(data, INPUT_HEADER.size)
+    except IndexError:
+        return None
+    codes = data[offset:]
+    if len(codes) != count or any(code >= len(gameobjects.Tank.INPUTS) for code in codes):
+        return None
+    return ack, first, codes
+
+
+class NetworkConditions:
+    """Sends packets with a simulated latency, jitter and loss."""
+
+    def __init__(self, latency=0, jitter=0, loss=0, seed=0):
+        self.latency = latency # Seconds
+        self.jitter  = jitter  # Seconds, the delay of a packet is latency + [0, jitter]
+        self.loss    = loss    # Probability that a packet is lost
+        self.random  = random.Random(seed)
+        self.sent    = 0
+        self.lost    = 0
+
+    def send(self, transport, data, addr=None):
+        self.sent += 1
+        if self.loss and self.random.random() < self.loss:
+            self.lost += 1
+            return
+        delay = self.latency + self.random.random() * self.jitter
+        if delay <= 0:
+            transport.sendto(data, addr)
+        else:
+            asyncio.get_running_loop().call_later(delay, self.deliver, transport, data, addr)
+
+    def deliver(self, transport, data, addr):
+        # The transport may have been closed while the packet was delayed.
+        if not transport.is_closing():
+            transport.sendto(data, addr)
+
+
+class RemoteClient:
+    """What the server knows about a client."""
+
+    def __init__(self, addr, slot):
+        self.addr     = addr
+        self.slot     = slot
+        self.ack      = None # Last snapshot the client received
+        self.last_seq = 0    # Last input applied
+        self.inputs   = []   # Inputs to apply on the next tick
+
+
+class Server(asyncio.DatagramProtocol):
+    """Runs the game (ctf.py must be set up and started) and serves it to the clients in the remote slots."""
+
+    def __init__(self, ctf, map_name, remote_slots, conditions):
+        self.ctf          = ctf
+        self.map_name     = map_name
+        self.free_slots   = list(remote_slots)
+        self.conditions   = conditions
+        self.transport    = None
+        self.clients      = {}  # Address -> RemoteClient
+        self.history      = {}  # Tick -> state
+        self.running      = True
+        self.snapshot_bytes = [] # Bytes of the snapshots sent to each client, per tick
+        self.full_bytes     = [] # Bytes of one snapshot without delta compression, per tick
+        self.input_bytes    = 0  # Bytes of the input packets received
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if not data:
+            return
+        if data[0] == JOIN:
+            client = self.clients.get(addr)
+            if client is None:
+                if not self.free_slots:
+                    return
+                client = RemoteClient(addr, self.free_slots.pop(0))
+                self.clients[addr] = client
+            # The welcome may have been lost, so it is sent again for every join.
+            packet = WELCOME_HEADER.pack(WELCOME, client.slot, self.ctf.TICK_RATE) + self.map_name.encode()
+            self.conditions.send(self.transport, packet, addr)
+        elif data[0] == INPUT:
+            client = self.clients.get(addr)
+            if client is None:
+                return
+            self.input_bytes += len(data)
+            inputs = parse_inputs(data)
+            if inputs is None:
+                return
+            ack, first, codes = inputs
+            # A tick that was not sent yet is not an acknowledgement.
+            if ack != NO_TICK and ack <= self.ctf.ticks and (client.ack is None or ack > client.ack):
+                client.ack = ack
+            # A packet that skips inputs came before an older one, wait for the inputs it misses.
+            if first > client.last_seq + 1:
+                return
+            for seq in range(max(first, client.last_seq + 1), first + len(codes)):
+                client.inputs.append(gameobjects.Tank.INPUTS[codes[seq - first]])
+                client.last_seq = seq
+
+    def state_at(self, tick):
+        """Returns the state sent for a tick, if it is still in the history."""
+        return self.history.get(tick)
+
+    def tick(self):
+        """Runs one tick of the game and sends the snapshot to every client."""
+        ctf = self.ctf
+        inputs = []
+        for client in self.clients.values():
+            # The tank of the client may have just been destroyed.
+            if ctf.entity_store.tank_at(client.slot) is not None:
+                inputs += [(client.slot, name) for name in client.inputs]
+            client.inputs = []
+        self.running = ctf.tick(inputs=inputs)
+
+        state = capture(ctf)
+        self.history[ctf.ticks] = state
+        self.history.pop(ctf.ticks - HISTORY, None)
+
+        sent = []
+        for client in self.clients.values():
+            baseline = self.history.get(client.ack) if client.ack is not None else None
+            base_tick = client.ack if baseline is not None else NO_TICK
+            packet = bytearray(SNAPSHOT_HEADER.pack(SNAPSHOT, ctf.ticks, base_tick, client.last_seq))
+            encode_delta(packet, state, baseline or {})
+            self.conditions.send(self.transport, bytes(packet), client.addr)
+            sent.append(len(packet))
+        if sent:
+            self.snapshot_bytes.append(sent)
+            full = bytearray(SNAPSHOT_HEADER.size)
+            encode_delta(full, state, {})
+            self.full_bytes.append(len(full))
+
+    async def run(self, ticks=None):
+        """Runs the game at its tick rate, for a number of ticks or until it is over."""
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+        while self.running and (ticks is None or self.ctf.ticks < ticks):
+            self.tick()
+            next_time += 1 / self.ctf.TICK_RATE
+            await asyncio.sleep(max(0, next_time - loop.time()))
+
+
+class Client(asyncio.DatagramProtocol):
+    """
+    A client that rebuilds the state of the game from the snapshots of the
+    server. As a bot it gives a random input to its tank now and then.
+    """
+
+    def __init__(self, conditions, seed=0, bot=True):
+        self.conditions = conditions
+        self.random     = random.Random(seed)
+        self.bot        = bot
+        self.transport  = None
+        self.slot       = None
+        self.map_name   = None
+        self.tick_rate  = 50
+        self.states     = {}   # Tick -> state
+        self.latest     = None # Tick of the newest snapshot
+        self.seq        = 0    # Sequence number of the last input
+        self.unacked    = []   # (sequence, input index) not applied by the server yet
+        self.received   = 0    # Snapshots decoded
+        self.undecoded  = 0    # Snapshots whose baseline was not known
+        self.received_bytes = 0
+        self.mismatches = 0    # Snapshots that differed from the state of the server
+        self.check      = None # Tick -> state of the server, to verify the snapshots
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if not data:
+            return
+        if data[0] == WELCOME and self.slot is None and len(data) >= WELCOME_HEADER.size:
+            _, self.slot, self.tick_rate = WELCOME_HEADER.unpack_from(data)
+            self.map_name = data[WELCOME_HEADER.size:].decode(errors='replace')
+        elif data[0] == SNAPSHOT and len(data) >= SNAPSHOT_HEADER.size:
+            self.received_bytes += len(data)
+            _, tick, base_tick, last_seq = SNAPSHOT_HEADER.unpack_from(data)
+            if tick in self.states or (self.latest is not None and tick <= self.latest - HISTORY):
+                return
+            baseline = {} if base_tick == NO_TICK else self.states.get(base_tick)
+            if baseline is None:
+                self.undecoded += 1
+                return
+            try:
+                state = decode_delta(data, SNAPSHOT_HEADER.size, baseline)
+            except (IndexError, KeyError):
+                self.undecoded += 1
+                return
+            self.states[tick] = state
+            self.received += 1
+            if self.latest is None or tick > self.latest:
+                self.latest = tick
+                # Lost and late snapshots leave holes, so every old tick is dropped, not only one.
+                for old in [old for old in self.states if old <= tick - HISTORY]:
+                    del self.states[old]
+            self.unacked = [(seq, index) for seq, index in self.unacked if seq > last_seq]
+            if self.check is not None:
+                expected = self.check(tick)
+                if expected is not None and expected != state:
+                    self.mismatches += 1
+
+    @property
+    def state(self):
+        """The newest state of the game."""
+        return self.states.get(self.latest, {})
+
+    def give_input(self, name):
+        """Queues an input (one of gameobjects.Tank.INPUTS) for the tank of the client."""
+        self.seq += 1
+        self.unacked.append((self.seq, gameobjects.Tank.INPUTS.index(name)))
+
+    def send_inputs(self):
+        """Sends the inputs the server has not applied yet, and acknowledges the newest snapshot."""
+        first = self.unacked[0][0] if self.unacked else self.seq + 1
+        packet = bytearray(INPUT_HEADER.pack(INPUT, NO_TICK if self.latest is None else self.latest, first))
+        write_varint(packet, len(self.unacked))
+        packet += bytes(index for seq, index in self.unacked)
+        self.conditions.send(self.transport, bytes(packet))
+
+    async def run(self, ticks=None):
+        """Joins the server, then sends the inputs once per tick."""
+        loop = asyncio.get_running_loop()
+        while self.slot is None:
+            self.conditions.send(self.transport, bytes([JOIN]))
+            await asyncio.sleep(JOIN_INTERVAL)
+        sent = 0
+        next_time = loop.time()
+        while ticks is None or sent < ticks:
+            if self.bot and self.random.random() < 0.05:
+                self.give_input(self.random.choice(gameobjects.Tank.INPUTS))
+            self.send_inputs()
+            sent += 1
+            next_time += 1 / self.tick_rate
+            await asyncio.sleep(max(0, next_time - loop.time()))
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+def print_report(server, bots):
+    print("____NETWORK____")
+    conditions = server.conditions
+    print('Ticks:', server.ctf.ticks, ' Clients:', len(server.clients))
+    print('Latency:', round(conditions.latency * 1000), 'ms, jitter:', round(conditions.jitter * 1000),
+          'ms, loss:', conditions.loss)
+    per_client = [size for sizes in server.snapshot_bytes for size in sizes]
+    if per_client:
+        print('Snapshot bytes per tick and client: mean', round(sum(per_client) / len(per_client), 1),
+              ' p95', percentile(per_client, 0.95), ' max', max(per_client))
+        print('Full snapshot bytes per tick:', round(sum(server.full_bytes) / len(server.full_bytes), 1),
+              '(without delta compression)')
+        print('Input bytes per tick and client:', round(server.input_bytes / len(server.snapshot_bytes) / len(server.clients), 1))
+    print('Packets sent by the server:', conditions.sent, ', lost:', conditions.lost)
+    for bot in bots:
+        print('Slot', bot.slot, ': snapshots decoded', bot.received, ', without baseline', bot.undecoded,
+              ', different from the server', bot.mismatches)
+
+async def serve(ctf, map_name, remote_slots, conditions, port, bots, ticks, seed):
+    """Runs the server, and the bots that connect to it over localhost."""
+    loop = asyncio.get_running_loop()
+    server = Server(ctf, map_name, remote_slots, conditions)
+    transport, _ = await loop.create_datagram_endpoint(lambda: server, local_addr=('0.0.0.0', port))
+    port = transport.get_extra_info('sockname')[1]
+    clients = []
+    tasks = []
+    for i in range(bots):
+        client = Client(NetworkConditions(conditions.latency, conditions.jitter, conditions.loss, seed + i + 1), seed + i)
+        client.check = server.state_at
+        await loop.create_datagram_endpoint(lambda client=client: client, remote_addr=('127.0.0.1', port))
+        clients.append(client)
+        tasks.append(asyncio.create_task(client.run()))
+    try:
+        await server.run(ticks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        for client in clients:
+            client.transport.close()
+        transport.close()
+    return server, clients
+
+async def connect(host, port, conditions, ticks, seed):
+    """Runs one bot client against a remote server."""
+    loop = asyncio.get_running_loop()
+    client = Client(conditions, seed)
+    await loop.create_datagram_endpoint(lambda: client, remote_addr=(host, port))
+    try:
+        await client.run(ticks)
+    finally:
+        client.transport.close()
+    return client
+
+if __name__ == '__main__':
+    # Neither the server nor the clients draw anything.
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    import images
+    images.set_metadata_only()
+
+    seed = int(get_option('--seed', '0'))
+    conditions = NetworkConditions(float(get_option('--latency', '0')) / 1000,
+                                   float(get_option('--jitter', '0')) / 1000,
+                                   float(get_option('--loss', '0')), seed)
+    ticks = get_option('--ticks')
+    ticks = int(ticks) if ticks is not None else None
+
+    address = get_option('--connect')
+    if address is not None:
+        host, port = address.rsplit(':', 1)
+        start = time.perf_counter()
+        client = asyncio.run(connect(host, int(port), conditions, ticks, seed))
+        ticks = max(1, client.received)
+        print('Slot', client.slot, ': snapshots decoded', client.received, ', without baseline', client.undecoded,
+              ', bytes per snapshot', round(client.received_bytes / ticks, 1))
+        sys.exit()
+
+    import ctf
+    import mapfile
+    map_name = get_option('--map', 'map1')
+    game_map = mapfile.load_map(map_name)
+    remote = int(get_option('--clients', '2'))
+    ctf.HEADLESS = True
+    ctf.AI_TYPES = ['none'] * remote + [get_option('--ai', 'field')] * (len(game_map.start_positions) - remote)
+    ctf.setup_map(game_map)
+    ctf.start_game()
+    random.seed(seed)
+
+    server, bots = asyncio.run(serve(ctf, map_name, range(remote), conditions, int(get_option('--port', '7777')),
+                                     int(get_option('--bots', str(remote))), ticks, seed))
+    print_report(server, bots)
@@ -0,0 +1,643 @@
+import heapq
+from array import array
+import grid
+
+INFINITY = float('inf')
+
+# Returned by planners that plan in the background (see planning.py) when the
+# path is not ready yet: the ai waits instead of looking for another path.
+PENDING = object()
+
+#-- Cost of driving into a tile of each type (grass, rock, wood, metal) for the
+#   WeightedPlanner, in the time it takes to cross a grass tile (25 ticks at full
+#   speed). A wood box is shot away first, which takes up to a shoot cooldown
+#   (50 ticks). A metal box is pushed ahead of the tank until it leaves the
+#   path, slowly, and it can get stuck against other boxes, so it is worth a
+#   long detour. Rock boxes can not be crossed.
+TILE_COSTS = (1, None, 3, 10)
+
+
+class IncrementalPlanner:
+    """ 
+    A D* Lite planner for one ai. It searches backwards from the target and
+    keeps its search state between calls, so that when the tank advances,
+    when tiles of the grid change (a wood box is shot away, a box is pushed)
+    or when metal boxes get allowed, only the affected nodes are updated
+    instead of searching again from scratch. A new target starts a new search.
+    """
+
+    def __init__(self, passability_grid):
+        self.grid           = passability_grid
+        self.target         = None
+        self.allow_metalbox = False
+        self.replans        = 0 # Number of searches that had to expand nodes.
+        self.expansions     = 0 # Number of nodes expanded in all searches.
+        self.resets         = 0 # Number of searches started from scratch.
+
+    def reset(self, start, target, allow_metalbox):
+        """Starts a new search from scratch."""
+        size                = len(self.grid.tiles)
+        self.g              = array('d', [INFINITY]) * size
+        self.rhs            = array('d', [INFINITY]) * size
+        self.queue          = []  # Heap of (key, node), keys that no longer match self.keys are skipped.
+        self.keys           = {}  # Node -> its key in the queue.
+        self.km             = 0
+        self.start          = start
+        self.last           = start
+        self.target         = target
+        self.allow_metalbox = allow_metalbox
+        self.changes        = self.grid.subscribe()
+        self.rhs[target]    = 0
+        self.push(target, self.calculate_key(target))
+        self.resets += 1
+
+    def heuristic(self, a, b):
+        """Manhattan distance between two indices."""
+        ay, ax = divmod(a, self.grid.stride)
+        by, bx = divmod(b, self.grid.stride)
+        return abs(ax - bx) + abs(ay - by)
+
+    def calculate_key(self, node):
+        value = min(self.g[node], self.rhs[node])
+        return (value + self.heuristic(self.start, node) + self.km, value)
+
+    def push(self, node, key):
+        self.keys[node] = key
+        heapq.heappush(self.queue, (key, node))
+
+    def top_key(self):
+        """Returns the smallest key in the queue, after dropping outdated entries."""
+        queue = self.queue
+        while queue and self.keys.get(queue[0][1]) != queue[0][0]:
+            heapq.heappop(queue)
+        return queue[0][0] if queue else (INFINITY, INFINITY)
+
+    def neighbours(self, node):
+        """The neighbours of a node that a tank can stand on (rock boxes and the border are skipped)."""
+        tiles  = self.grid.tiles
+        stride = self.grid.stride
+        return [n for n in (node - 1, node + 1, node - stride, node + stride) if tiles[n] != grid.ROCKBOX]
+
+    def update_vertex(self, node):
+        g = self.g
+        if node != self.target:
+            tiles    = self.grid.tiles
+            passable = self.grid.passable(self.allow_metalbox)
+            stride   = self.grid.stride
+            best     = INFINITY
+            for n in (node - 1, node + 1, node - stride, node + stride):
+                if passable[tiles[n]] and g[n] + 1 < best:
+                    best = g[n] + 1
+            self.rhs[node] = best
+        if g[node] != self.rhs[node]:
+            self.push(node, self.calculate_key(node))
+        else:
+            self.keys.pop(node, None)
+
+    def compute_shortest_path(self):
+        g        = self.g
+        rhs      = self.rhs
+        expanded = 0
+        while self.top_key() < self.calculate_key(self.start) or rhs[self.start] != g[self.start]:
+            if not self.queue:
+                break
+            old_key, node = heapq.heappop(self.queue)
+            del self.keys[node]
+            expanded += 1
+            new_key = self.calculate_key(node)
+            if old_key < new_key:
+                self.push(node, new_key)
+            elif g[node] > rhs[node]:
+                g[node] = rhs[node]
+                for n in self.neighbours(node):
+                    self.update_vertex(n)
+            else:
+                g[node] = INFINITY
+                self.update_vertex(node)
+                for n in self.neighbours(node):
+                    self.update_vertex(n)
+        if expanded:
+            self.replans += 1
+            self.expansions += expanded
+
+    def changed_tiles(self, allow_metalbox):
+        """Returns the tiles whose cost changed since the previous call."""
+        changes = set(self.changes)
+        self.changes.clear()
+        if allow_metalbox != self.allow_metalbox:
+            self.allow_metalbox = allow_metalbox
+            tiles = self.grid.tiles
+            index = tiles.find(grid.METALBOX)
+            while index >= 0:
+                changes.add(index)
+                index = tiles.find(grid.METALBOX, index + 1)
+        return changes
+
+    def next_tile(self, start, target, allow_metalbox=False):
+        """ 
+        Returns the index of the next tile on a shortest path from start to
+        target, or None if we are at the target or it can not be reached.
+        """
+        tiles = self.grid.tiles
+        if tiles[start] == grid.ROCKBOX:
+            return None
+        if target != self.target:
+            self.reset(start, target, allow_metalbox)
+        else:
+            if start != self.start:
+                self.km += self.heuristic(self.last, start)
+                self.last  = start
+                self.start = start
+            for tile in self.changed_tiles(allow_metalbox):
+                self.update_vertex(tile)
+                for n in self.neighbours(tile):
+                    self.update_vertex(n)
+        self.compute_shortest_path()
+
+        g = self.g
+        if start == target or g[start] == INFINITY:
+            return None
+        passable = self.grid.passable(allow_metalbox)
+        best     = None
+        for n in (start - 1, start + 1, start - self.grid.stride, start + self.grid.stride):
+            if passable[tiles[n]] and (best is None or g[n] < g[best]):
+                best = n
+        if best is None or g[best] == INFINITY:
+            return None
+        return best
+
+
+class ClusterGraph:
+    """ 
+    The abstract graph of HierarchicalPlanner for one passability table. The
+    grid is split into square clusters. Every run of tiles that can be crossed
+    between two neighbouring clusters gets an entrance in the middle, or one
+    at each end if the run is wide, and the entrances of a cluster are joined
+    by their distances inside the cluster. The clusters keep a local copy of
+    which of their tiles are passable, with a border that is never passable.
+    The distances of a cluster are only computed when a search reaches it.
+    """
+
+    def __init__(self, passability_grid, passable, size, entrance_width):
+        self.grid           = passability_grid
+        self.passable       = passable
+        # Translation table from tile type to 1 (passable) or 0.
+        self.table          = bytes(passable) + bytes(256 - len(passable))
+        self.size           = size
+        self.entrance_width = entrance_width
+        self.columns        = (passability_grid.width + size - 1) // size
+        self.rows           = (passability_grid.height + size - 1) // size
+        self.local          = {} # Cluster -> passable tiles of the cluster
+        self.borders        = {} # Border -> list of (entrance, entrance in the next cluster)
+        self.crossings      = {} # Entrance -> {border: entrance on the other side}
+        self.nodes          = {} # Cluster -> its entrances
+        self.edges          = {} # Cluster -> {entrance: [(neighbour, distance), ...]}
+        self.changes        = passability_grid.subscribe() # Tiles that changed since the last update.
+        self.rebuilt        = 0  # Number of clusters rebuilt after tiles changed.
+
+        clusters = [(cx, cy) for cy in range(self.rows) for cx in range(self.columns)]
+        for cluster in clusters:
+            self.build_local(cluster)
+        for cx, cy in clusters:
+            if cx + 1 < self.columns:
+                self.build_border((0, cx, cy))
+            if cy + 1 < self.rows:
+                self.build_border((1, cx, cy))
+        for cluster in clusters:
+            self.build_nodes(cluster)
+
+    #-- A cluster is (cx, cy). A border is (0, cx, cy) between the clusters
+    #   (cx, cy) and (cx + 1, cy), or (1, cx, cy) between (cx, cy) and (cx, cy + 1).
+
+    def cluster_of(self, index):
+        x, y = self.grid.coords(index)
+        return (x // self.size, y // self.size)
+
+    def bounds(self, cluster):
+        """Returns the tiles (x0, y0, x1, y1) of a cluster, x1 and y1 excluded."""
+        x0 = cluster[0] * self.size
+        y0 = cluster[1] * self.size
+        return x0, y0, min(x0 + self.size, self.grid.width), min(y0 + self.size, self.grid.height)
+
+    def local_stride(self, cluster):
+        x0, y0, x1, y1 = self.bounds(cluster)
+        return x1 - x0 + 2
+
+    def to_local(self, cluster, index):
+        """Converts an index of the grid to an index in the local tiles of the cluster."""
+        x, y = self.grid.coords(index)
+        x0, y0, x1, y1 = self.bounds(cluster)
+        return (y - y0 + 1) * (x1 - x0 + 2) + x - x0 + 1
+
+    def to_grid(self, cluster, local_index):
+        x0, y0, x1, y1 = self.bounds(cluster)
+        y, x = divmod(local_index, x1 - x0 + 2)
+        return self.grid.index(x0 + x - 1, y0 + y - 1)
+
+    def build_local(self, cluster):
+        x0, y0, x1, y1 = self.bounds(cluster)
+        width  = x1 - x0
+        stride = width + 2
+        local  = bytearray(stride * (y1 - y0 + 2))
+        tiles  = self.grid.tiles
+        for y in range(y0, y1):
+            start  = self.grid.index(x0, y)
+            offset = (y - y0 + 1) * stride + 1
+            local[offset:offset + width] = tiles[start:start + width].translate(self.table)
+        self.local[cluster] = local
+
+    def build_border(self, border):
+        """Finds the entrances of a border again."""
+        for a, b in self.borders.get(border, ()):
+            for node in (a, b):
+                del self.crossings[node][border]
+                if not self.crossings[node]:
+                    del self.crossings[node]
+
+        kind, cx, cy = border
+        size = self.size
+        if kind == 0:
+            x = (cx + 1) * size - 1
+            candidates = [self.grid.index(x, y) for y in range(cy * size, min((cy + 1) * size, self.grid.height))]
+            step = 1
+        else:
+            y = (cy + 1) * size - 1
+            candidates = [self.grid.index(x, y) for x in range(cx * size, min((cx + 1) * size, self.grid.width))]
+            step = self.grid.stride
+
+        tiles    = self.grid.tiles
+        passable = self.passable
+        pairs    = []
+        run      = []
+        # The sentinel ends the last run.
+        for index in candidates + [None]:
+            if index is not None and passable[tiles[index]] and passable[tiles[index + step]]:
+                run.append(index)
+                continue
+            if len(run) >= self.entrance_width:
+                pairs += [(run[0], run[0] + step), (run[-1], run[-1] + step)]
+            elif run:
+                middle = run[len(run) // 2]
+                pairs.append((middle, middle + step))
+            run = []
+
+        self.borders[border] = pairs
+        for a, b in pairs:
+            self.crossings.setdefault(a, {})[border] = b
+            self.crossings.setdefault(b, {})[border] = a
+
+    def build_nodes(self, cluster):
+        """Collects the entrances of a cluster again, their distances are computed when they are needed."""
+        cx, cy = cluster
+        nodes = set()
+        for border in ((0, cx - 1, cy), (0, cx, cy), (1, cx, cy - 1), (1, cx, cy)):
+            for pair in self.borders.get(border, ()):
+                nodes.update(node for node in pair if self.cluster_of(node) == cluster)
+        self.nodes[cluster] = sorted(nodes)
+        self.edges.pop(cluster, None)
+
+    def cluster_edges(self, cluster):
+        """ 
+        Returns the neighbours of the entrances of a cluster with their distances:
+        the entrances of the cluster that can be reached inside it, and the
+        entrances on the other side of its borders.
+        """
+        edges = self.edges.get(cluster)
+        if edges is None:
+            nodes = self.nodes[cluster]
+            local = [self.to_local(cluster, node) for node in nodes]
+            edges = {}
+            for node in nodes:
+                distances = self.distances(cluster, node)
+                edges[node] = [(other, distances[index]) for other, index in zip(nodes, local)
+                               if other != node and distances[index] >= 0]
+                edges[node] += [(other, 1) for other in self.crossings[node].values()]
+            self.edges[cluster] = edges
+        return edges
+
+    def update(self):
+        """Rebuilds the clusters and borders with tiles that changed since the previous call."""
+        if not self.changes:
+            return
+        size     = self.size
+        clusters = set()
+        borders  = set()
+        for index in self.changes:
+            x, y = self.grid.coords(index)
+            cx, cy = x // size, y // size
+            clusters.add((cx, cy))
+            # A tile on the edge of a cluster can open or close an entrance.
+            if x % size == size - 1 and cx + 1 < self.columns:
+                borders.add((0, cx, cy))
+            if x % size == 0 and cx > 0:
+                borders.add((0, cx - 1, cy))
+            if y % size == size - 1 and cy + 1 < self.rows:
+                borders.add((1, cx, cy))
+            if y % size == 0 and cy > 0:
+                borders.add((1, cx, cy - 1))
+        self.changes.clear()
+
+        for cluster in clusters:
+            self.build_local(cluster)
+        for border in borders:
+            self.build_border(border)
+            kind, cx, cy = border
+            # The entrances of the clusters on both sides changed.
+            clusters.add((cx, cy))
+            clusters.add((cx + 1, cy) if kind == 0 else (cx, cy + 1))
+        for cluster in clusters:
+            self.build_nodes(cluster)
+        self.rebuilt += len(clusters)
+
+    def distances(self, cluster, source):
+        """ 
+        Breadth first search inside a cluster from the grid index source, which
+        does not need to be passable. Returns the distances of the local
+        indices, -1 for the tiles that can not be reached.
+        """
+        local     = self.local[cluster]
+        stride    = self.local_stride(cluster)
+        distances = array('l', [-1]) * len(local)
+        start     = self.to_local(cluster, source)
+        distances[start] = 0
+        queue     = [start]
+        append    = queue.append
+        for node in queue:
+            distance = distances[node] + 1
+            for neighbour in (node - 1, node + 1, node - stride, node + stride):
+                if distances[neighbour] < 0 and local[neighbour]:
+                    distances[neighbour] = distance
+                    append(neighbour)
+        return distances
+
+    def segment(self, a, b):
+        """Returns the tiles after a up to b, where b is an entrance next to a or a tile of the same cluster."""
+        cluster = self.cluster_of(a)
+        if self.cluster_of(b) != cluster:
+            return [b]
+        stride    = self.local_stride(cluster)
+        distances = self.distances(cluster, a)
+        node      = self.to_local(cluster, b)
+        path      = []
+        # Walk back from b to a, down the distances.
+        while distances[node] > 0:
+            path.append(self.to_grid(cluster, node))
+            distance = distances[node] - 1
+            for neighbour in (node - 1, node + 1, node - stride, node + stride):
+                if distances[neighbour] == distance:
+                    node = neighbour
+                    break
+        path.reverse()
+        return path
+
+    def source_edges(self, source, target):
+        """Returns the entrances of the cluster of source, and target if it is in it, that source reaches inside the cluster."""
+        cluster   = self.cluster_of(source)
+        distances = self.distances(cluster, source)
+        nodes     = self.nodes[cluster] + ([target] if self.cluster_of(target) == cluster else [])
+        edges     = []
+        for node in nodes:
+            distance = distances[self.to_local(cluster, node)]
+            if distance >= 0:
+                edges.append((node, distance))
+        return edges
+
+    def search(self, start, target):
+        """ 
+        A* on the entrances from start to target, with the Manhattan distance
+        as heuristic. start and target are joined to the entrances of their
+        clusters first. Returns the nodes after start up to target, or None if
+        the target can not be reached, and the number of nodes expanded.
+        """
+        start_cluster  = self.cluster_of(start)
+        target_cluster = self.cluster_of(target)
+        if not self.local[target_cluster][self.to_local(target_cluster, target)]:
+            return None, 0
+        # Edges from start, and from the tiles next to it in other clusters if
+        # it is not passable (a tank on a pushed metal box): it can still
+        # drive off it, maybe across a border where there is no entrance.
+        extra_edges = {start: self.source_edges(start, target)}
+        if not self.passable[self.grid.tiles[start]]:
+            for offset in self.grid.offsets:
+                neighbour = start + offset
+                if self.passable[self.grid.tiles[neighbour]] and self.cluster_of(neighbour) != start_cluster:
+                    extra_edges[start].append((neighbour, 1))
+                    extra_edges[neighbour] = self.source_edges(neighbour, target)
+        distances    = self.distances(target_cluster, target)
+        target_edges = {}
+        for node in self.nodes[target_cluster]:
+            distance = distances[self.to_local(target_cluster, node)]
+            if distance >= 0:
+                target_edges[node] = distance
+
+        stride  = self.grid.stride
+        ty, tx  = divmod(target, stride)
+        costs   = {start: 0}
+        parents = {start: None}
+        queue   = [(0, 0, start)]
+        expanded = 0
+        while queue:
+            estimate, cost, node = heapq.heappop(queue)
+            cost = -cost
+            if cost > costs[node]:
+                continue # Outdated entry
+            if node == target:
+                path = []
+                while node != start:
+                    path.append(node)
+                    node = parents[node]
+                path.reverse()
+                return path, expanded
+            expanded += 1
+            neighbours = self.cluster_edges(self.cluster_of(node)).get(node, ())
+            if node in extra_edges or node in target_edges:
+                neighbours = list(neighbours) + extra_edges.get(node, [])
+                if node in target_edges:
+                    neighbours.append((target, target_edges[node]))
+            for neighbour, distance in neighbours:
+                new_cost = cost + distance
+                if new_cost < costs.get(neighbour, INFINITY):
+                    costs[neighbour] = new_cost
+                    parents[neighbour] = node
+                    y, x = divmod(neighbour, stride)
+                    # Among equal estimates, the node furthest from start is expanded first.
+                    heapq.heappush(queue, (new_cost + abs(x - tx) + abs(y - ty), -new_cost, neighbour))
+        return None, expanded
+
+
+class HierarchicalPlanner:
+    """ 
+    A hierarchical (HPA*) planner, shared by all ais. A path is first searched
+    on the graph of the entrances between clusters of tiles (see ClusterGraph),
+    which is much smaller than the grid, and is then refined to tiles one
+    cluster at a time, when the tank gets there. The refined tiles are kept
+    until the grid changes, so following a path is a lookup per tile. When
+    tiles change, only the clusters and borders that contain them are rebuilt.
+    """
+
+    CLUSTER_SIZE    = 16
+    ENTRANCE_WIDTH  = 6      # Runs of at least this many tiles get an entrance at both ends.
+    MAX_CACHED      = 100000 # Refined tiles kept before the cache is emptied.
+
+    def __init__(self, passability_grid, cluster_size=CLUSTER_SIZE):
+        self.grid         = passability_grid
+        self.cluster_size = cluster_size
+        self.graphs       = {}  # allow_metalbox -> ClusterGraph, built when first used
+        self.next_tiles   = {}  # (tile, target, allow_metalbox) -> next tile, None if there is no path
+        self.remaining    = {}  # (entrance, target, allow_metalbox) -> nodes of the path after the entrance
+        self.version      = passability_grid.version
+        self.searches     = 0   # Number of searches on the abstract graph.
+        self.expansions   = 0   # Number of abstract nodes expanded in all searches.
+
+    def graph(self, allow_metalbox):
+        """Returns the abstract graph for a passability table, up to date with the grid."""
+        graph = self.graphs.get(allow_metalbox)
+        if graph is None:
+            graph = ClusterGraph(self.grid, self.grid.passable(allow_metalbox), self.cluster_size, self.ENTRANCE_WIDTH)
+            self.graphs[allow_metalbox] = graph
+        else:
+            graph.update()
+        return graph
+
+    @property
+    def rebuilt(self):
+        """Number of clusters rebuilt after tiles changed."""
+        return sum(graph.rebuilt for graph in self.graphs.values())
+
+    def next_tile(self, start, target, allow_metalbox=False):
+        """ 
+        Returns the index of the next tile on a path from start to target, or
+        None if we are at the target or it can not be reached.
+        """
+        if self.version != self.grid.version or len(self.next_tiles) > self.MAX_CACHED:
+            self.next_tiles.clear()
+            self.remaining.clear()
+            self.version = self.grid.version
+        key = (start, target, allow_metalbox)
+        if key not in self.next_tiles:
+            if start == target or self.grid.tiles[start] == grid.ROCKBOX:
+                self.next_tiles[key] = None
+                return None
+            graph = self.graph(allow_metalbox)
+            nodes = self.remaining.pop(key, None)
+            if nodes is None:
+                nodes, expanded = graph.search(start, target)
+                self.searches += 1
+                self.expansions += expanded
+            self.refine(graph, start, target, allow_metalbox, nodes)
+        return self.next_tiles[key]
+
+    def refine(self, graph, start, target, allow_metalbox, nodes):
+        """Refines the path to the first node in nodes, the rest is refined when the tank gets there."""
+        if not nodes:
+            self.next_tiles[(start, target, allow_metalbox)] = None
+            return
+        previous = start
+        for tile in graph.segment(start, nodes[0]):
+            self.next_tiles[(previous, target, allow_metalbox)] = tile
+            previous = tile
+        if len(nodes) > 1:
+            self.remaining[(nodes[0], target, allow_metalbox)] = nodes[1:]
+
+    def path(self, start, target, allow_metalbox=False):
+        """Returns the list of indices after start up to target, an empty list if it can not be reached."""
+        path = []
+        node = self.next_tile(start, target, allow_metalbox)
+        while node is not None:
+            path.append(node)
+            node = self.next_tile(node, target, allow_metalbox)
+        return path
+
+
+class WeightedPlanner:
+    """ 
+    An A* planner shared by all ais, where driving into a tile costs the time
+    it takes (see TILE_COSTS). Wood boxes are shot away and metal boxes are
+    pushed, so one search finds the quickest path through them and
+    allow_metalbox is not needed. The heuristic is the Manhattan distance
+    times weight: above 1 fewer nodes are expanded, and the path costs at most
+    weight times the cheapest one. The paths are kept until the grid changes.
+    """
+
+    MAX_CACHED = 100000 # Tiles kept before the cache is emptied.
+
+    def __init__(self, passability_grid, weight=1.0):
+        self.grid       = passability_grid
+        self.weight     = weight
+        self.next_tiles = {}  # (tile, target) -> next tile, None if there is no path
+        self.version    = passability_grid.version
+        self.searches   = 0   # Number of searches.
+        self.expansions = 0   # Number of nodes expanded in all searches.
+
+    def search(self, start, target):
+        """Returns the list of indices after start up to target on the cheapest path, an empty list if there is none."""
+        tiles   = self.grid.tiles
+        stride  = self.grid.stride
+        weight  = self.weight
+        if TILE_COSTS[tiles[target]] is None:
+            return []
+        ty, tx  = divmod(target, stride)
+        costs   = {start: 0}
+        parents = {start: start}
+        queue   = [(0, 0, start)]
+        expanded = 0
+        self.searches += 1
+        while queue:
+            estimate, cost, node = heapq.heappop(queue)
+            cost = -cost
+            if cost > costs[node]:
+                continue # Outdated entry
+            if node == target:
+                self.expansions += expanded
+                path = []
+                while node != start:
+                    path.append(node)
+                    node = parents[node]
+                path.reverse()
+                return path
+            expanded += 1
+            for neighbour in (node - 1, node + 1, node - stride, node + stride):
+                step = TILE_COSTS[tiles[neighbour]]
+                if step is None:
+                    continue
+                new_cost = cost + step
+                if new_cost < costs.get(neighbour, INFINITY):
+                    costs[neighbour] = new_cost
+                    parents[neighbour] = node
+                    y, x = divmod(neighbour, stride)
+                    # Among equal estimates, the node furthest from start is expanded first.
+                    heapq.heappush(queue, (new_cost + weight * (abs(x - tx) + abs(y - ty)), -new_cost, neighbour))
+        self.expansions += expanded
+        return []
+
+    def next_tile(self, start, target, allow_metalbox=False):
+        """ 
+        Returns the index of the next tile on the quickest path from start to
+        target, or None if we are at the target or it can not be reached.
+        Metal boxes are always priced in, allow_metalbox is ignored.
+        """
+        if self.version != self.grid.version or len(self.next_tiles) > self.MAX_CACHED:
+            self.next_tiles.clear()
+            self.version = self.grid.version
+        key = (start, target)
+        if key not in self.next_tiles:
+            if start == target:
+                self.next_tiles[key] = None
+                return None
+            path = self.search(start, target)
+            if not path:
+                self.next_tiles[key] = None
+            previous = start
+            for node in path:
+                self.next_tiles[(previous, target)] = node
+                previous = node
+        return self.next_tiles[key]
+
+    def path(self, start, target, allow_metalbox=False):
+        """Returns the list of indices after start up to target, an empty list if it can not be reached."""
+        path = []
+        node = self.next_tile(start, target)
+        while node is not None:
+            path.append(node)
+            node = self.next_tile(node, target)
+        return path
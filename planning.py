@@ -0,0 +1,144 @@
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import grid
+import planners
+
+#----- Off-thread path planning -----#
+#   With --async-planning the paths of the ais are planned by a pool of worker
+#   processes instead of in the tick, so a long search on a large map does not
+#   hold up the game. Every request carries a snapshot of the passability grid
+#   and its version. The ais keep following their last path (or hold still
+#   when they have none) until the new one arrives, and a path planned on a
+#   version of the grid that is no longer the current one is dropped.
+
+#-- Planners that the workers can use, by name (see ctf.PLANNER). The
+#   incremental planner keeps its state between calls, so it is only run in the tick.
+WORKER_PLANNERS = {
+    'field':        grid.DistanceFields,
+    'hierarchical': planners.HierarchicalPlanner,
+    'weighted':     planners.WeightedPlanner,
+}
+
+# Identifies the grids of a process, so that workers never mix up two grids with the same version.
+sessions = itertools.count()
+
+# The grid and the planners of a worker, for the last snapshot it received.
+worker_state = threading.local()
+
+
+def plan(session, version, width, height, tiles, kind, start, target, allow_metalbox):
+    """Runs in a worker: returns the path from start to target on a snapshot of the grid."""
+    key = (session, version)
+    if getattr(worker_state, 'key', None) != key:
+        passability_grid = grid.PassabilityGrid(width, height)
+        passability_grid.tiles[:] = tiles
+        passability_grid.version = version
+        worker_state.key = key
+        worker_state.grid = passability_grid
+        worker_state.planners = {}
+    planner = worker_state.planners.get(kind)
+    if planner is None:
+        planner = WORKER_PLANNERS.get(kind, grid.DistanceFields)(worker_state.grid)
+        worker_state.planners[kind] = planner
+    return planner.path(start, target, allow_metalbox)
+
+
+class PlanningService:
+    """
+    Sends the planning requests of the ais to a pool of workers. The workers
+    are processes, or threads when processes can not be started (in the
+    worker processes of the match runner) or when threads is True.
+    """
+
+    def __init__(self, passability_grid, workers=1, threads=False):
+        self.grid     = passability_grid
+        self.session  = next(sessions)
+        # Daemon processes, like the workers of the match runner, can not have children.
+        if threads or multiprocessing.current_process().daemon:
+            self.executor = ThreadPoolExecutor(workers)
+        else:
+            self.executor = ProcessPoolExecutor(workers)
+        self.snapshot = None # (version, tiles) of the last snapshot of the grid
+        self.requests = 0    # Number of paths asked for.
+        self.dropped  = 0    # Number of paths dropped because the grid changed while they were planned.
+
+    def submit(self, kind, start, target, allow_metalbox):
+        """Asks for a path on the current version of the grid, returns a future."""
+        version = self.grid.version
+        if self.snapshot is None or self.snapshot[0] != version:
+            self.snapshot = (version, bytes(self.grid.tiles))
+        self.requests += 1
+        return self.executor.submit(plan, self.session, version, self.grid.width, self.grid.height,
+                                    self.snapshot[1], kind, start, target, allow_metalbox)
+
+    def close(self):
+        """Stops the workers after the paths they are planning, the other requests are forgotten."""
+        self.executor.shutdown(cancel_futures=True)
+
+
+class AsyncPlanner:
+    """
+    The planner of one ai when the paths are planned by a PlanningService.
+    next_tile never waits for a worker: while a path is planned, the ai
+    follows its previous path if it is on it, and gets PENDING otherwise.
+    """
+
+    def __init__(self, service, kind='field'):
+        self.service      = service
+        self.kind         = kind
+        self.next_tiles   = {}    # Tile -> next tile on the last path
+        self.plan_key     = None  # (target, allow_metalbox) of the last path
+        self.plan_version = None  # Version of the grid the last path was planned on
+        self.found        = False # Whether there was a path
+        self.future       = None
+        self.request      = None  # (target, allow_metalbox, version, start) of the future
+
+    def collect(self):
+        """Takes the path of the worker if it is ready, and drops it if the grid changed since it was asked for."""
+        if self.future is None or not self.future.done():
+            return
+        future = self.future
+        self.future = None
+        target, allow_metalbox, version, start = self.request
+        if future.cancelled() or version != self.service.grid.version:
+            self.service.dropped += 1
+            return
+        path = future.result()
+        self.plan_key     = (target, allow_metalbox)
+        self.plan_version = version
+        self.found        = bool(path)
+        self.next_tiles   = {}
+        previous = start
+        for node in path:
+            self.next_tiles[previous] = node
+            previous = node
+
+    def next_tile(self, start, target, allow_metalbox=False):
+        """
+        Returns the index of the next tile towards the target, None if we are
+        at the target or it can not be reached, or PENDING if the ai has to
+        wait for a path.
+        """
+        if start == target:
+            return None
+        self.collect()
+        key     = (target, allow_metalbox)
+        version = self.service.grid.version
+        if self.plan_key == key and self.plan_version == version:
+            if not self.found:
+                return None
+            if start in self.next_tiles:
+                return self.next_tiles[start]
+
+        # The path is for another target or an older grid, or we left it: plan
+        # again, unless the same path is already being planned.
+        if self.future is None or self.request[:3] != (target, allow_metalbox, version):
+            if self.future is not None:
+                self.future.cancel()
+            self.request = (target, allow_metalbox, version, start)
+            self.future  = self.service.submit(self.kind, start, target, allow_metalbox)
+        if self.plan_key == key and start in self.next_tiles:
+            return self.next_tiles[start]
+        return planners.PENDING
@@ -0,0 +1,96 @@
+import time
+from array import array
+
+#-- The phases of a tick, in the order they run in ctf.main_loop
+PHASES = ('events', 'ai', 'rules', 'update', 'step', 'post_update', 'render')
+
+
+class TickProfiler:
+    """ 
+    Times each phase of every tick. The durations of the last "size" ticks are
+    kept in a ring buffer, so the memory used does not grow with the length of
+    the game. Call start_tick() at the start of a tick, mark(phase) at the end
+    of every phase and end_tick() when the tick is over.
+    """
+
+    def __init__(self, size=4096, worst=5):
+        self.size       = size
+        self.worst      = worst  # Number of slowest ticks in the report.
+        self.durations  = {phase: array('d', [0.0]) * size for phase in PHASES}
+        self.totals     = array('d', [0.0]) * size
+        self.numbers    = array('l', [0]) * size  # Number of the tick stored at each position.
+        self.counts     = [None] * size            # Number of entities of each kind during the tick.
+        self.ticks      = 0
+        self.index      = 0
+        self.tick_start = 0
+        self.last       = 0
+
+    def start_tick(self):
+        self.index = self.ticks % self.size
+        for durations in self.durations.values():
+            durations[self.index] = 0.0
+        self.tick_start = self.last = time.perf_counter()
+
+    def mark(self, phase):
+        """Ends a phase, the time since the previous mark is added to it."""
+        now = time.perf_counter()
+        self.durations[phase][self.index] += now - self.last
+        self.last = now
+
+    def end_tick(self, entities=None):
+        """Ends the tick, the number of entities of each kind in the entity store is recorded with it."""
+        self.totals[self.index]  = self.last - self.tick_start
+        self.numbers[self.index] = self.ticks
+        self.counts[self.index]  = entities.counts() if entities is not None else None
+        self.ticks += 1
+
+    def recorded(self):
+        """Returns the positions in the ring buffer that hold a tick."""
+        return range(min(self.ticks, self.size))
+
+    def percentiles(self, values):
+        ordered = sorted(values)
+        def percentile(p):
+            return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000
+        return {'p50': percentile(50), 'p95': percentile(95), 'p99': percentile(99)}
+
+    def report(self):
+        """Returns the percentiles (in milliseconds) of every phase and the slowest ticks."""
+        positions = self.recorded()
+        if not positions:
+            return {'ticks': 0, 'phases': {}, 'worst': []}
+        phases = {phase: self.percentiles([self.durations[phase][i] for i in positions]) for phase in PHASES}
+        phases['total'] = self.percentiles([self.totals[i] for i in positions])
+        slowest = sorted(positions, key=lambda i: self.totals[i], reverse=True)[:self.worst]
+        worst = [{'tick':     self.numbers[i],
+                  'total':    self.totals[i] * 1000,
+                  'phases':   {phase: self.durations[phase][i] * 1000 for phase in PHASES},
+                  'entities': self.counts[i]} for i in slowest]
+        return {'ticks': self.ticks, 'phases': phases, 'worst': worst}
+
+    def print_report(self):
+        report = self.report()
+        print("____PROFILE____")
+        print('Ticks:', report['ticks'], '(last', len(self.recorded()), 'recorded)')
+        print('Phase'.ljust(12), 'p50 ms'.rjust(8), 'p95 ms'.rjust(8), 'p99 ms'.rjust(8))
+        for phase, values in report['phases'].items():
+            print(phase.ljust(12), *[('%.3f' % values[p]).rjust(8) for p in ('p50', 'p95', 'p99')])
+        print("____SLOWEST TICKS____")
+        for tick in report['worst']:
+            phases = ', '.join('%s %.3f' % (phase, duration) for phase, duration in tick['phases'].items())
+            print('Tick', tick['tick'], '%.3f ms:' % tick['total'], phases)
+            if tick['entities'] is not None:
+                print('    entities:', ', '.join('%s %d' % item for item in tick['entities'].items()))
+
+
+class NoProfiler:
+    """Used when profiling is off, every call does nothing."""
+
+    def start_tick(self):
+        pass
+
+    def mark(self, phase):
+        pass
+
+    def end_tick(self, entities=None):
+        pass
@@ -0,0 +1,217 @@
+import itertools
+import pygame
+import pymunk
+import gameobjects
+import images
+
+#-- Kinds of objects (see entities.py) that move all the time, they are looked
+#   at every frame. The boxes and the bases are cached until they move or change.
+MOVING_KINDS = ('tanks', 'bullets', 'flags', 'others')
+
+
+def box_key(box):
+    """What the drawing of a movable box depends on: it only has to be looked at again when this changes."""
+    body  = box.body
+    state = (body.position, body.angle)
+    if box.previous_state is None or box.previous_state == state:
+        return state
+    # The box moved in the last tick, it is drawn between its two states.
+    return state + box.previous_state + (gameobjects.render_alpha,)
+
+def draw_order(obj):
+    # The store gives increasing ids, so this is the order the objects were added in.
+    return obj.entity_id
+
+
+class DirtyRectRenderer:
+    """
+    Draws the game objects on the screen, but only redraws the parts of the
+    screen that changed since the previous frame. A part of the screen is
+    dirty if an object appeared, disappeared, moved or was rotated there.
+    Dirty areas are restored from the background, the objects covering them
+    are redrawn (clipped to the area) and only those areas are sent to the display.
+
+    The sprites of the boxes and the bases are kept between the frames and
+    indexed by the tiles they cover. They are only looked at again when boxes
+    or bases are added or removed. A movable box only starts to move when
+    something touches it, so with watch() the renderer follows the contacts
+    of the boxes and only looks at the boxes that are touched or still
+    sliding. A frame where nothing moves costs the tanks, the bullets and the flag.
+    """
+
+    def __init__(self, screen, background):
+        self.screen       = screen
+        self.background   = background
+        self.drawn        = {}    # Object -> sprite and rectangle drawn in the previous frame, for the moving objects.
+        self.cached       = {}    # Box or base -> sprite and rectangle it is drawn with.
+        self.buckets      = {}    # Tile -> boxes and bases whose rectangle overlaps it.
+        self.box_keys     = {}    # Movable box -> its box_key when its sprite was cached.
+        self.contacts     = {}    # Box -> number of shapes touching it.
+        self.awake        = set() # Movable boxes that are touched or moved in the last frame.
+        self.revision     = None  # Revisions of the boxes and bases in the store when they were cached.
+        self.full_redraw  = True  # The first frame always redraws the entire screen.
+        self.dirty_count  = 0     # Number of dirty rectangles in the last frame.
+
+    def invalidate(self):
+        """Forces the next frame to redraw the entire screen, call it when boxes were moved back at the start of a round."""
+        self.full_redraw = True
+        self.awake.update(self.box_keys)
+
+    def watch(self, space, collision_types):
+        """Follows the contacts of the boxes with these collision types in the physics engine."""
+        for collision_type in collision_types:
+            handler = space.add_wildcard_collision_handler(collision_type)
+            handler.begin    = self.contact_begin
+            handler.separate = self.contact_separate
+
+    def contact_begin(self, arbiter, space, data):
+        # The first shape is the one of the wildcard type.
+        box = arbiter.shapes[0].parent
+        if isinstance(box, gameobjects.Box):
+            self.contacts[box] = self.contacts.get(box, 0) + 1
+            self.awake.add(box)
+        return True
+
+    def contact_separate(self, arbiter, space, data):
+        box = arbiter.shapes[0].parent
+        count = self.contacts.get(box)
+        if count == 1:
+            del self.contacts[box]
+        elif count is not None:
+            self.contacts[box] = count - 1
+
+    def tiles(self, rect):
+        """The tiles a rectangle of the screen overlaps."""
+        size = images.TILE_SIZE
+        return itertools.product(range(rect.left // size, (rect.right - 1) // size + 1),
+                                 range(rect.top // size, (rect.bottom - 1) // size + 1))
+
+    def cache(self, obj, sprite, rect):
+        self.cached[obj] = (sprite, rect)
+        for tile in self.tiles(rect):
+            self.buckets.setdefault(tile, set()).add(obj)
+
+    def uncache(self, obj):
+        """Forgets the sprite of a box or a base, and returns the rectangle it covered."""
+        sprite, rect = self.cached.pop(obj)
+        for tile in self.tiles(rect):
+            bucket = self.buckets[tile]
+            bucket.discard(obj)
+            if not bucket:
+                del self.buckets[tile]
+        return rect
+
+    def update_cached(self, game_objects, dirty):
+        """Follows the boxes and bases that were added, removed or moved, and adds the areas that changed to dirty."""
+        revision = (game_objects.revisions['boxes'], game_objects.revisions['bases'])
+        if revision != self.revision:
+            self.revision = revision
+            current = set(game_objects.boxes())
+            current.update(game_objects.bases())
+            for obj in [obj for obj in self.cached if obj not in current]:
+                dirty.append(self.uncache(obj))
+                self.box_keys.pop(obj, None)
+                self.awake.discard(obj)
+            for obj in current:
+                if obj in self.cached:
+                    continue
+                sprite, rect = obj.screen_sprite()
+                self.cache(obj, sprite, rect)
+                dirty.append(rect)
+                if isinstance(obj, gameobjects.Box) and obj.body.body_type != pymunk.Body.STATIC:
+                    self.box_keys[obj] = box_key(obj)
+
+        for box in list(self.awake):
+            if box not in self.box_keys:
+                self.awake.discard(box)
+                continue
+            new_key = box_key(box)
+            if new_key == self.box_keys[box]:
+                # At rest and left alone, the box can not move until something touches it again.
+                if box not in self.contacts:
+                    self.awake.discard(box)
+                continue
+            self.box_keys[box] = new_key
+            sprite, rect = box.screen_sprite()
+            previous = self.cached[box]
+            if previous[0] is not sprite or previous[1] != rect:
+                dirty.append(self.uncache(box))
+                dirty.append(rect)
+                self.cache(box, sprite, rect)
+
+    def render(self, game_objects):
+        """
+        Draws the game objects (an entities.EntityStore), returns the list of
+        rectangles that were updated on the display.
+        """
+        # The debug drawing is not part of the sprites, so redraw everything.
+        if gameobjects.DEBUG:
+            self.drawn = {}
+            self.cached = {}
+            self.buckets = {}
+            self.box_keys = {}
+            self.awake = set()
+            self.revision = None
+            self.full_redraw = True
+            self.screen.blit(self.background, (0, 0))
+            for obj in game_objects:
+                obj.update_screen(self.screen)
+            pygame.display.flip()
+            return [self.screen.get_rect()]
+
+        dirty = []
+        self.update_cached(game_objects, dirty)
+
+        moving  = []
+        rects   = []
+        current = {}
+        for obj in itertools.chain.from_iterable(game_objects.of_kind(kind) for kind in MOVING_KINDS):
+            sprite, rect = obj.screen_sprite()
+            moving.append(obj)
+            rects.append(rect)
+            current[obj] = (sprite, rect)
+
+            previous = self.drawn.pop(obj, None)
+            if previous is None:
+                dirty.append(rect)
+            elif previous[0] is not sprite or previous[1] != rect:
+                dirty.append(previous[1])
+                dirty.append(rect)
+
+        # Objects that are left were removed since the previous frame (bullets, destroyed tanks...).
+        for sprite, rect in self.drawn.values():
+            dirty.append(rect)
+        self.drawn = current
+
+        if self.full_redraw:
+            self.full_redraw = False
+            self.screen.blit(self.background, (0, 0))
+            for obj in game_objects:
+                sprite, rect = self.cached.get(obj) or current[obj]
+                self.screen.blit(sprite, rect)
+            pygame.display.flip()
+            self.dirty_count = 1
+            return [self.screen.get_rect()]
+
+        screen_rect = self.screen.get_rect()
+        dirty = [rect.clip(screen_rect) for rect in dirty]
+        dirty = [rect for rect in dirty if rect.width > 0 and rect.height > 0]
+        for area in dirty:
+            # Restore the background, then redraw in order every object that overlaps the area.
+            covering = set()
+            for tile in self.tiles(area):
+                covering.update(self.buckets.get(tile, ()))
+            covering = [obj for obj in covering if self.cached[obj][1].colliderect(area)]
+            covering += [moving[i] for i in area.collidelistall(rects)]
+            covering.sort(key=draw_order)
+            self.screen.set_clip(area)
+            self.screen.blit(self.background, area, area)
+            for obj in covering:
+                sprite, rect = self.cached.get(obj) or current[obj]
+                self.screen.blit(sprite, rect)
+        self.screen.set_clip(None)
+
+        self.dirty_count = len(dirty)
+        if dirty:
+            pygame.display.update(dirty)
+        return dirty
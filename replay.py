@@ -0,0 +1,282 @@
+import os
+import sys
+import struct
+import zlib
+
+#----- Replays -----#
+#   A replay is the map and the inputs given to the tanks on every tick (by
+#   the players and the ai). Since the simulation is deterministic, playing the
+#   inputs back reproduces the match. Hashes of the game state are stored at
+#   regular intervals so that playback can detect when it desyncs.
+#
+#   Record:     python3 ctf.py --singleplayer --record match.ctfr
+#   Play back:  python3 replay.py match.ctfr                (full speed, no rendering)
+#               python3 replay.py match.ctfr --seek 1500    (render from tick 1500)
+
+MAGIC         = b'CTFR'
+VERSION       = 3
+HASH_INTERVAL = 50 # Ticks between two state hashes.
+# Magic, version, ticks, hash interval, tick rate, substeps, most bullets, numpy movement and update interval.
+HEADER        = struct.Struct('<4sBIHHBHBB')
+
+
+class DesyncError(Exception):
+    """Raised when the state of a played back match differs from the recording."""
+
+
+#-- Variable length integers, so that small numbers use one byte
+def write_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+def read_varint(data, offset):
+    """Returns the integer at offset and the offset after it."""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def state_hash(ctf):
+    """Returns a 32 bit hash of the positions, angles and velocities of all the game objects and of the score."""
+    values = []
+    for obj in ctf.entity_store:
+        if hasattr(obj, 'body'):
+            body = obj.body
+            values += [body.position[0], body.position[1], body.angle,
+                       body.velocity[0], body.velocity[1], body.angular_velocity]
+        else:
+            values += [obj.x, obj.y, obj.orientation]
+    values += [ctf.point_dict[player] for player in sorted(ctf.point_dict)]
+    return zlib.crc32(struct.pack('<%dd' % len(values), *values))
+
+
+class Replay:
+    """ 
+    The map, the inputs and the state hashes of a match. The inputs are kept
+    encoded, as for every tick with inputs: the ticks since the previous such
+    tick, the number of inputs and the inputs (slot * 8 + index in
+    gameobjects.Tank.INPUTS), all as varints.
+    """
+
+    def __init__(self, game_map, win_condition=None, hash_interval=HASH_INTERVAL, tick_rate=50, substeps=1,
+                 max_bullets=256, numpy_movement=False, update_interval=3):
+        self.map             = game_map
+        self.win_condition   = win_condition
+        self.hash_interval   = hash_interval
+        # The simulation depends on them, see ctf.TICK_RATE, ctf.UPDATE_INTERVAL,
+        # gameobjects.BulletPool and movement.use_numpy.
+        self.tick_rate       = tick_rate
+        self.substeps        = substeps
+        self.max_bullets     = max_bullets
+        self.numpy_movement  = numpy_movement
+        self.update_interval = update_interval
+        self.ticks           = 0
+        self.input_ticks     = 0  # Number of ticks with inputs.
+        self.last_input      = 0  # Last tick with inputs.
+        self.stream          = bytearray()
+        self.hashes          = {} # Tick -> state hash
+
+    def add_inputs(self, tick, codes):
+        """Adds the input codes given on a tick, ticks must be added in order."""
+        write_varint(self.stream, tick - self.last_input)
+        write_varint(self.stream, len(codes))
+        for code in codes:
+            write_varint(self.stream, code)
+        self.input_ticks += 1
+        self.last_input = tick
+
+    def inputs(self):
+        """Yields every tick with inputs and its inputs as a list of (slot, input name)."""
+        import gameobjects
+        names = gameobjects.Tank.INPUTS
+        stream = self.stream
+        offset = 0
+        tick = 0
+        for i in range(self.input_ticks):
+            delta, offset = read_varint(stream, offset)
+            count, offset = read_varint(stream, offset)
+            tick += delta
+            inputs = []
+            for j in range(count):
+                code, offset = read_varint(stream, offset)
+                inputs.append((code >> 3, names[code & 7]))
+            yield tick, inputs
+
+    def to_bytes(self):
+        game_map = self.map
+        body = bytearray()
+        body += struct.pack('<HHB', game_map.width, game_map.height, len(game_map.start_positions))
+        for x, y, angle in game_map.start_positions:
+            body += struct.pack('<ddd', x, y, angle)
+        body += struct.pack('<dd', *game_map.flag_position)
+        for y in range(game_map.height):
+            body += game_map.boxes.row(y)
+        condition = (self.win_condition or '').encode()
+        body += struct.pack('<B', len(condition)) + condition
+
+        write_varint(body, self.input_ticks)
+        write_varint(body, len(self.stream))
+        body += self.stream
+
+        write_varint(body, len(self.hashes))
+        for tick in sorted(self.hashes):
+            body += struct.pack('<I', self.hashes[tick])
+
+        header = HEADER.pack(MAGIC, VERSION, self.ticks, self.hash_interval, self.tick_rate, self.substeps,
+                             self.max_bullets, self.numpy_movement, self.update_interval)
+        return header + zlib.compress(bytes(body), 9)
+
+    @classmethod
+    def from_bytes(cls, data):
+        import maps
+        if data[:4] != MAGIC or len(data) < HEADER.size or data[4] != VERSION:
+            raise ValueError('Not a replay file of version %d' % VERSION)
+        (magic, version, ticks, hash_interval, tick_rate, substeps,
+         max_bullets, numpy_movement, update_interval) = HEADER.unpack_from(data)
+        body = zlib.decompress(data[HEADER.size:])
+
+        width, height, players = struct.unpack_from('<HHB', body)
+        offset = struct.calcsize('<HHB')
+        start_positions = []
+        for i in range(players):
+            start_positions.append(list(struct.unpack_from('<ddd', body, offset)))
+            offset += 24
+        flag_position = list(struct.unpack_from('<dd', body, offset))
+        offset += 16
+        boxes = maps.TileGrid(width, height)
+        for y in range(height):
+            boxes.set_row(y, body[offset:offset + width])
+            offset += width
+        length = body[offset]
+        condition = body[offset + 1:offset + 1 + length].decode() or None
+        offset += 1 + length
+
+        replay = cls(maps.Map(width, height, boxes, start_positions, flag_position), condition, hash_interval,
+                     tick_rate, substeps, max_bullets, bool(numpy_movement), update_interval)
+        replay.ticks = ticks
+        replay.input_ticks, offset = read_varint(body, offset)
+        length, offset = read_varint(body, offset)
+        replay.stream = bytearray(body[offset:offset + length])
+        offset += length
+
+        count, offset = read_varint(body, offset)
+        for i in range(count):
+            replay.hashes[(i + 1) * hash_interval] = struct.unpack_from('<I', body, offset)[0]
+            offset += 4
+        return replay
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            file.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as file:
+            return cls.from_bytes(file.read())
+
+
+class Recorder:
+    """ 
+    Records a match played by ctf.py: every input given to a tank (see
+    gameobjects.Tank.input_listener) and a state hash every hash_interval ticks.
+    """
+
+    def __init__(self, ctf, hash_interval=HASH_INTERVAL):
+        import gameobjects
+        import movement
+        self.ctf    = ctf
+        self.codes  = []
+        self.names  = {name: index for index, name in enumerate(gameobjects.Tank.INPUTS)}
+        self.replay = Replay(ctf.current_map, ctf.WIN_CONDITION, hash_interval, ctf.TICK_RATE, ctf.SUBSTEPS,
+                             gameobjects.bullet_pool.max_bullets, movement.numpy_backend, ctf.UPDATE_INTERVAL)
+        gameobjects.Tank.input_listener = self.on_input
+
+    def on_input(self, tank, name):
+        self.codes.append(tank.slot * 8 + self.names[name])
+
+    def end_tick(self):
+        """Call this after every tick."""
+        ticks = self.ctf.ticks
+        if self.codes:
+            self.replay.add_inputs(ticks, self.codes)
+            self.codes = []
+        self.replay.ticks = ticks
+        if ticks % self.replay.hash_interval == 0:
+            self.replay.hashes[ticks] = state_hash(self.ctf)
+
+    def save(self, path):
+        import gameobjects
+        gameobjects.Tank.input_listener = None
+        self.replay.save(path)
+
+
+def play(replay, seek=None):
+    """ 
+    Plays a replay back with ctf.py, as fast as possible and without rendering.
+    If seek is a tick, the game is rendered at the normal framerate from that
+    tick on. Raises DesyncError if a state hash differs from the recording.
+    Returns the number of ticks played.
+    """
+    import pygame
+    import ctf
+    import images
+    import gameobjects
+    import movement
+    ctf.HEADLESS = seek is None
+    images.set_metadata_only(seek is None)
+    # Nobody controls the tanks, they only get the recorded inputs.
+    ctf.AI_TYPES = ['none'] * len(replay.map.start_positions)
+    ctf.WIN_CONDITION = replay.win_condition
+    ctf.TICK_RATE = replay.tick_rate
+    ctf.SUBSTEPS = replay.substeps
+    ctf.UPDATE_INTERVAL = replay.update_interval
+    gameobjects.bullet_pool.max_bullets = replay.max_bullets
+    movement.use_numpy(replay.numpy_movement)
+    ctf.setup_map(replay.map)
+    ctf.start_game()
+
+    inputs = replay.inputs()
+    next_tick, next_inputs = next(inputs, (None, ()))
+    while ctf.ticks < replay.ticks:
+        if ctf.ticks + 1 == next_tick:
+            ctf.tick(inputs=next_inputs)
+            next_tick, next_inputs = next(inputs, (None, ()))
+        else:
+            ctf.tick()
+        expected = replay.hashes.get(ctf.ticks)
+        if expected is not None and expected != state_hash(ctf):
+            raise DesyncError('Replay desynced at tick %d' % ctf.ticks)
+
+        if seek is not None and ctf.ticks >= seek:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                    return ctf.ticks
+            ctf.screen_renderer.render(ctf.entity_store)
+            ctf.clock.tick(ctf.TICK_RATE)
+    return ctf.ticks
+
+
+if __name__ == '__main__':
+    import time
+    if len(sys.argv) < 2:
+        raise SystemExit('Usage: python3 replay.py REPLAY [--seek TICK]')
+    seek = None
+    if '--seek' in sys.argv:
+        seek = int(sys.argv[sys.argv.index('--seek') + 1])
+    else:
+        # Without rendering nothing needs a window or sounds.
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        os.environ['SDL_AUDIODRIVER'] = 'dummy'
+    replay = Replay.load(sys.argv[1])
+    start = time.perf_counter()
+    ticks = play(replay, seek)
+    seconds = time.perf_counter() - start
+    print('Played', ticks, 'ticks in', round(seconds, 3), 'seconds, no desync.')
@@ -0,0 +1,61 @@
+import gameobjects
+
+#----- World snapshots -----#
+#   Instead of rebuilding every object when a round is won, the state of the
+#   world at the start of the first round is captured once per map. A new
+#   round then only moves the objects back to their start, removes the bullets
+#   and recreates the boxes that were destroyed.
+
+
+class WorldSnapshot:
+    """The start of a round: where the boxes, the tanks and the flag are."""
+
+    def __init__(self, entities, space, passability_grid, game_map, flag):
+        """Captures the objects in the entity store, call this right after they are created."""
+        self.entities           = entities
+        self.space              = space
+        self.passability_grid   = passability_grid
+        self.map                = game_map
+        self.flag               = flag
+        # Box -> (tile x, tile y, box type). Rock boxes never move nor break.
+        self.boxes = {}
+        for box in entities.boxes():
+            if box.body.body_type == box.body.STATIC:
+                continue
+            x = int(box.body.position[0])
+            y = int(box.body.position[1])
+            self.boxes[box] = (x, y, game_map.boxAt(x, y))
+
+    def restore(self):
+        """Puts the world back as it was when the snapshot was taken."""
+        entities = self.entities
+        space = self.space
+
+        gameobjects.bullet_pool.release_all(entities)
+
+        # Tanks are recreated when they are destroyed, so they are reset by slot.
+        for slot, (x, y, orientation) in enumerate(self.map.start_positions):
+            entities.tank_at(slot).reset(x, y, orientation)
+
+        self.flag.x, self.flag.y = self.map.flag_position
+        self.flag.orientation = 0
+        self.flag.is_on_tank = False
+        self.flag.previous_state = None
+
+        moved = False
+        for box, (x, y, type) in list(self.boxes.items()):
+            if box in entities:
+                # Most boxes are never touched, leave them alone.
+                if box.body.position != (x + 0.5, y + 0.5) or box.body.angle != 0:
+                    box.reset(x + 0.5, y + 0.5, 0)
+                    moved = True
+                continue
+            # The box was destroyed, replace it by a new one.
+            del self.boxes[box]
+            box = gameobjects.get_box_with_type(x, y, type, space)
+            entities.add(box)
+            self.passability_grid.track(box, type)
+            self.boxes[box] = (x, y, type)
+        # Move the pushed boxes back to their tiles in the grid.
+        if moved:
+            self.passability_grid.update_boxes()
@@ -0,0 +1,55 @@
+import pymunk
+import images
+import entities
+import grid
+import gameobjects
+
+#----- Tests of the game objects -----#
+#   python3 -m pytest
+
+images.set_metadata_only()
+
+
+def test_bullet_pool_recycles_the_oldest_bullet():
+    pool     = gameobjects.BulletPool(max_bullets=256)
+    space    = pymunk.Space()
+    store    = entities.EntityStore()
+    # Nothing hits anything in an empty space, so every bullet keeps flying.
+    bullets  = [pool.acquire(1, 1, 0, space, store) for _ in range(300)]
+    assert None not in bullets
+    assert pool.allocated == 256 and pool.recycled == 44
+    assert len(store.bullets()) == 256 and len(space.bodies) == 256
+    # The bullets fired last are flying, the first 44 were fired again.
+    flying = list(store.bullets())
+    assert [bullet.entity_id for bullet in flying] == sorted(bullet.entity_id for bullet in flying)
+    assert set(flying) == set(bullets[-256:])
+
+    pool.release_all(store)
+    assert pool.stats()['live'] == 0 and len(pool.free) == 256 and not space.bodies
+
+def test_tank_can_shoot_when_the_pool_is_full(monkeypatch):
+    monkeypatch.setattr(gameobjects, 'bullet_pool', gameobjects.BulletPool(max_bullets=256))
+    space = pymunk.Space()
+    store = entities.EntityStore()
+    tank  = gameobjects.Tank(5, 5, 0, images.tanks[0], space)
+    store.add(tank, 0)
+    for shot in range(300):
+        tank.frame = gameobjects.Tank.SHOOT_COOLDOWN + 1
+        tank.shoot(space, store)
+        assert tank.frame == 0, shot
+    assert gameobjects.bullet_pool.recycled == 300 - 256
+
+def test_grid_follows_only_the_boxes_that_move():
+    space = pymunk.Space()
+    passability_grid = grid.PassabilityGrid(4, 1)
+    for x in range(4):
+        passability_grid.set_tile(x, 0, grid.GRASS)
+    boxes = [gameobjects.get_box_with_type(x, 0, grid.METALBOX, space) for x in range(3)]
+    for box in boxes:
+        passability_grid.track(box, grid.METALBOX)
+    passability_grid.follow_moves()
+    boxes[1].body.angle = 0.5
+    boxes[2].body.position = (3.5, 0.5)
+    passability_grid.update_boxes()
+    assert passability_grid.moved == {boxes[1], boxes[2]}
+    assert passability_grid.tile_at(3, 0) == grid.METALBOX and passability_grid.tile_at(2, 0) == grid.GRASS
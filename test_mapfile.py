@@ -0,0 +1,60 @@
+import json
+import pytest
+import maps
+import mapfile
+
+#----- Tests of the compiled maps -----#
+#   python3 -m pytest
+
+MAP_JSON = {'width': 3, 'height': 2, 'boxes': [[0, 1, 2], [3, 0, 0]],
+            'start_position': [[0.5, 0.5, 0], [2.5, 1.5, 180]], 'flag_position': [1.5, 1.5]}
+
+
+def tiles_of(game_map):
+    return [bytes(game_map.boxes.row(y)) for y in range(game_map.height)]
+
+def test_compiled_map_round_trip(tmp_path):
+    path = str(tmp_path / 'map1.ctfm')
+    mapfile.compile_map(maps.map1, path)
+    game_map = mapfile.load_compiled(path)
+    assert (game_map.width, game_map.height) == (maps.map1.width, maps.map1.height)
+    assert tiles_of(game_map) == tiles_of(maps.map1)
+    assert [list(position) for position in game_map.start_positions] == [list(position) for position in maps.map1.start_positions]
+    assert list(game_map.flag_position) == list(maps.map1.flag_position)
+
+def test_json_map_is_compiled_once(tmp_path, monkeypatch):
+    source = tmp_path / 'small.json'
+    source.write_text(json.dumps(MAP_JSON))
+    monkeypatch.setattr(mapfile, 'CACHE_DIR', str(tmp_path / 'cache'))
+    game_map = mapfile.load_map(str(source))
+    assert tiles_of(game_map) == [bytes([0, 1, 2]), bytes([3, 0, 0])]
+    assert mapfile.is_up_to_date(mapfile.cache_path(str(source)), str(source))
+
+@pytest.mark.parametrize('change', [{'boxes': 5}, {'start_position': None}, {'flag_position': 'ab'},
+                                    {'width': 'x'}, {'boxes': [[0, 1, 4], [3, 0, 0]]}, {'height': 3},
+                                    {'boxes': [[0, 1, 2.0], [3, 0, 0]]}, {'boxes': [[0, True, 2], [3, 0, 0]]},
+                                    {'start_position': [[0.5, 0.5, None], [2.5, 1.5, 180]]},
+                                    {'start_position': [[0.5, 0.5, '0'], [2.5, 1.5, 180]]},
+                                    {'flag_position': [1.5, None]}, {'width': True}])
+def test_invalid_json_map(tmp_path, change):
+    data = dict(MAP_JSON)
+    data.update(change)
+    source = tmp_path / 'bad.json'
+    source.write_text(json.dumps(data))
+    with pytest.raises(mapfile.MapError):
+        mapfile.compile_json(str(source), str(tmp_path / 'bad.ctfm'))
+    # Nothing is left behind, not even a temporary file.
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['bad.json']
+
+def test_corrupt_compiled_maps(tmp_path):
+    data = mapfile.to_bytes(maps.map0)
+    corrupt = {'empty':     b'',
+               'header':    data[:10],
+               'magic':     b'XXXX' + data[4:],
+               'truncated': data[:-1],
+               'tile':      data[:-1] + bytes([7])}
+    for name, content in corrupt.items():
+        path = tmp_path / (name + '.ctfm')
+        path.write_bytes(content)
+        with pytest.raises(mapfile.MapError):
+            mapfile.load_compiled(str(path))
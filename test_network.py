@@ -0,0 +1,96 @@
+import random
+import types
+import network
+
+#----- Tests of the network snapshots and packets -----#
+#   python3 -m pytest
+
+
+def random_state(rng):
+    """A state with tanks, bullets, the flag, moved boxes and scores."""
+    state = {}
+    for slot in range(6):
+        state[slot * 8 + network.TANK] = (rng.randint(0, 2000), rng.randint(0, 2000), rng.randrange(1024), rng.randint(0, 1))
+        state[slot * 8 + network.SCORE] = (rng.randint(0, 5),)
+    for entity_id in rng.sample(range(100, 400), rng.randint(0, 40)):
+        state[entity_id * 8 + network.BULLET] = (rng.randint(0, 2000), rng.randint(0, 2000), rng.randrange(1024))
+    state[network.FLAG] = (rng.randint(0, 2000), rng.randint(0, 2000), rng.randrange(1024))
+    for tile in rng.sample(range(1000), rng.randint(0, 10)):
+        state[tile * 8 + network.BOX] = rng.choice([(0, 0, 0, 1), (rng.randint(0, 2000), rng.randint(0, 2000), 0, 0)])
+    return state
+
+def snapshot(tick, state, base_tick=network.NO_TICK, baseline={}, last_seq=0):
+    packet = bytearray(network.SNAPSHOT_HEADER.pack(network.SNAPSHOT, tick, base_tick, last_seq))
+    network.encode_delta(packet, state, baseline)
+    return bytes(packet)
+
+def test_delta_round_trip():
+    rng = random.Random(0)
+    for _ in range(200):
+        baseline = random_state(rng)
+        state    = random_state(rng)
+        # Keep some entries the same, as between two ticks.
+        for key in rng.sample(list(baseline), len(baseline) // 2):
+            if key in state:
+                state[key] = baseline[key]
+        for base in (baseline, {}):
+            buffer = bytearray()
+            network.encode_delta(buffer, state, base)
+            assert network.decode_delta(bytes(buffer), 0, base) == state
+
+def test_unchanged_state_is_small():
+    state  = random_state(random.Random(1))
+    buffer = bytearray()
+    network.encode_delta(buffer, state, state)
+    assert bytes(buffer) == bytes([0, 0])
+
+def test_zigzag():
+    for value in range(-1000, 1000):
+        assert network.unzigzag(network.zigzag(value)) == value
+
+def input_packet(ack, first, codes):
+    packet = bytearray(network.INPUT_HEADER.pack(network.INPUT, ack, first))
+    network.write_varint(packet, len(codes))
+    return bytes(packet + bytes(codes))
+
+def test_server_drops_bad_input_packets():
+    server = network.Server(types.SimpleNamespace(ticks=10), 'map0', [0], network.NetworkConditions())
+    address = ('127.0.0.1', 1)
+    server.clients[address] = network.RemoteClient(address, 0)
+    unknown = len(network.gameobjects.Tank.INPUTS)
+    bad = [bytes([network.INPUT]),                                # Short
+           input_packet(5, 1, [0, 1])[:-1],                       # Truncated
+           input_packet(5, 1, [0, 1]) + b'\0',                    # Extra byte
+           input_packet(5, 1, [unknown]),                         # Unknown input
+           network.INPUT_HEADER.pack(network.INPUT, 5, 1) + b'\xff'] # Broken varint
+    for packet in bad:
+        server.datagram_received(packet, address)
+    client = server.clients[address]
+    assert client.inputs == [] and client.last_seq == 0
+
+    # An acknowledgement of a tick that was not sent is ignored.
+    server.datagram_received(input_packet(99, 1, [0, 6]), address)
+    assert client.ack is None
+    assert client.inputs == ['accelerate', 'shoot'] and client.last_seq == 2
+    # Inputs that were already applied are skipped.
+    server.datagram_received(input_packet(9, 2, [6, 2]), address)
+    assert client.ack == 9
+    assert client.inputs == ['accelerate', 'shoot', 'turn_left'] and client.last_seq == 3
+
+def test_client_rebuilds_the_state_and_forgets_old_ticks():
+    rng    = random.Random(2)
+    client = network.Client(network.NetworkConditions())
+    states = {}
+    for tick in range(1, 1000):
+        states[tick] = random_state(rng)
+        # Some snapshots are lost.
+        if rng.random() < 0.3:
+            continue
+        base_tick = client.latest if client.latest is not None else network.NO_TICK
+        baseline  = states.get(base_tick, {})
+        client.datagram_received(snapshot(tick, states[tick], base_tick, baseline), None)
+        assert client.state == states[tick]
+        assert len(client.states) <= network.HISTORY
+    # A snapshot too old to be a baseline anymore is ignored.
+    client.datagram_received(snapshot(1, states[1]), None)
+    assert 1 not in client.states
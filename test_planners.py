@@ -0,0 +1,104 @@
+import random
+import grid
+import planners
+
+#----- Tests of the path planners -----#
+#   python3 -m pytest
+
+
+def random_grid(rng, width, height):
+    """Returns a grid with random tiles, and the indices of the tiles that are not rock."""
+    passability_grid = grid.PassabilityGrid(width, height)
+    for y in range(height):
+        for x in range(width):
+            passability_grid.set_tile(x, y, rng.choice((grid.GRASS, grid.GRASS, grid.GRASS,
+                                                        grid.ROCKBOX, grid.WOODBOX, grid.METALBOX)))
+    free = [passability_grid.index(x, y) for y in range(height) for x in range(width)
+            if passability_grid.tile_at(x, y) != grid.ROCKBOX]
+    return passability_grid, free
+
+def test_incremental_planner_matches_bfs_when_tiles_change():
+    for seed in range(300):
+        rng = random.Random(seed)
+        passability_grid, free = random_grid(rng, rng.randint(3, 12), rng.randint(1, 12))
+        if len(free) < 2:
+            continue
+        start, target = rng.sample(free, 2)
+        planner = planners.IncrementalPlanner(passability_grid)
+        allow_metalbox = False
+        for step in range(30):
+            # Wood boxes are shot away and metal boxes pushed, rock never changes.
+            for _ in range(rng.randint(0, 3)):
+                passability_grid.set_index(rng.choice(free), rng.choice((grid.GRASS, grid.WOODBOX, grid.METALBOX)))
+            if rng.random() < 0.1:
+                allow_metalbox = not allow_metalbox
+            next_tile = planner.next_tile(start, target, allow_metalbox)
+            expected  = passability_grid.bfs(start, target, allow_metalbox) if start != target else []
+            assert (next_tile is None) == (not expected), (seed, step)
+            if expected:
+                assert planner.g[start] == len(expected), (seed, step)
+                # The next tile is one step closer to the target.
+                assert len(passability_grid.bfs(next_tile, target, allow_metalbox)) == len(expected) - 1, (seed, step)
+            if next_tile is not None and rng.random() < 0.7:
+                start = next_tile
+
+def test_distance_field_does_not_reach_a_blocked_target():
+    passability_grid = grid.PassabilityGrid(5, 1)
+    passability_grid.set_tile(4, 0, grid.METALBOX)
+    fields = grid.DistanceFields(passability_grid)
+    start  = passability_grid.index(0, 0)
+    target = passability_grid.index(4, 0)
+    assert passability_grid.bfs(start, target) == []
+    assert fields.next_tile(start, target) is None
+    assert fields.path(start, target) == []
+    assert fields.path(start, target, allow_metalbox=True) == passability_grid.bfs(start, target, True)
+
+def check_path(passability_grid, start, target, path, allow_metalbox):
+    """A path goes from neighbour to neighbour through passable tiles and ends at the target."""
+    passable = passability_grid.passable(allow_metalbox)
+    previous = start
+    for node in path:
+        assert node - previous in passability_grid.offsets
+        assert passable[passability_grid.tiles[node]]
+        previous = node
+    assert previous == target
+
+def test_planners_agree_with_bfs_on_random_grids():
+    for seed in range(100):
+        rng = random.Random(seed)
+        passability_grid, free = random_grid(rng, rng.randint(3, 20), rng.randint(1, 20))
+        if len(free) < 2:
+            continue
+        fields       = grid.DistanceFields(passability_grid)
+        incremental  = planners.IncrementalPlanner(passability_grid)
+        hierarchical = planners.HierarchicalPlanner(passability_grid, cluster_size=4)
+        weighted     = planners.WeightedPlanner(passability_grid)
+        for _ in range(10):
+            start, target = rng.sample(free, 2)
+            for allow_metalbox in (False, True):
+                expected = passability_grid.bfs(start, target, allow_metalbox)
+                path = fields.path(start, target, allow_metalbox)
+                assert len(path) == len(expected), seed
+                path = incremental_path(incremental, start, target, allow_metalbox)
+                assert len(path) == len(expected), seed
+                # HPA* paths are close to the shortest, not always the shortest.
+                path = hierarchical.path(start, target, allow_metalbox)
+                assert bool(path) == bool(expected) and len(path) >= len(expected), seed
+                if path:
+                    check_path(passability_grid, start, target, path, allow_metalbox)
+            # Metal boxes are priced in, so the weighted planner goes where bfs with metal boxes goes.
+            path = weighted.path(start, target)
+            assert bool(path) == bool(passability_grid.bfs(start, target, True)), seed
+            if path:
+                check_path(passability_grid, start, target, path, True)
+            # The tiles change between the searches.
+            for _ in range(rng.randint(0, 3)):
+                passability_grid.set_index(rng.choice(free), rng.choice((grid.GRASS, grid.WOODBOX, grid.METALBOX)))
+
+def incremental_path(planner, start, target, allow_metalbox):
+    path = []
+    node = planner.next_tile(start, target, allow_metalbox)
+    while node is not None:
+        path.append(node)
+        node = planner.next_tile(node, target, allow_metalbox)
+    return path
@@ -0,0 +1,87 @@
+import os
+import pytest
+import replay
+
+#----- Tests of the replays -----#
+#   python3 -m pytest
+
+# Nothing is drawn, ctf.py must not open a window.
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+
+def test_varint_round_trip():
+    buffer = bytearray()
+    values = [0, 1, 127, 128, 300, 16383, 16384, 2 ** 31, 2 ** 40]
+    for value in values:
+        replay.write_varint(buffer, value)
+    offset = 0
+    for value in values:
+        read, offset = replay.read_varint(buffer, offset)
+        assert read == value
+    assert offset == len(buffer)
+
+@pytest.fixture
+def ctf(monkeypatch):
+    """ctf.py set up for a headless match of ais, its settings are restored after the test."""
+    import ctf
+    import images
+    import gameobjects
+    import movement
+    import maps
+    for name in ('HEADLESS', 'AI_TYPES', 'WIN_CONDITION', 'TICK_RATE', 'SUBSTEPS', 'UPDATE_INTERVAL'):
+        monkeypatch.setattr(ctf, name, getattr(ctf, name))
+    monkeypatch.setattr(gameobjects.bullet_pool, 'max_bullets', gameobjects.bullet_pool.max_bullets)
+    monkeypatch.setattr(movement, 'numpy_backend', movement.numpy_backend)
+    monkeypatch.setattr(gameobjects.Tank, 'input_listener', None)
+    images.set_metadata_only()
+    ctf.HEADLESS = True
+    ctf.AI_TYPES = ['field'] * len(maps.map0.start_positions)
+    ctf.WIN_CONDITION = None
+    ctf.setup_map(maps.map0)
+    ctf.start_game()
+    return ctf
+
+def record(ctf, ticks):
+    recorder = replay.Recorder(ctf)
+    for _ in range(ticks):
+        ctf.tick()
+        recorder.end_tick()
+    return recorder
+
+def test_replay_plays_back_without_desync(ctf, tmp_path):
+    import gameobjects
+    ctf.UPDATE_INTERVAL = 2
+    gameobjects.bullet_pool.max_bullets = 20
+    recorder = record(ctf, 400)
+    assert recorder.replay.input_ticks > 0
+    path = str(tmp_path / 'match.ctfr')
+    recorder.save(path)
+
+    # Playback uses the settings of the recording, not the current ones.
+    ctf.UPDATE_INTERVAL = 3
+    gameobjects.bullet_pool.max_bullets = 256
+    loaded = replay.Replay.load(path)
+    assert (loaded.update_interval, loaded.max_bullets) == (2, 20)
+    assert list(loaded.inputs()) == list(recorder.replay.inputs())
+    assert replay.play(loaded) == 400
+    assert ctf.UPDATE_INTERVAL == 2 and gameobjects.bullet_pool.max_bullets == 20
+
+def test_changed_inputs_desync(ctf):
+    import gameobjects
+    recorded = record(ctf, 300).replay
+    # The same match where the first tank never gets its inputs.
+    changed = replay.Replay(recorded.map, recorded.win_condition, recorded.hash_interval, recorded.tick_rate,
+                            recorded.substeps, recorded.max_bullets, recorded.numpy_movement, recorded.update_interval)
+    changed.ticks  = recorded.ticks
+    changed.hashes = recorded.hashes
+    for tick, inputs in recorded.inputs():
+        codes = [slot * 8 + gameobjects.Tank.INPUTS.index(name) for slot, name in inputs if slot != 0]
+        if codes:
+            changed.add_inputs(tick, codes)
+    with pytest.raises(replay.DesyncError):
+        replay.play(changed)
+
+def test_not_a_replay():
+    with pytest.raises(ValueError):
+        replay.Replay.from_bytes(b'CTFM' + bytes(30))